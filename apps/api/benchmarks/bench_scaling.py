@@ -0,0 +1,58 @@
+"""Throughput scaling of the API with the number of gunicorn workers.
+
+Runs the WebSocket load test once per worker count, with the offered load,
+the client processes and the fake upstream workers scaled along, and every
+token sent in its own frame so that the workers are CPU bound. Reports the
+throughput of each run, its speedup over a single worker and the scaling
+efficiency (speedup divided by workers, 1.0 being linear).
+
+The clients and the upstream need cores too: scaling is only measured
+faithfully up to about a third of the cores of the machine.
+
+Usage:
+    python -m benchmarks.bench_scaling [--worker-counts 1,2,4]
+        [--connections-per-worker 64] [load test options]
+"""
+import asyncio
+import json
+import os
+
+from benchmarks.load_test import build_parser, load
+
+
+def main() -> None:
+    parser = build_parser(__doc__.splitlines()[0])
+    parser.add_argument("--worker-counts", default="1,2,4",
+                        help="comma-separated numbers of workers to measure")
+    parser.add_argument("--connections-per-worker", type=int, default=64)
+    parser.add_argument("--json", action="store_true", help="print the full reports as JSON")
+    parser.set_defaults(requests=3, tokens=200, tokens_per_second=2000.0, ttft_ms=10.0,
+                        ttft_sigma=0.0, coalesce_window_ms=0)
+    args = parser.parse_args()
+
+    worker_counts = [int(count) for count in args.worker_counts.split(",")]
+    if 3 * max(worker_counts) > (os.cpu_count() or 1):
+        print(f"Warning: {os.cpu_count()} cores is too few to measure {max(worker_counts)} workers faithfully")
+
+    reports = []
+    for workers in worker_counts:
+        args.workers = workers
+        args.client_processes = workers
+        args.upstream_workers = workers
+        args.connections = args.connections_per_worker * workers
+        reports.append(asyncio.run(load(args)))
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    base = reports[0]["tokens_per_second"] / worker_counts[0]
+    print(f"{'workers':>7} {'req/s':>9} {'tokens/s':>10} {'speedup':>8} {'efficiency':>10} {'failed':>7}")
+    for workers, report in zip(worker_counts, reports):
+        speedup = report["tokens_per_second"] / base if base else 0.0
+        print(
+            f"{workers:>7} {report['requests_per_second']:>9.1f} {report['tokens_per_second']:>10.1f}"
+            f" {speedup:>8.2f} {speedup / workers:>10.2f} {report['failed'] + report['broken_connections']:>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
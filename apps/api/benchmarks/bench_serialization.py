@@ -0,0 +1,73 @@
+"""Microbenchmark for the StreamChunk fast path.
+
+Compares the per-chunk cost of the original send path (build a StreamChunk,
+``model_dump()`` it, then ``json.dumps`` it the way starlette's ``send_json``
+does) with the specialised encoder, after checking both produce the same bytes.
+
+Usage:
+    python -m benchmarks.bench_serialization [--iterations N]
+"""
+import argparse
+import json
+import timeit
+
+from src.models.chat import ErrorResponse, StreamChunk
+from src.utils.serialization import encode_error_response, encode_stream_chunk
+
+REQUEST_ID = "3f2b8c1e-6d4a-4a4e-9d7b-1c2e3f4a5b6c"
+DELTAS = [" the", " quick", " brown", " fox", "é", " 🚀", ' "quoted"', "\n"]
+METRICS = {"responseTime": 812, "length": 1024, "tokens": 240, "status": "completed"}
+
+
+def model_path(content: str, finished: bool = False, metrics=None) -> str:
+    """Encode a chunk the way the handler used to."""
+    return json.dumps(
+        StreamChunk(
+            request_id=REQUEST_ID, content=content, finished=finished, metrics=metrics
+        ).model_dump(),
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+
+
+def check_identical() -> None:
+    """Fail loudly if the fast path ever differs from the model path."""
+    for content in DELTAS + [""]:
+        for finished in (False, True):
+            assert encode_stream_chunk(REQUEST_ID, content, finished) == model_path(content, finished)
+    assert encode_stream_chunk(REQUEST_ID, "", True, METRICS) == model_path("", True, METRICS)
+    expected_error = json.dumps(
+        ErrorResponse(request_id=REQUEST_ID, error="boom").model_dump(),
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    assert encode_error_response(REQUEST_ID, "boom") == expected_error
+
+
+def per_chunk_ns(func, iterations: int) -> float:
+    """Return the best observed cost of encoding one chunk, in nanoseconds."""
+    def run():
+        for content in DELTAS:
+            func(content)
+
+    best = min(timeit.repeat(run, number=iterations, repeat=5))
+    return best / (iterations * len(DELTAS)) * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    check_identical()
+    print("Output: byte-for-byte identical")
+
+    baseline = per_chunk_ns(model_path, args.iterations)
+    fast = per_chunk_ns(lambda content: encode_stream_chunk(REQUEST_ID, content, False), args.iterations)
+    print(f"StreamChunk + model_dump + json.dumps: {baseline:8.0f} ns/chunk")
+    print(f"encode_stream_chunk:                   {fast:8.0f} ns/chunk")
+    print(f"Speedup:                               {baseline / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Cold start of the API, from spawning the process to serving a first completion.
+
+Measures, over several fresh processes:
+
+- how long ``import src.main`` takes on its own
+- how long a uvicorn worker takes to answer ``/health/live`` (the port is
+  bound) and ``/health/ready`` (the connection pools are warm)
+- the time to first token of the first completion sent once it is ready
+
+The API runs against the fake upstream, so the warmup only saves a local
+handshake here; against a remote provider it also saves the TLS handshake.
+Pass ``--no-warmup`` to measure a first request on cold connection pools.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 5] [--no-warmup] [--json]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.load_test import free_port, run_connections, server_command, server_environment, wait_until_up
+
+IMPORT_TIMER = "import time; started = time.perf_counter(); import src.main; print(time.perf_counter() - started)"
+
+# Polling interval of the health checks, small enough not to hide the startup time
+POLL_INTERVAL = 0.005
+
+
+def import_seconds(environment: Dict[str, str]) -> float:
+    """Import the application in a fresh interpreter and return how long it took."""
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_TIMER], env=environment, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+async def start_once(environment: Dict[str, str]) -> Dict[str, float]:
+    """Start a worker, wait for it to be live then ready and time its first completion."""
+    port = free_port()
+    started = time.perf_counter()
+    api = subprocess.Popen(server_command(port, None), env=environment)
+    try:
+        await wait_until_up(f"http://127.0.0.1:{port}/health/live", api, interval=POLL_INTERVAL)
+        live = time.perf_counter() - started
+        await wait_until_up(f"http://127.0.0.1:{port}/health/ready", api, interval=POLL_INTERVAL)
+        ready = time.perf_counter() - started
+        results = await run_connections(f"ws://127.0.0.1:{port}/api/v1/ws", 1, 1, "Hello")
+    finally:
+        api.terminate()
+        api.wait(timeout=30)
+    if not results.first_tokens:
+        raise RuntimeError("The first completion failed")
+    return {"live_s": live, "ready_s": ready, "first_token_s": results.first_tokens[0]}
+
+
+def median_ms(runs: List[Dict[str, float]], name: str) -> float:
+    return round(statistics.median(run[name] for run in runs) * 1000, 1)
+
+
+async def bench(args: argparse.Namespace) -> dict:
+    """Run the startup benchmark and return its report."""
+    upstream_port = free_port()
+    upstream = subprocess.Popen([sys.executable, "-m", "benchmarks.fake_openai", "--port", str(upstream_port)])
+    environment = server_environment(upstream_port, connections=1)
+    environment["OPENAI_WARMUP_ON_STARTUP"] = str(args.warmup)
+    try:
+        await wait_until_up(f"http://127.0.0.1:{upstream_port}/v1/models", upstream)
+        imports = [import_seconds(environment) for _ in range(args.runs)]
+        runs = [await start_once(environment) for _ in range(args.runs)]
+    finally:
+        upstream.terminate()
+        upstream.wait(timeout=30)
+
+    return {
+        "runs": args.runs,
+        "warmup": args.warmup,
+        "import_ms": round(statistics.median(imports) * 1000, 1),
+        "live_ms": median_ms(runs, "live_s"),
+        "ready_ms": median_ms(runs, "ready_s"),
+        "first_token_ms": median_ms(runs, "first_token_s"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes measured, the median is reported")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="leave the connection pools cold until the first request")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(bench(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"median of {report['runs']} runs, warmup {'on' if report['warmup'] else 'off'}")
+    print(f"{'import src.main':<24} {report['import_ms']:>8.1f} ms")
+    print(f"{'spawn to /health/live':<24} {report['live_ms']:>8.1f} ms")
+    print(f"{'spawn to /health/ready':<24} {report['ready_ms']:>8.1f} ms")
+    print(f"{'first token when ready':<24} {report['first_token_ms']:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""A local OpenAI-compatible streaming server for load tests.
+
+Serves ``POST /v1/chat/completions`` as server-sent events the way the
+OpenAI API streams them, so the API can be loaded without spending tokens
+or measuring the upstream's variance instead of our own. The first token
+waits a log-normally distributed delay around a median, later tokens come
+at a fixed rate, and a share of the requests can be made to fail, either
+before the stream starts (429 or 500) or by dropping the stream midway.
+
+Usage:
+    python -m benchmarks.fake_openai [--port 8090] [--tokens-per-second 50]
+        [--ttft-ms 300] [--ttft-sigma 0.5] [--tokens 200]
+        [--error-rate 0] [--drop-rate 0] [--seed N] [--workers 1]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+# Environment variable passing the configuration to worker processes
+CONFIG_VARIABLE = "FAKE_OPENAI_CONFIG"
+
+# Words the fake completions are made of, one per token
+WORDS = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit")
+
+
+@dataclass
+class FakeUpstreamConfig:
+    """How the fake upstream behaves."""
+    tokens_per_second: float = 50.0
+    ttft_ms: float = 300.0
+    ttft_sigma: float = 0.5
+    tokens: int = 200
+    error_rate: float = 0.0
+    drop_rate: float = 0.0
+    seed: Optional[int] = None
+
+    def first_token_delay(self, rng: random.Random) -> float:
+        """Draw the delay before the first token, in seconds."""
+        if self.ttft_sigma <= 0:
+            return self.ttft_ms / 1000
+        return self.ttft_ms / 1000 * math.exp(rng.gauss(0, self.ttft_sigma))
+
+
+def _chunk(completion_id: str, model: str, created: int, **fields) -> str:
+    """Encode one server-sent event of a chat completion stream."""
+    body = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [],
+    }
+    body.update(fields)
+    return f"data: {json.dumps(body, separators=(',', ':'))}\n\n"
+
+
+def build_app(config: FakeUpstreamConfig) -> Starlette:
+    """Build the fake upstream application.
+
+    Args:
+        config: How the upstream behaves
+
+    Returns:
+        An ASGI application serving the OpenAI routes the API uses
+    """
+    rng = random.Random(config.seed)
+
+    async def models(request: Request) -> Response:
+        # The API lists the models to warm its connection pool up
+        return JSONResponse({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+
+    async def chat_completions(request: Request) -> Response:
+        payload = await request.json()
+        if rng.random() < config.error_rate:
+            if rng.random() < 0.5:
+                return JSONResponse(
+                    {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                    status_code=429,
+                    headers={"retry-after": "0.1"},
+                )
+            return JSONResponse(
+                {"error": {"message": "Injected failure", "type": "server_error"}}, status_code=500
+            )
+
+        model = payload.get("model", "gpt-4o-mini")
+        tokens = min(config.tokens, payload.get("max_tokens") or config.tokens)
+        prompt_tokens = sum(
+            len(str(message.get("content", "")).split()) for message in payload.get("messages", [])
+        )
+        include_usage = (payload.get("stream_options") or {}).get("include_usage", False)
+        drop_at = rng.randrange(tokens) if tokens and rng.random() < config.drop_rate else None
+        first_token_delay = config.first_token_delay(rng)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": tokens,
+            "total_tokens": prompt_tokens + tokens,
+        }
+
+        if not payload.get("stream"):
+            await asyncio.sleep(first_token_delay + tokens / config.tokens_per_second)
+            content = " ".join(WORDS[index % len(WORDS)] for index in range(tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        async def events() -> AsyncIterator[str]:
+            await asyncio.sleep(first_token_delay)
+            # Tokens are paced against the start so that sleep overshoot does not add up
+            started = time.monotonic()
+            for index in range(tokens):
+                if index == drop_at:
+                    raise ConnectionResetError("Injected stream drop")
+                delay = started + index / config.tokens_per_second - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                content = WORDS[index % len(WORDS)] if index == 0 else " " + WORDS[index % len(WORDS)]
+                yield _chunk(completion_id, model, created, choices=[
+                    {"index": 0, "delta": {"content": content}, "finish_reason": None}
+                ])
+            yield _chunk(completion_id, model, created, choices=[
+                {"index": 0, "delta": {}, "finish_reason": "stop"}
+            ])
+            if include_usage:
+                yield _chunk(completion_id, model, created, usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[
+        Route("/v1/models", models, methods=["GET"]),
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+    ])
+
+
+def app_from_environment() -> Starlette:
+    """Build the application in a worker process, from the configuration in the environment."""
+    return build_app(FakeUpstreamConfig(**json.loads(os.environ[CONFIG_VARIABLE])))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of the fake upstream to a parser."""
+    defaults = FakeUpstreamConfig()
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second)
+    parser.add_argument("--ttft-ms", type=float, default=defaults.ttft_ms,
+                        help="median delay before the first token")
+    parser.add_argument("--ttft-sigma", type=float, default=defaults.ttft_sigma,
+                        help="log-normal spread of the first token delay, 0 for a fixed delay")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="tokens per completion")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate,
+                        help="share of requests answered with a 429 or 500")
+    parser.add_argument("--drop-rate", type=float, default=defaults.drop_rate,
+                        help="share of streams dropped before their end")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeUpstreamConfig:
+    """Build the upstream configuration from parsed options."""
+    return FakeUpstreamConfig(
+        tokens_per_second=args.tokens_per_second,
+        ttft_ms=args.ttft_ms,
+        ttft_sigma=args.ttft_sigma,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes serving the upstream, so it is not the bottleneck")
+    add_arguments(parser)
+    args = parser.parse_args()
+    config = config_from_args(args)
+    if args.workers > 1:
+        os.environ[CONFIG_VARIABLE] = json.dumps(asdict(config))
+        uvicorn.run(
+            "benchmarks.fake_openai:app_from_environment",
+            factory=True,
+            workers=args.workers,
+            host=args.host,
+            port=args.port,
+            log_level="warning",
+        )
+    else:
+        uvicorn.run(build_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
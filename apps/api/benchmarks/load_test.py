@@ -0,0 +1,426 @@
+"""WebSocket load test of the API against the fake OpenAI upstream.
+
+Starts ``benchmarks.fake_openai`` and the real ``src.main:application`` under
+uvicorn, pointed at each other through ``OPENAI_BASE_URL``, then opens N
+WebSockets that each stream a number of completions back to back. Reports
+request and token throughput, time to first token and inter-token latency
+percentiles as seen by the clients (between frames, so coalesced deltas count
+as one), and the CPU time and resident memory the API process spent per
+connection (read from /proc, so Linux only).
+
+With ``--workers N`` the API runs under gunicorn with N workers sharing
+their state through SQLite, as in production, and ``--client-processes``
+spreads the clients over several processes so that they are not the
+bottleneck. CPU and memory then cover the master and all its workers.
+
+Results can be saved as a named baseline in ``benchmarks/baselines/`` and
+later runs are compared against it: a metric that got worse by more than the
+tolerance is reported as a regression and the run exits with status 1.
+Baselines are only comparable on the same machine and options.
+
+Usage:
+    python -m benchmarks.load_test [--connections 50] [--requests 5]
+        [--workers N] [--client-processes N] [--upstream-workers N]
+        [--coalesce-window-ms MS] [--baseline NAME] [--save-baseline] [--tolerance 0.15]
+        [fake upstream options, see benchmarks.fake_openai]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import httpx
+from websockets.asyncio.client import connect
+
+from benchmarks.fake_openai import add_arguments
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+
+# Compared metrics, and whether a higher value is better
+TRACKED = {
+    "requests_per_second": True,
+    "tokens_per_second": True,
+    "ttft_p50_ms": False,
+    "ttft_p95_ms": False,
+    "ttft_p99_ms": False,
+    "inter_token_p50_ms": False,
+    "inter_token_p95_ms": False,
+    "inter_token_p99_ms": False,
+    "cpu_ms_per_connection": False,
+    "rss_kib_per_connection": False,
+}
+
+
+def percentile(values: Sequence[float], fraction: float) -> Optional[float]:
+    """Return a nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def free_port() -> int:
+    """Return a local TCP port nobody listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree(pid: int) -> List[int]:
+    """Return a process and all of its descendants."""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                parent = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+def cpu_seconds(pid: int) -> float:
+    """Return the user and system CPU time a process and its descendants used so far."""
+    total = 0.0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as stat:
+                # The command name may contain spaces, so fields are counted after it
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total
+
+
+def rss_kib(pid: int) -> int:
+    """Return the resident memory of a process and its descendants in KiB."""
+    total = 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class LoadResults:
+    """Timings collected by the clients."""
+
+    def __init__(self):
+        self.first_tokens: List[float] = []
+        self.gaps: List[float] = []
+        self.completed = 0
+        self.failed = 0
+        self.tokens = 0
+        self.broken = 0
+
+    def merge(self, other: "LoadResults") -> None:
+        """Add the timings collected by another client process."""
+        self.first_tokens += other.first_tokens
+        self.gaps += other.gaps
+        self.completed += other.completed
+        self.failed += other.failed
+        self.tokens += other.tokens
+        self.broken += other.broken
+
+
+async def run_connection(url: str, requests: int, results: LoadResults, prompt: str) -> None:
+    """Stream completions one after the other over one WebSocket."""
+    async with connect(url, max_size=None) as websocket:
+        for _ in range(requests):
+            request_id = str(uuid.uuid4())
+            sent_at = time.perf_counter()
+            await websocket.send(json.dumps({
+                "request_id": request_id,
+                "messages": [{"role": "user", "content": prompt}],
+            }))
+            last = None
+            while True:
+                frame = json.loads(await websocket.recv())
+                if frame.get("request_id") != request_id:
+                    continue
+                now = time.perf_counter()
+                if "error" in frame:
+                    results.failed += 1
+                    break
+                if frame["content"]:
+                    if last is None:
+                        results.first_tokens.append(now - sent_at)
+                    else:
+                        results.gaps.append(now - last)
+                    last = now
+                if frame["finished"]:
+                    metrics = frame.get("metrics") or {}
+                    results.tokens += metrics.get("completionTokens", metrics.get("tokens", 0))
+                    results.completed += 1
+                    break
+
+
+async def run_connections(url: str, connections: int, requests: int, prompt: str) -> LoadResults:
+    """Run connections concurrently and collect their timings."""
+    results = LoadResults()
+    outcomes = await asyncio.gather(*(
+        run_connection(url, requests, results, prompt) for _ in range(connections)
+    ), return_exceptions=True)
+    results.broken = sum(isinstance(outcome, BaseException) for outcome in outcomes)
+    return results
+
+
+def drive(url: str, connections: int, requests: int, prompt: str) -> LoadResults:
+    """Run connections in a client process of their own."""
+    return asyncio.run(run_connections(url, connections, requests, prompt))
+
+
+def server_environment(
+    upstream_port: int, connections: int, coalesce_window_ms: Optional[int] = None
+) -> Dict[str, str]:
+    """Return the environment of the API, lifting limits the load would hit."""
+    environment = dict(os.environ)
+    for name, value in (
+        ("API_NAME", "Singularity API"),
+        ("API_VERSION", "load-test"),
+        ("API_DESCRIPTION", "Load test"),
+        ("OPENAI_API_KEY", "load-test"),
+    ):
+        environment.setdefault(name, value)
+    environment.update({
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "LOGGING_LEVEL": "WARNING",
+        "OPENAI_MAX_CONNECTIONS": str(max(100, connections)),
+        "OPENAI_MAX_KEEPALIVE_CONNECTIONS": str(max(20, connections)),
+        # Every client shares one address, so the per-client limits are lifted
+        "ADMISSION_REQUESTS_PER_SECOND": "1000000",
+        "ADMISSION_REQUEST_BURST": "1000000",
+        "ADMISSION_TOKENS_PER_MINUTE": "1000000000",
+        "ADMISSION_MAX_CONCURRENT": str(max(64, connections)),
+        "COMPLETION_CACHE_ENABLED": "False",
+        "CONVERSATION_STORE_PATH": ":memory:",
+    })
+    if coalesce_window_ms is not None:
+        environment["STREAM_COALESCE_WINDOW_MS"] = str(coalesce_window_ms)
+    return environment
+
+
+async def wait_until_up(
+    url: str, process: subprocess.Popen, timeout: float = 30.0, interval: float = 0.1
+) -> None:
+    """Poll an HTTP URL until it answers 200 or the process exits."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args} exited with status {process.returncode}")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(interval)
+    raise RuntimeError(f"{url} did not answer within {timeout:g}s")
+
+
+def server_command(port: int, workers: Optional[int]) -> List[str]:
+    """Return the command serving the API, under gunicorn when workers are given."""
+    if workers:
+        return [
+            sys.executable, "-m", "gunicorn", "src.main:application",
+            "--config", "gunicorn.conf.py",
+            "--bind", f"127.0.0.1:{port}", "--workers", str(workers),
+            "--log-level", "warning",
+        ]
+    return [
+        sys.executable, "-m", "uvicorn", "src.main:application",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--ws", "websockets", "--log-level", "warning",
+    ]
+
+
+async def load(args: argparse.Namespace) -> dict:
+    """Run the load test and return its report."""
+    upstream_args = upstream_arguments(args)
+    upstream_port, api_port = free_port(), free_port()
+    upstream = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_openai", "--port", str(upstream_port)] + upstream_args
+    )
+    state_directory = tempfile.TemporaryDirectory()
+    environment = server_environment(upstream_port, args.connections, args.coalesce_window_ms)
+    if args.workers:
+        environment["SHARED_STATE_BACKEND"] = "sqlite"
+        environment["SHARED_STATE_PATH"] = os.path.join(state_directory.name, "shared_state.db")
+    api = subprocess.Popen(server_command(api_port, args.workers), env=environment)
+    try:
+        await wait_until_up(f"http://127.0.0.1:{upstream_port}/v1/models", upstream)
+        await wait_until_up(f"http://127.0.0.1:{api_port}/health/ready", api)
+        # Let every worker finish starting up before measuring
+        await asyncio.sleep(1.0 if args.workers else 0)
+
+        idle_rss = rss_kib(api.pid)
+        peak_rss = idle_rss
+        cpu_before = cpu_seconds(api.pid)
+        url = f"ws://127.0.0.1:{api_port}/api/v1/ws"
+        prompt = " ".join(["word"] * args.prompt_words)
+        processes = max(1, min(args.client_processes, args.connections))
+        shares = [args.connections // processes + (index < args.connections % processes)
+                  for index in range(processes)]
+
+        with ProcessPoolExecutor(processes) if processes > 1 else nullcontext() as pool:
+            started = time.perf_counter()
+            if pool is None:
+                clients = asyncio.ensure_future(run_connections(url, args.connections, args.requests, prompt))
+                batches = [clients]
+            else:
+                loop = asyncio.get_running_loop()
+                batches = [
+                    loop.run_in_executor(pool, drive, url, share, args.requests, prompt) for share in shares
+                ]
+                clients = asyncio.gather(*batches)
+            while not clients.done():
+                peak_rss = max(peak_rss, rss_kib(api.pid))
+                await asyncio.wait((clients,), timeout=0.1)
+            elapsed = time.perf_counter() - started
+        cpu_used = cpu_seconds(api.pid) - cpu_before
+        results = LoadResults()
+        for batch in batches:
+            results.merge(batch.result())
+    finally:
+        for process in (api, upstream):
+            process.terminate()
+        for process in (api, upstream):
+            process.wait(timeout=30)
+        state_directory.cleanup()
+
+    def milliseconds(values: List[float], fraction: float) -> Optional[float]:
+        value = percentile(values, fraction)
+        return None if value is None else round(value * 1000, 2)
+
+    return {
+        "options": {
+            "connections": args.connections,
+            "requests": args.requests,
+            "prompt_words": args.prompt_words,
+            "coalesce_window_ms": args.coalesce_window_ms,
+            "workers": args.workers,
+            "client_processes": args.client_processes,
+            "upstream": upstream_args,
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "completed": results.completed,
+        "failed": results.failed,
+        "broken_connections": results.broken,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(results.completed / elapsed, 2),
+        "tokens_per_second": round(results.tokens / elapsed, 1),
+        "ttft_p50_ms": milliseconds(results.first_tokens, 0.50),
+        "ttft_p95_ms": milliseconds(results.first_tokens, 0.95),
+        "ttft_p99_ms": milliseconds(results.first_tokens, 0.99),
+        "inter_token_p50_ms": milliseconds(results.gaps, 0.50),
+        "inter_token_p95_ms": milliseconds(results.gaps, 0.95),
+        "inter_token_p99_ms": milliseconds(results.gaps, 0.99),
+        "cpu_ms_per_connection": round(cpu_used * 1000 / args.connections, 2),
+        "rss_kib_per_connection": round(max(0, peak_rss - idle_rss) / args.connections, 1),
+        "idle_rss_kib": idle_rss,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return a line for every tracked metric that regressed past the tolerance."""
+    regressions = []
+    for name, higher_is_better in TRACKED.items():
+        current, previous = report.get(name), baseline.get(name)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{name}: {previous} -> {current} ({change:+.1%})")
+    return regressions
+
+
+def upstream_arguments(args: argparse.Namespace) -> List[str]:
+    """Return the command line options of the fake upstream."""
+    upstream_args = [
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--ttft-ms", str(args.ttft_ms),
+        "--ttft-sigma", str(args.ttft_sigma),
+        "--tokens", str(args.tokens),
+        "--error-rate", str(args.error_rate),
+        "--drop-rate", str(args.drop_rate),
+        "--workers", str(args.upstream_workers),
+    ]
+    if args.seed is not None:
+        upstream_args += ["--seed", str(args.seed)]
+    return upstream_args
+
+
+def build_parser(description: str) -> argparse.ArgumentParser:
+    """Return the parser of the load options shared by the load benchmarks."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5, help="completions per connection")
+    parser.add_argument("--prompt-words", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="serve the API with this many gunicorn workers instead of one uvicorn process")
+    parser.add_argument("--client-processes", type=int, default=1,
+                        help="processes the WebSocket clients are spread over")
+    parser.add_argument("--coalesce-window-ms", type=int, default=None,
+                        help="override STREAM_COALESCE_WINDOW_MS, 0 sends every token in its own frame")
+    upstream = parser.add_argument_group("fake upstream")
+    upstream.add_argument("--upstream-workers", type=int, default=1)
+    add_arguments(upstream)
+    return parser
+
+
+def main() -> None:
+    parser = build_parser(__doc__.splitlines()[0])
+    parser.add_argument("--baseline", default="default", help="name of the baseline to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="relative change of a metric reported as a regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(load(args))
+    print(json.dumps(report, indent=2))
+
+    baseline_path = BASELINE_DIR / f"{args.baseline}.json"
+    if args.save_baseline:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        baseline_path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Saved baseline {baseline_path}")
+    elif baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        if baseline.get("options") != report["options"]:
+            print(f"Warning: baseline {args.baseline} was recorded with other options")
+        regressions = compare(report, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against baseline {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Gunicorn configuration of the multi-process serving mode.
+
+Every worker runs its own event loop, connection pool and caches, and
+reads the application settings itself. Set SHARED_STATE_BACKEND=sqlite so
+that rate limits and the stream registry are shared by the workers.
+
+A single worker is started unless WEB_CONCURRENCY asks for more. /metrics,
+the /debug/traces ring buffer and /health/ready are answered by whichever
+worker accepts the connection, so with several workers scale by running
+more single-worker replicas where those must be consistent.
+
+Usage:
+    gunicorn -c gunicorn.conf.py src.main:application
+"""
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8081")
+# One worker unless WEB_CONCURRENCY opts in to more
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "src.workers.UvicornWorker"
+# Give streaming completions time to finish on a graceful restart
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+# Each worker opens its own resources in the application lifespan
+preload_app = False
+
+
+def on_starting(server):
+    """Warn when several workers would each keep their own rate limits."""
+    from src.settings import settings
+
+    if server.cfg.workers > 1 and settings.SHARED_STATE_BACKEND == "local":
+        server.log.warning(
+            "Running %d workers with SHARED_STATE_BACKEND=local: rate limits are per worker",
+            server.cfg.workers,
+        )
+    if server.cfg.workers > 1 and settings.CONVERSATION_STORE_PATH == ":memory:":
+        server.log.warning("CONVERSATION_STORE_PATH=:memory: is not shared by the workers")
+    if server.cfg.workers > 1:
+        server.log.warning(
+            "Running %d workers: /metrics, /debug/traces and /health/ready answer for one worker each",
+            server.cfg.workers,
+        )
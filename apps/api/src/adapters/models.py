@@ -0,0 +1,13 @@
+"""Models served by the OpenAI adapter.
+
+Kept apart from the adapter so modules that only need the model names do
+not import the OpenAI SDK.
+"""
+from enum import Enum
+
+
+class OpenAIModel(str, Enum):
+    """Supported OpenAI models."""
+    GPT_4O = "gpt-4o"
+    GPT_4O_MINI = "gpt-4o-mini"
+    O3_MINI = "o3-mini"
@@ -1,36 +1,100 @@
 """Adapter for interacting with the OpenAI API."""
-from enum import Enum
 from typing import AsyncGenerator, Dict, List, Literal, Optional, Union, Any
 import logging
 
+import httpx
 from openai import AsyncOpenAI, APIError
 from openai.types.chat import ChatCompletionChunk
 
-from src.settings import Settings
+from src.adapters.models import OpenAIModel
+from src.settings import Settings, settings
+from src.utils.retry import RetryMetrics, build_retrying, retry_reason
+from src.utils.tracing import current_traceparent, span
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 
-class OpenAIModel(str, Enum):
-    """Supported OpenAI models."""
-    GPT_4O = "gpt-4o"
-    GPT_4O_MINI = "gpt-4o-mini"
-    O3_MINI = "o3-mini"
-
-
 class OpenAIAdapter:
     """Adapter for interacting with the OpenAI API."""
 
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        settings_instance: Optional[Settings] = None,
+        base_url: Optional[str] = None,
+        retry_max_attempts: Optional[int] = None,
+    ):
         """Initialize the OpenAI adapter with an API key.
         
+        The adapter owns a single pooled HTTP client, so one instance is meant
+        to be shared by every connection for the lifetime of the application.
+        
         Args:
             api_key: OpenAI API key, defaults to the one in settings
+            settings_instance: Settings to read pool and retry configuration
+                from, defaults to the application settings
+            base_url: OpenAI-compatible endpoint, defaults to the one in settings
+            retry_max_attempts: Attempts to open a stream, defaults to the
+                number in settings
         """
-        settings_instance = Settings()
+        settings_instance = settings_instance or settings
         self.api_key = api_key or settings_instance.OPENAI_API_KEY
-        self.client = AsyncOpenAI(api_key=self.api_key)
+        self.http_client = self._build_http_client(settings_instance)
+        # Retries are handled by our own policy below, not by the SDK
+        self.client = AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=base_url or settings_instance.OPENAI_BASE_URL,
+            http_client=self.http_client,
+            max_retries=0,
+        )
+        self.retry_max_attempts = retry_max_attempts or settings_instance.OPENAI_RETRY_MAX_ATTEMPTS
+        self.retry_base_delay = settings_instance.OPENAI_RETRY_BASE_DELAY
+        self.retry_max_delay = settings_instance.OPENAI_RETRY_MAX_DELAY
+        self.retry_deadline = settings_instance.OPENAI_RETRY_DEADLINE
+        self.retry_metrics = RetryMetrics()
+        self.stream_include_usage = settings_instance.OPENAI_STREAM_INCLUDE_USAGE
+
+    @staticmethod
+    def _build_http_client(settings_instance: Settings) -> httpx.AsyncClient:
+        """Build the pooled HTTP client shared by all upstream requests.
+        
+        Args:
+            settings_instance: Settings holding the pool limits and timeouts
+            
+        Returns:
+            An httpx client with the configured connection pool
+        """
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings_instance.OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=settings_instance.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=settings_instance.OPENAI_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=settings_instance.OPENAI_CONNECT_TIMEOUT,
+                read=settings_instance.OPENAI_READ_TIMEOUT,
+                write=settings_instance.OPENAI_CONNECT_TIMEOUT,
+                pool=settings_instance.OPENAI_POOL_TIMEOUT,
+            ),
+        )
+
+    async def warmup(self) -> bool:
+        """Open a connection to the upstream so the first request skips the handshake.
+        
+        Returns:
+            True if the upstream answered, False otherwise
+        """
+        try:
+            await self.client.models.list()
+            return True
+        except Exception as e:
+            logger.warning("OpenAI connection warmup failed: %s", e)
+            return False
+
+    async def close(self) -> None:
+        """Close the pooled HTTP client and every connection it holds."""
+        await self.client.close()
 
     def _prepare_completion_params(
         self,
@@ -75,6 +139,10 @@ class OpenAIAdapter:
         # Add temperature only for non-o3-mini models
         if not is_o3_mini:
             params["temperature"] = temperature
+        
+        # Have the last chunk of a stream report the token usage
+        if stream and self.stream_include_usage:
+            params["stream_options"] = {"include_usage": True}
             
         return params
 
@@ -89,6 +157,13 @@ class OpenAIAdapter:
         """
         Generate a chat completion from OpenAI.
         
+        Rate limits, server errors, timeouts and connection failures are
+        retried with jittered exponential backoff, or after the delay the
+        upstream asks for in Retry-After, until the attempts or the total
+        deadline run out. Only opening the stream is retried: once it is
+        returned its tokens may reach the client, so a stream is never
+        started twice.
+        
         Args:
             messages: List of message objects with role and content
             model: The model to use for generation (can be string or enum)
@@ -111,7 +186,22 @@ class OpenAIAdapter:
                 stream=stream
             )
             
-            return await self.client.chat.completions.create(**params)
+            retrying = build_retrying(
+                max_attempts=self.retry_max_attempts,
+                base_delay=self.retry_base_delay,
+                max_delay=self.retry_max_delay,
+                deadline=self.retry_deadline,
+                metrics=self.retry_metrics,
+            )
+            async for attempt in retrying:
+                with attempt, span("upstream_attempt", attempt=attempt.retry_state.attempt_number):
+                    # Continue the trace of the request at the upstream, if it is traced
+                    traceparent = current_traceparent()
+                    if traceparent is not None:
+                        params["extra_headers"] = {"traceparent": traceparent}
+                    return await self.client.chat.completions.create(**params)
         except APIError as e:
-            logger.error(f"OpenAI API error: {str(e)}", exc_info=True)
+            if retry_reason(e) is not None:
+                self.retry_metrics.exhausted += 1
+            logger.error("OpenAI API error: %s", e, exc_info=True)
             raise 
\ No newline at end of file
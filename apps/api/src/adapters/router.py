@@ -0,0 +1,392 @@
+"""Routing of chat completions between several OpenAI-compatible providers."""
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncGenerator, Dict, FrozenSet, List, Optional, Sequence, Union
+
+from src.adapters.models import OpenAIModel
+from src.settings import Settings, settings
+from src.utils.logs import SAMPLED
+from src.utils.retry import RetryMetrics
+from src.utils.tracing import span
+
+if TYPE_CHECKING:
+    # The OpenAI SDK is imported when the providers are built, not at startup
+    from src.adapters.openai import OpenAIAdapter
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Name of the provider built from OPENAI_API_KEY and OPENAI_BASE_URL
+DEFAULT_PROVIDER = "default"
+
+# Statuses that blame the request rather than the provider, so failing over cannot help
+_REQUEST_ERROR_STATUSES = {400, 401, 403, 413, 422}
+
+# Lowest share of successes a provider's score is divided by
+_MIN_SUCCESS_RATE = 0.05
+
+
+def _is_request_error(error: BaseException) -> bool:
+    """Tell whether an upstream error blames the request rather than the provider."""
+    # Only providers that were built can raise, so the SDK is already imported here
+    from openai import APIStatusError
+
+    return isinstance(error, APIStatusError) and error.status_code in _REQUEST_ERROR_STATUSES
+
+
+class NoProviderError(ValueError):
+    """Raised when no configured provider serves the requested model."""
+
+
+@dataclass
+class ProviderStats:
+    """Live statistics of a provider, the inputs of its routing score."""
+    latency: Optional[float] = None
+    # EWMA duration of non-streamed responses, reported but not ranked on
+    response_time: Optional[float] = None
+    error_rate: float = 0.0
+    in_flight: int = 0
+    selected: int = 0
+    failures: int = 0
+    failovers: int = 0
+    ejected_until: float = 0.0
+
+    def ejected(self, now: float) -> bool:
+        """Whether the provider is left out of routing at this time."""
+        return now < self.ejected_until
+
+
+class Provider:
+    """An upstream backend with its own connection pool and statistics."""
+
+    def __init__(self, name: str, adapter: "OpenAIAdapter", models: Sequence[str] = ()):
+        """Initialize the provider.
+
+        Args:
+            name: Name the provider is reported as
+            adapter: Adapter holding the provider's client and connection pool
+            models: Models the provider serves, empty for any
+        """
+        self.name = name
+        self.adapter = adapter
+        self.models: FrozenSet[str] = frozenset(models)
+        self.stats = ProviderStats()
+
+    def serves(self, model: str) -> bool:
+        """Whether the provider can be asked for a model."""
+        return not self.models or model in self.models
+
+
+class RoutedResponse:
+    """A non-streamed completion and the provider that answered it."""
+
+    def __init__(self, provider: Provider, response: Any, failovers: int):
+        """Wrap a response.
+
+        Args:
+            provider: The provider that answered
+            response: The completion returned by the provider's adapter
+            failovers: Providers that failed before this one answered
+        """
+        self.provider = provider
+        self.response = response
+        self.failovers = failovers
+
+
+class RoutedStream:
+    """An upstream stream that reports its outcome to the provider that serves it.
+
+    The time to the first chunk is the latency sample of the provider, and
+    an error while streaming counts as a failure. A stream closed before its
+    first chunk, e.g. because a hedge won, still counts the time it waited
+    when that is longer than the provider's average, so that slow providers
+    are not rewarded for being abandoned.
+    """
+
+    def __init__(self, router: "ProviderRouter", provider: Provider, stream: Any, started_at: float, failovers: int):
+        """Wrap an open stream.
+
+        Args:
+            router: The router recording the outcome
+            provider: The provider serving the stream
+            stream: The stream returned by the provider's adapter
+            started_at: Monotonic time the stream was requested
+            failovers: Providers that failed before this one opened the stream
+        """
+        self.provider = provider
+        self.failovers = failovers
+        self._router = router
+        self._stream = stream
+        self._started_at = started_at
+        self._first_chunk = False
+        self._released = False
+
+    def __aiter__(self) -> AsyncGenerator[Any, None]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncGenerator[Any, None]:
+        try:
+            async for chunk in self._stream:
+                if not self._first_chunk:
+                    self._first_chunk = True
+                    self._router.record_latency(self.provider, time.monotonic() - self._started_at)
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except Exception:
+            self._router.record_failure(self.provider)
+            self._release()
+            raise
+        self._router.record_success(self.provider)
+        self._release()
+
+    async def close(self) -> None:
+        """Close the upstream stream and stop counting it as in flight."""
+        if not self._first_chunk and not self._released:
+            waited = time.monotonic() - self._started_at
+            latency = self.provider.stats.latency
+            if latency is not None and waited > latency:
+                self._router.record_latency(self.provider, waited)
+        self._release()
+        close = getattr(self._stream, "close", None) or getattr(self._stream, "aclose", None)
+        if close is not None:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+
+    def _release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.provider.stats.in_flight -= 1
+
+
+class ProviderRouter:
+    """Picks a provider for each completion and fails over when it degrades.
+
+    Providers are ranked by a cost that grows with their EWMA time to first
+    chunk, their requests in flight and their EWMA error rate, the way
+    least-loaded balancers weigh latency by load. Providers without a latency
+    sample yet count as the fastest one measured, so new or recovered
+    providers get traffic. A provider whose error rate reaches the threshold
+    is left out for a while, unless every provider of the model is. When
+    opening a stream fails for a reason that is not the request's fault, the
+    next provider is tried.
+
+    Streams keep the interface of the adapter's, so one provider configured
+    from OPENAI_API_KEY and OPENAI_BASE_URL behaves like the adapter alone.
+    Non-streamed responses come wrapped with the provider that answered.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[Provider],
+        latency_alpha: float = 0.3,
+        error_alpha: float = 0.2,
+        eject_error_rate: float = 0.5,
+        eject_seconds: float = 30.0,
+    ):
+        """Initialize the router.
+
+        Args:
+            providers: The providers to route between, in order of preference on a tie
+            latency_alpha: Weight of a new latency sample in the EWMA
+            error_alpha: Weight of a new outcome in the error rate EWMA
+            eject_error_rate: Error rate at which a provider is left out
+            eject_seconds: How long an ejected provider is left out
+        """
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = list(providers)
+        self.latency_alpha = latency_alpha
+        self.error_alpha = error_alpha
+        self.eject_error_rate = eject_error_rate
+        self.eject_seconds = eject_seconds
+
+    @classmethod
+    def from_settings(cls, settings_instance: Optional[Settings] = None) -> "ProviderRouter":
+        """Build the providers and router configured by the application settings.
+
+        With several providers each opens its stream in a single attempt,
+        since failing over to another provider replaces retrying the same one.
+        """
+        from src.adapters.openai import OpenAIAdapter
+
+        settings_instance = settings_instance or settings
+        configured = settings_instance.OPENAI_PROVIDERS
+        if not configured:
+            providers = [Provider(DEFAULT_PROVIDER, OpenAIAdapter(settings_instance=settings_instance))]
+        else:
+            attempts = 1 if len(configured) > 1 else None
+            providers = [
+                Provider(
+                    provider.name,
+                    OpenAIAdapter(
+                        api_key=provider.api_key,
+                        settings_instance=settings_instance,
+                        base_url=provider.base_url,
+                        retry_max_attempts=attempts,
+                    ),
+                    provider.models,
+                )
+                for provider in configured
+            ]
+        return cls(
+            providers,
+            latency_alpha=settings_instance.PROVIDER_LATENCY_EWMA_ALPHA,
+            error_alpha=settings_instance.PROVIDER_ERROR_EWMA_ALPHA,
+            eject_error_rate=settings_instance.PROVIDER_EJECT_ERROR_RATE,
+            eject_seconds=settings_instance.PROVIDER_EJECT_SECONDS,
+        )
+
+    @property
+    def retry_metrics(self) -> RetryMetrics:
+        """The retry counters of every provider added together."""
+        total = RetryMetrics()
+        for provider in self.providers:
+            total.retries += provider.adapter.retry_metrics.retries
+            total.exhausted += provider.adapter.retry_metrics.exhausted
+            total.by_reason.update(provider.adapter.retry_metrics.by_reason)
+        return total
+
+    async def warmup(self) -> bool:
+        """Warm the connection pool of every provider up.
+
+        Returns:
+            True if any provider answered
+        """
+        results = await asyncio.gather(*(provider.adapter.warmup() for provider in self.providers))
+        return any(results)
+
+    async def close(self) -> None:
+        """Close the connection pool of every provider."""
+        await asyncio.gather(*(provider.adapter.close() for provider in self.providers))
+
+    def rank(self, model: str) -> List[Provider]:
+        """Order the providers of a model from the best to the worst.
+
+        Args:
+            model: The requested model
+
+        Returns:
+            The providers to try in order
+
+        Raises:
+            NoProviderError: When no provider serves the model
+        """
+        candidates = [provider for provider in self.providers if provider.serves(model)]
+        if not candidates:
+            raise NoProviderError(f"No provider serves the model {model}")
+        now = time.monotonic()
+        healthy = [provider for provider in candidates if not provider.stats.ejected(now)]
+        measured = [provider.stats.latency for provider in candidates if provider.stats.latency is not None]
+        fastest = min(measured) if measured else 0.0
+
+        def cost(provider: Provider) -> float:
+            stats = provider.stats
+            latency = stats.latency if stats.latency is not None else fastest
+            return latency * (stats.in_flight + 1) / max(1.0 - stats.error_rate, _MIN_SUCCESS_RATE)
+
+        # Sorting is stable, so ties keep the configured order after the least loaded
+        return sorted(healthy or candidates, key=lambda provider: (cost(provider), provider.stats.in_flight))
+
+    async def generate_chat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        model: Union[str, OpenAIModel] = OpenAIModel.GPT_4O_MINI,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        stream: bool = True,
+    ) -> Any:
+        """Open a completion on the best provider, failing over to the next ones.
+
+        Args:
+            messages: List of message objects with role and content
+            model: The model to use for generation (can be string or enum)
+            temperature: Controls randomness (higher = more random)
+            max_tokens: Maximum number of tokens to generate
+            stream: Whether to stream the response
+
+        Returns:
+            A RoutedStream when streaming, otherwise a RoutedResponse
+
+        Raises:
+            NoProviderError: When no provider serves the model
+            APIError: The error of the last provider tried
+        """
+        model_name = model.value if isinstance(model, OpenAIModel) else model
+        candidates = self.rank(model_name)
+        for index, provider in enumerate(candidates):
+            provider.stats.selected += 1
+            provider.stats.in_flight += 1
+            started_at = time.monotonic()
+            try:
+                with span("provider", provider=provider.name):
+                    response = await provider.adapter.generate_chat_completion(
+                        messages=messages,
+                        model=model,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        stream=stream
+                    )
+            except Exception as e:
+                provider.stats.in_flight -= 1
+                if _is_request_error(e):
+                    raise
+                self.record_failure(provider)
+                if index == len(candidates) - 1:
+                    raise
+                provider.stats.failovers += 1
+                logger.warning(
+                    "Provider %s failed to open a stream, failing over to %s: %s",
+                    provider.name, candidates[index + 1].name, e, extra=SAMPLED
+                )
+                continue
+            except BaseException:
+                provider.stats.in_flight -= 1
+                raise
+            if not stream:
+                provider.stats.in_flight -= 1
+                self.record_response_time(provider, time.monotonic() - started_at)
+                self.record_success(provider)
+                return RoutedResponse(provider, response, failovers=index)
+            return RoutedStream(self, provider, response, started_at, failovers=index)
+
+    def record_latency(self, provider: Provider, seconds: float) -> None:
+        """Fold a time to first chunk into a provider's EWMA latency."""
+        stats = provider.stats
+        if stats.latency is None:
+            stats.latency = seconds
+        else:
+            stats.latency += self.latency_alpha * (seconds - stats.latency)
+
+    def record_response_time(self, provider: Provider, seconds: float) -> None:
+        """Fold the duration of a non-streamed response into its own EWMA.
+
+        A whole response takes far longer than a first chunk, so it is kept
+        out of the latency the providers are ranked by.
+        """
+        stats = provider.stats
+        if stats.response_time is None:
+            stats.response_time = seconds
+        else:
+            stats.response_time += self.latency_alpha * (seconds - stats.response_time)
+
+    def record_success(self, provider: Provider) -> None:
+        """Fold a completed stream into a provider's error rate."""
+        provider.stats.error_rate -= self.error_alpha * provider.stats.error_rate
+
+    def record_failure(self, provider: Provider) -> None:
+        """Fold a failure into a provider's error rate, ejecting it past the threshold."""
+        stats = provider.stats
+        stats.failures += 1
+        stats.error_rate += self.error_alpha * (1.0 - stats.error_rate)
+        now = time.monotonic()
+        if stats.error_rate >= self.eject_error_rate and not stats.ejected(now) and len(self.providers) > 1:
+            stats.ejected_until = now + self.eject_seconds
+            logger.warning(
+                "Provider %s left out for %gs at an error rate of %.2f",
+                provider.name, self.eject_seconds, stats.error_rate
+            )
@@ -0,0 +1,59 @@
+"""Debug endpoints serving the traces kept in memory."""
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+
+from src.api.dependencies import get_tracer
+from src.settings import settings
+from src.utils.tracing import MemoryTraceExporter
+
+
+def _debug_endpoints_enabled() -> None:
+    """Hide the debug endpoints unless they are enabled.
+
+    Raises:
+        HTTPException: When DEBUG_ENDPOINTS_ENABLED is off
+    """
+    if not settings.DEBUG_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+router = APIRouter(prefix="/debug", dependencies=[Depends(_debug_endpoints_enabled)])
+
+
+def _memory_exporter(request: Request) -> MemoryTraceExporter:
+    """Return the ring buffer of recent traces.
+
+    Raises:
+        HTTPException: When traces are not kept in memory
+    """
+    tracer = get_tracer(request)
+    if tracer is None or not isinstance(tracer.exporter, MemoryTraceExporter):
+        raise HTTPException(status_code=404, detail="Traces are only kept in memory with TRACING_EXPORTER=memory")
+    return tracer.exporter
+
+
+@router.get("/traces", include_in_schema=False)
+async def traces_endpoint(request: Request, limit: int = Query(50, ge=1, le=1000)) -> List[dict]:
+    """List the most recent traces of the worker, newest first.
+
+    Returns:
+        The id, start, duration and request details of each trace
+    """
+    return [trace.summary() for trace in _memory_exporter(request).recent(limit)]
+
+
+@router.get("/traces/{trace_id}", include_in_schema=False)
+async def trace_endpoint(trace_id: str, request: Request) -> dict:
+    """Return the span tree of a trace.
+
+    Returns:
+        The trace, with each span's start and duration in milliseconds
+
+    Raises:
+        HTTPException: When the worker does not hold the trace
+    """
+    trace = _memory_exporter(request).get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"Trace {trace_id} not found")
+    return trace.as_dict()
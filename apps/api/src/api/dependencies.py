@@ -1,29 +1,332 @@
 """Dependency injection for FastAPI."""
-from fastapi import Depends
+import asyncio
+from typing import Optional
 
-from src.adapters.openai import OpenAIAdapter
+from fastapi import Depends, HTTPException
+from starlette.requests import HTTPConnection
+
+from src.adapters.router import ProviderRouter
+from src.handlers.batch import BatchCompletionHandler
+from src.handlers.http import HTTPCompletionHandler
 from src.handlers.websocket import WebSocketHandler
+from src.settings import settings
+from src.utils.admission import AdmissionController
+from src.utils.completion_cache import CompletionCache
+from src.utils.conversation_store import ConversationStore
+from src.utils.metrics import ServiceMetrics
+from src.utils.send_queue import SendQueueMetrics
+from src.utils.shared_state import SharedState
+from src.utils.single_flight import SingleFlightGroup
+from src.utils.token_budget import TokenBudget
+from src.utils.tracing import Tracer
+
+
+
+async def get_provider_router(connection: HTTPConnection) -> ProviderRouter:
+    """Provide the application-wide router between the OpenAI-compatible providers.
+
+    The router is built by the application lifespan on a worker thread, and
+    a connection arriving before it is done waits for it rather than building
+    another on the event loop. When the lifespan has not run (e.g. a test
+    client used without a context manager) it is created lazily and stored
+    on the application so it is still shared.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared router, holding one adapter per provider
+
+    Raises:
+        HTTPException: When the lifespan failed to build the router
+    """
+    state = connection.app.state
+    build = getattr(state, "router_build", None)
+    if build is not None:
+        if not build.done():
+            # Waited on without shielding, so a cancelled connection leaves the build running
+            await asyncio.wait((build,))
+        if build.cancelled() or build.exception() is not None:
+            raise HTTPException(status_code=503, detail="The upstream providers could not be set up")
+        return build.result()
+    router = getattr(state, "provider_router", None)
+    if router is None:
+        router = ProviderRouter.from_settings()
+        state.provider_router = router
+    return router
+
+
+def get_completion_cache(connection: HTTPConnection) -> Optional[CompletionCache]:
+    """Provide the application-wide completion cache, if it is enabled.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared completion cache, or None when caching is disabled
+    """
+    return getattr(connection.app.state, "completion_cache", None)
+
+
+def get_conversation_store(connection: HTTPConnection) -> Optional[ConversationStore]:
+    """Provide the application-wide conversation store, if it is enabled.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared conversation store, or None when it is not open
+    """
+    return getattr(connection.app.state, "conversation_store", None)
+
+
+def get_single_flight(connection: HTTPConnection) -> Optional[SingleFlightGroup]:
+    """Provide the application-wide single-flight group, if it is enabled.
+
+    Like the adapter, the group is created lazily when the lifespan has not run.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared single-flight group, or None when sharing is disabled
+    """
+    if not settings.SINGLE_FLIGHT_ENABLED:
+        return None
+    state = connection.app.state
+    single_flight = getattr(state, "single_flight", None)
+    if single_flight is None:
+        single_flight = SingleFlightGroup()
+        state.single_flight = single_flight
+    return single_flight
+
+
+def get_token_budget(connection: HTTPConnection) -> Optional[TokenBudget]:
+    """Provide the application-wide token budget manager, if it is enabled.
+
+    Like the adapter, it is created lazily when the lifespan has not run.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared token budget manager, or None when budgeting is disabled
+    """
+    if not settings.TOKEN_BUDGET_ENABLED:
+        return None
+    state = connection.app.state
+    token_budget = getattr(state, "token_budget", None)
+    if token_budget is None:
+        token_budget = TokenBudget.from_settings(settings)
+        state.token_budget = token_budget
+    return token_budget
+
+
+def get_shared_state(connection: HTTPConnection) -> SharedState:
+    """Provide the state shared with the other workers of the host.
+
+    Like the adapter, it is created and opened lazily when the lifespan has not run.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The configured shared state backend
+    """
+    state = connection.app.state
+    shared_state = getattr(state, "shared_state", None)
+    if shared_state is None:
+        shared_state = SharedState.from_settings(settings)
+        shared_state.open()
+        state.shared_state = shared_state
+    return shared_state
+
+
+def get_admission(connection: HTTPConnection) -> Optional[AdmissionController]:
+    """Provide the application-wide admission controller, if it is enabled.
 
+    Like the adapter, it is created lazily when the lifespan has not run.
 
+    Args:
+        connection: The incoming HTTP or WebSocket connection
 
-def get_open_ai_adapter() -> OpenAIAdapter:
-    """Provide OpenAI adapter instance.
-    
     Returns:
-        An instance of the OpenAI adapter
+        The shared admission controller, or None when admission control is disabled
     """
-    return OpenAIAdapter()
+    if not settings.ADMISSION_ENABLED:
+        return None
+    state = connection.app.state
+    admission = getattr(state, "admission", None)
+    if admission is None:
+        admission = AdmissionController.from_settings(settings, get_shared_state(connection))
+        state.admission = admission
+    return admission
+
+
+def get_send_queue_metrics(connection: HTTPConnection) -> SendQueueMetrics:
+    """Provide the counters shared by the send queues of every connection.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared send queue metrics
+    """
+    state = connection.app.state
+    metrics = getattr(state, "send_queue_metrics", None)
+    if metrics is None:
+        metrics = SendQueueMetrics()
+        state.send_queue_metrics = metrics
+    return metrics
+
+
+def get_service_metrics(connection: HTTPConnection) -> ServiceMetrics:
+    """Provide the latency histograms and request counters of the worker.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared service metrics
+    """
+    state = connection.app.state
+    metrics = getattr(state, "service_metrics", None)
+    if metrics is None:
+        metrics = ServiceMetrics()
+        state.service_metrics = metrics
+    return metrics
+
+
+def get_tracer(connection: HTTPConnection) -> Optional[Tracer]:
+    """Provide the application-wide tracer, if tracing is enabled.
+
+    Like the adapter, it is created lazily when the lifespan has not run.
+
+    Args:
+        connection: The incoming HTTP or WebSocket connection
+
+    Returns:
+        The shared tracer, or None when tracing is disabled
+    """
+    if not settings.TRACING_ENABLED:
+        return None
+    state = connection.app.state
+    tracer = getattr(state, "tracer", None)
+    if tracer is None:
+        tracer = Tracer.from_settings(settings)
+        state.tracer = tracer
+    return tracer
 
 
 def get_websocket_handler(
-    openai_adapter: OpenAIAdapter = Depends(get_open_ai_adapter)
+    router: ProviderRouter = Depends(get_provider_router),
+    completion_cache: Optional[CompletionCache] = Depends(get_completion_cache),
+    single_flight: Optional[SingleFlightGroup] = Depends(get_single_flight),
+    conversation_store: Optional[ConversationStore] = Depends(get_conversation_store),
+    token_budget: Optional[TokenBudget] = Depends(get_token_budget),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+    send_queue_metrics: Optional[SendQueueMetrics] = Depends(get_send_queue_metrics),
+    service_metrics: Optional[ServiceMetrics] = Depends(get_service_metrics),
+    tracer: Optional[Tracer] = Depends(get_tracer)
 ) -> WebSocketHandler:
     """Provide WebSocket handler instance with dependencies.
-    
+
     Args:
-        openai_adapter: Adapter for interacting with OpenAI
-        
+        router: Router between the OpenAI-compatible providers
+        completion_cache: Cache of completed responses, if enabled
+        single_flight: Group sharing identical in-flight completions, if enabled
+        conversation_store: Server-side conversation histories, if enabled
+        token_budget: Context-window budgeting of requests, if enabled
+        admission: Rate limits and the global concurrency gate, if enabled
+        send_queue_metrics: Counters shared by every connection's send queue
+        service_metrics: Latency histograms and request counters of the worker
+        tracer: Records the stages of sampled requests, if enabled
+
     Returns:
         An instance of the WebSocket handler
     """
-    return WebSocketHandler(openai_adapter) 
\ No newline at end of file
+    return WebSocketHandler(
+        router,
+        completion_cache=completion_cache,
+        single_flight=single_flight,
+        conversation_store=conversation_store,
+        token_budget=token_budget,
+        admission=admission,
+        send_queue_metrics=send_queue_metrics,
+        service_metrics=service_metrics,
+        tracer=tracer
+    )
+
+
+def get_http_handler(
+    router: ProviderRouter = Depends(get_provider_router),
+    completion_cache: Optional[CompletionCache] = Depends(get_completion_cache),
+    single_flight: Optional[SingleFlightGroup] = Depends(get_single_flight),
+    conversation_store: Optional[ConversationStore] = Depends(get_conversation_store),
+    token_budget: Optional[TokenBudget] = Depends(get_token_budget),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+    service_metrics: Optional[ServiceMetrics] = Depends(get_service_metrics),
+    tracer: Optional[Tracer] = Depends(get_tracer)
+) -> HTTPCompletionHandler:
+    """Provide an HTTP completion handler instance with dependencies.
+
+    Args:
+        router: Router between the OpenAI-compatible providers
+        completion_cache: Cache of completed responses, if enabled
+        single_flight: Group sharing identical in-flight completions, if enabled
+        conversation_store: Server-side conversation histories, if enabled
+        token_budget: Context-window budgeting of requests, if enabled
+        admission: Rate limits and the global concurrency gate, if enabled
+        service_metrics: Latency histograms and request counters of the worker
+        tracer: Records the stages of sampled requests, if enabled
+
+    Returns:
+        An instance of the HTTP completion handler
+    """
+    return HTTPCompletionHandler(
+        router,
+        completion_cache=completion_cache,
+        single_flight=single_flight,
+        conversation_store=conversation_store,
+        token_budget=token_budget,
+        admission=admission,
+        service_metrics=service_metrics,
+        tracer=tracer
+    )
+
+
+def get_batch_handler(
+    router: ProviderRouter = Depends(get_provider_router),
+    completion_cache: Optional[CompletionCache] = Depends(get_completion_cache),
+    single_flight: Optional[SingleFlightGroup] = Depends(get_single_flight),
+    conversation_store: Optional[ConversationStore] = Depends(get_conversation_store),
+    token_budget: Optional[TokenBudget] = Depends(get_token_budget),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+    service_metrics: Optional[ServiceMetrics] = Depends(get_service_metrics),
+    tracer: Optional[Tracer] = Depends(get_tracer)
+) -> BatchCompletionHandler:
+    """Provide a batch completion handler instance with dependencies.
+
+    Args:
+        router: Router between the OpenAI-compatible providers
+        completion_cache: Cache of completed responses, if enabled
+        single_flight: Group sharing identical in-flight completions, if enabled
+        conversation_store: Server-side conversation histories, if enabled
+        token_budget: Context-window budgeting of requests, if enabled
+        admission: Rate limits and the global concurrency gate, if enabled
+        service_metrics: Latency histograms and request counters of the worker
+        tracer: Records the stages of sampled requests, if enabled
+
+    Returns:
+        An instance of the batch completion handler
+    """
+    return BatchCompletionHandler(
+        router,
+        completion_cache=completion_cache,
+        single_flight=single_flight,
+        conversation_store=conversation_store,
+        token_budget=token_budget,
+        admission=admission,
+        service_metrics=service_metrics,
+        tracer=tracer
+    )
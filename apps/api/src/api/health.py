@@ -1,10 +1,41 @@
-"""Health check endpoint for the API."""
-from fastapi import APIRouter
+"""Health check endpoints for the API."""
+import asyncio
+from typing import Optional
+
+from fastapi import APIRouter, FastAPI, HTTPException, Request
 from starlette import status
 
 router = APIRouter()
 
 
+def startup_error(app: FastAPI) -> Optional[BaseException]:
+    """Return the error the startup of the worker failed with, if it did.
+
+    Args:
+        app: The application whose lifespan started the worker
+    """
+    startup = getattr(app.state, "startup", None)
+    if startup is None or not startup.done():
+        return None
+    if startup.cancelled():
+        return asyncio.CancelledError()
+    return startup.exception()
+
+
+def is_ready(app: FastAPI) -> bool:
+    """Tell whether the worker finished starting up.
+
+    Args:
+        app: The application whose lifespan started the worker
+
+    Returns:
+        True once the providers are built and warmed up, or when the lifespan
+        did not run and they are built on first use
+    """
+    startup = getattr(app.state, "startup", None)
+    return startup is None or (startup.done() and startup_error(app) is None)
+
+
 @router.get("/health", status_code=status.HTTP_200_OK, include_in_schema=False)
 def health_endpoint() -> str:
     """Check if the API is up and running.
@@ -12,4 +43,43 @@ def health_endpoint() -> str:
     Returns:
         String indicating the API is operational
     """
-    return "OK" 
\ No newline at end of file
+    return "OK"
+
+
+@router.get("/health/live", status_code=status.HTTP_200_OK, include_in_schema=False)
+async def liveness_endpoint(request: Request) -> str:
+    """Check the worker is serving, for restarting it when it is not.
+
+    Returns:
+        String indicating the event loop answers
+
+    Raises:
+        HTTPException: When the worker failed to start
+    """
+    error = startup_error(request.app)
+    if error is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Startup failed: {error!r}"
+        )
+    return "OK"
+
+
+@router.get("/health/ready", status_code=status.HTTP_200_OK, include_in_schema=False)
+async def readiness_endpoint(request: Request) -> str:
+    """Check the worker is warm, for sending it traffic only once it is.
+
+    Returns:
+        String indicating the worker is ready for completions
+
+    Raises:
+        HTTPException: While the upstream connection pools are warming up, or
+            when the worker failed to start
+    """
+    error = startup_error(request.app)
+    if error is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=f"Startup failed: {error!r}"
+        )
+    if not is_ready(request.app):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Warming up")
+    return "OK"
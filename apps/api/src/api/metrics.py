@@ -0,0 +1,132 @@
+"""Prometheus metrics endpoint for the API."""
+import time
+from typing import List
+
+from fastapi import APIRouter, Request, Response
+
+from src.api.dependencies import get_send_queue_metrics, get_service_metrics
+from src.utils.logs import log_queue_stats
+from src.utils.metrics import CONTENT_TYPE, Counter, Gauge, render
+
+router = APIRouter()
+
+
+async def _runtime_families(request: Request) -> List:
+    """Read the state of the shared components into metric families at scrape time.
+    
+    Args:
+        request: The scrape request
+        
+    Returns:
+        Metric families of upstream retries, provider routing, admission
+        control, single-flight sharing, the send queues and the log queue
+    """
+    state = request.app.state
+    families = []
+
+    provider_router = getattr(state, "provider_router", None)
+    if provider_router is not None:
+        retries = Counter(
+            "singularity_upstream_retries_total", "Upstream calls retried, by reason.", ("reason",)
+        )
+        for reason, count in provider_router.retry_metrics.by_reason.items():
+            retries.labels(reason).inc(count)
+        exhausted = Counter(
+            "singularity_upstream_retries_exhausted_total",
+            "Upstream calls that failed after their last retryable attempt."
+        )
+        exhausted.inc(provider_router.retry_metrics.exhausted)
+        families += [retries, exhausted]
+
+        latency = Gauge(
+            "singularity_provider_latency_seconds",
+            "EWMA time to the first chunk of each provider.", ("provider",)
+        )
+        response_time = Gauge(
+            "singularity_provider_response_time_seconds",
+            "EWMA duration of the non-streamed responses of each provider.", ("provider",)
+        )
+        error_rate = Gauge("singularity_provider_error_rate", "EWMA error rate of each provider.", ("provider",))
+        in_flight = Gauge("singularity_provider_in_flight", "Streams open on each provider.", ("provider",))
+        selections = Counter(
+            "singularity_provider_selections_total", "Completions routed to each provider.", ("provider",)
+        )
+        failovers = Counter(
+            "singularity_provider_failovers_total",
+            "Completions moved to another provider after this one failed.", ("provider",)
+        )
+        ejected = Gauge(
+            "singularity_provider_ejected", "Whether each provider is left out of routing.", ("provider",)
+        )
+        now = time.monotonic()
+        for provider in provider_router.providers:
+            stats = provider.stats
+            if stats.latency is not None:
+                latency.labels(provider.name).set(stats.latency)
+            if stats.response_time is not None:
+                response_time.labels(provider.name).set(stats.response_time)
+            error_rate.labels(provider.name).set(stats.error_rate)
+            in_flight.labels(provider.name).set(stats.in_flight)
+            selections.labels(provider.name).inc(stats.selected)
+            failovers.labels(provider.name).inc(stats.failovers)
+            ejected.labels(provider.name).set(1 if stats.ejected(now) else 0)
+        families += [latency, response_time, error_rate, in_flight, selections, failovers, ejected]
+
+    admission = getattr(state, "admission", None)
+    if admission is not None:
+        active = Gauge("singularity_admission_active", "Completions holding a global admission slot.")
+        active.set(admission.gate.active)
+        queued = Gauge("singularity_admission_queued", "Requests waiting for a global admission slot.")
+        queued.set(admission.gate.queued)
+        host_streams = Gauge(
+            "singularity_host_active_streams", "Completions running on every worker of the host."
+        )
+        host_streams.set(await admission.state.active_streams())
+        families += [active, queued, host_streams]
+
+    single_flight = getattr(state, "single_flight", None)
+    if single_flight is not None:
+        flights = Gauge(
+            "singularity_single_flight_streams",
+            "Upstream streams shared between identical requests."
+        )
+        flights.set(single_flight.in_flight())
+        families.append(flights)
+
+    send_queues = get_send_queue_metrics(request)
+    queued_frames = Gauge("singularity_send_queue_frames", "Frames waiting in WebSocket send queues.")
+    queued_frames.set(send_queues.queued_frames)
+    max_depth = Gauge("singularity_send_queue_max_depth", "Deepest a WebSocket send queue has been.")
+    max_depth.set(send_queues.max_depth)
+    coalesced = Counter(
+        "singularity_send_queue_coalesced_total", "Deltas merged into a waiting frame of a full send queue."
+    )
+    coalesced.inc(send_queues.coalesced)
+    paused = Counter(
+        "singularity_send_queue_paused_total", "Times a request waited for room in a full send queue."
+    )
+    paused.inc(send_queues.paused)
+    slow_consumers = Counter(
+        "singularity_slow_consumer_disconnects_total", "Connections closed for not reading fast enough."
+    )
+    slow_consumers.inc(send_queues.disconnected)
+    families += [queued_frames, max_depth, coalesced, paused, slow_consumers]
+
+    queued_records, dropped_records = log_queue_stats()
+    log_queue = Gauge("singularity_log_queue_records", "Log records waiting for the background writer.")
+    log_queue.set(queued_records)
+    log_dropped = Counter("singularity_log_records_dropped_total", "Log records dropped because the queue was full.")
+    log_dropped.inc(dropped_records)
+    families += [log_queue, log_dropped]
+    return families
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics_endpoint(request: Request) -> Response:
+    """Expose the worker's metrics in the Prometheus text format.
+    
+    Returns:
+        The exposition of every metric family
+    """
+    families = get_service_metrics(request).families() + await _runtime_families(request)
+    return Response(render(families), media_type=CONTENT_TYPE)
@@ -1,9 +1,16 @@
-"""Chat API endpoints for WebSocket communication."""
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+"""Chat API endpoints for WebSocket and HTTP communication."""
+from typing import Union
 
+from fastapi import APIRouter, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from src.handlers.batch import BatchCompletionHandler
+from src.handlers.http import HTTPCompletionHandler
 from src.handlers.websocket import WebSocketHandler
-from src.api.dependencies import get_websocket_handler
+from src.api.dependencies import get_batch_handler, get_http_handler, get_websocket_handler
+from src.models.chat import BatchCompletionRequest, ChatCompletionResponse, HTTPChatCompletionRequest
 from src.utils.app_resources import logger
+from src.utils.logs import SAMPLED
 
 router = APIRouter(prefix="/api/v1")
 
@@ -13,16 +20,66 @@ async def websocket_endpoint(
     websocket: WebSocket,
     handler: WebSocketHandler = Depends(get_websocket_handler)
 ):
-    """WebSocket endpoint for chat completions with streaming responses."""
-    await websocket.accept()
+    """WebSocket endpoint for chat completions with streaming responses.
+    
+    Each message starts its own request task, so the socket keeps being read
+    while earlier completions are still streaming. The wire format (JSON or
+    MessagePack) is negotiated through the WebSocket subprotocol header.
+    """
+    await handler.accept(websocket)
     
     try:
         while True:
             # Receive message from WebSocket
-            data = await websocket.receive_text()
+            data = await handler.receive(websocket)
             
-            # Process the message using our handler
-            await handler.process_message(websocket, data)
+            # Start processing the message without waiting for it to finish
+            await handler.dispatch_message(websocket, data)
     
     except WebSocketDisconnect:
-        logger.info("WebSocket client disconnected") 
\ No newline at end of file
+        logger.info("WebSocket client disconnected", extra=SAMPLED)
+    finally:
+        # Stop any completions that are still streaming to this client
+        await handler.shutdown() 
+
+
+@router.post("/chat/completions", response_model=ChatCompletionResponse)
+async def chat_completions_endpoint(
+    chat_request: HTTPChatCompletionRequest,
+    request: Request,
+    handler: HTTPCompletionHandler = Depends(get_http_handler)
+) -> Union[ChatCompletionResponse, StreamingResponse]:
+    """HTTP endpoint for a single chat completion.
+    
+    With ``stream`` set (the default) the response is streamed as
+    Server-Sent Events carrying the chunks of the WebSocket protocol.
+    Otherwise the upstream is asked for a non-streamed completion, returned
+    as one JSON body. Errors before the first chunk set the response status.
+    """
+    await handler.open(request, chat_request)
+    if chat_request.stream:
+        return StreamingResponse(
+            handler.events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return await handler.collect()
+
+
+@router.post("/chat/completions/batch")
+async def batch_completions_endpoint(
+    batch: BatchCompletionRequest,
+    request: Request,
+    handler: BatchCompletionHandler = Depends(get_batch_handler)
+) -> StreamingResponse:
+    """HTTP endpoint running a batch of chat completions.
+    
+    Up to ``parallelism`` requests run at once, each through the same
+    admission, cache and metrics path as the WebSocket. Results are streamed
+    as NDJSON in completion order, one ``BatchCompletionResult`` per line
+    with either the content and metrics or the error of its request.
+    """
+    return StreamingResponse(
+        handler.run(request, batch.requests, batch.parallelism),
+        media_type="application/x-ndjson"
+    )
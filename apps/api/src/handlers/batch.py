@@ -0,0 +1,168 @@
+"""Batches of chat completions run with bounded parallelism."""
+import asyncio
+from itertools import islice
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+from starlette.requests import Request
+
+from src.handlers.websocket import WebSocketHandler
+from src.models.chat import BatchCompletionResult, ChatCompletionRequest
+from src.settings import settings
+from src.utils.admission import AdmissionRejected
+from src.utils.app_resources import logger
+
+
+class BatchCompletionHandler(WebSocketHandler):
+    """Handler running the requests of one batch and reporting each as it completes.
+
+    Every request goes through the pipeline of WebSocketHandler: admission,
+    cache, conversations, routing and metrics. At most the parallelism of
+    the batch run at once, and the global admission gate still applies on
+    top of it. A request refused by its client's rate
+    limits waits out the retry hint and tries again, for at most
+    BATCH_RATE_LIMIT_MAX_WAIT seconds, so that a batch is paced rather than
+    failed by the limits it is meant to respect. Deltas are collected per
+    request, and a result is emitted once its final chunk or error arrives.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        """Initialize the handler with the dependencies of WebSocketHandler."""
+        super().__init__(*args, **kwargs)
+        self._indexes: Dict[str, int] = {}
+        self._parts: Dict[str, List[str]] = {}
+        self._results: Optional[asyncio.Queue] = None
+
+    async def send_chunk(
+        self,
+        websocket: Any,
+        request_id: str,
+        content: str,
+        finished: bool,
+        metrics: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Collect a chunk, reporting the request once its final chunk arrives.
+
+        Args:
+            websocket: Unused, the HTTP request of the batch
+            request_id: Unique identifier for the request
+            content: Text content of the chunk
+            finished: Flag indicating if this is the final chunk
+            metrics: Optional performance metrics to include
+        """
+        parts = self._parts.setdefault(request_id, [])
+        parts.append(content)
+        if finished:
+            self._report(BatchCompletionResult(
+                index=self._indexes[request_id],
+                request_id=request_id,
+                content="".join(parts),
+                metrics=metrics
+            ))
+
+    async def handle_error(
+        self,
+        websocket: Any,
+        request_data: Dict[str, Any],
+        error: Exception
+    ) -> None:
+        """Report the error that ended a request of the batch.
+
+        Args:
+            websocket: Unused, the HTTP request of the batch
+            request_data: The original request data
+            error: The exception that was raised
+        """
+        logger.error("Error processing request: %s", error)
+        request_id = str(request_data.get("request_id", "unknown"))
+        if request_id in self._indexes:
+            self._report(BatchCompletionResult(
+                index=self._indexes[request_id],
+                request_id=request_id,
+                error=str(error),
+                retry_after=getattr(error, "retry_after", None)
+            ))
+
+    async def run(
+        self,
+        request: Request,
+        chat_requests: List[ChatCompletionRequest],
+        parallelism: Optional[int] = None
+    ) -> AsyncGenerator[str, None]:
+        """Run every request of a batch and yield their results as NDJSON lines.
+
+        Results come in completion order and carry the index of their
+        request in the batch. When the client goes away, the requests still
+        running or waiting are cancelled.
+
+        Args:
+            request: The HTTP request of the batch
+            chat_requests: The requests of the batch, with unique request ids
+            parallelism: Requests run at once, capped by BATCH_MAX_PARALLELISM
+
+        Yields:
+            One JSON line per request
+        """
+        self.client_id = self._get_client_id(request)
+        self.max_concurrent_requests = min(
+            parallelism or settings.BATCH_DEFAULT_PARALLELISM, settings.BATCH_MAX_PARALLELISM
+        )
+        self._results = asyncio.Queue()
+        self._indexes = {chat_request.request_id: index for index, chat_request in enumerate(chat_requests)}
+        # Requests are started as earlier ones finish, so that those waiting
+        # are neither charged to the rate limits nor holding tasks yet
+        waiting = iter(chat_requests)
+        try:
+            for chat_request in islice(waiting, self.max_concurrent_requests):
+                self._start_request(request, chat_request)
+            for _ in chat_requests:
+                result = await self._results.get()
+                for chat_request in islice(waiting, 1):
+                    self._start_request(request, chat_request)
+                yield result.model_dump_json(exclude_none=True) + "\n"
+        finally:
+            await self.shutdown()
+
+    async def _check_rate(self, chat_request: ChatCompletionRequest) -> None:
+        """Charge a request to its client's rate limits, waiting while they refuse it.
+
+        Args:
+            chat_request: The validated chat completion request
+
+        Raises:
+            AdmissionRejected: When the limits still refuse the request after
+                BATCH_RATE_LIMIT_MAX_WAIT seconds
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.BATCH_RATE_LIMIT_MAX_WAIT
+        while True:
+            try:
+                await super()._check_rate(chat_request)
+                return
+            except AdmissionRejected as e:
+                if e.retry_after is None or loop.time() + e.retry_after > deadline:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    def _report(self, result: BatchCompletionResult) -> None:
+        """Emit the result of a request, once.
+
+        Args:
+            result: The outcome of the request
+        """
+        if self._indexes.pop(result.request_id, None) is not None:
+            self._parts.pop(result.request_id, None)
+            self._results.put_nowait(result)
+
+    def _forget_request(self, request_id: str) -> None:
+        """Drop a finished request, reporting it if it ended without a result.
+
+        Args:
+            request_id: Unique identifier for the request
+        """
+        super()._forget_request(request_id)
+        if request_id in self._indexes:
+            self._report(BatchCompletionResult(
+                index=self._indexes[request_id],
+                request_id=request_id,
+                error="The request ended without a response"
+            ))
@@ -0,0 +1,205 @@
+"""Chat completions over plain HTTP, sharing the WebSocket handler's pipeline."""
+import asyncio
+import math
+from typing import Any, AsyncGenerator, Dict, Optional
+
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from src.handlers.websocket import WebSocketHandler
+from src.models.chat import ChatCompletionRequest, ChatCompletionResponse
+from src.settings import settings
+from src.utils.admission import AdmissionRejected
+from src.utils.app_resources import logger
+from src.utils.send_queue import FRAME_ERROR, OutboundFrame
+from src.utils.stream_watchdog import StreamStalled
+from src.utils.tracing import trace_context_from_headers
+
+
+def _http_error(error: Optional[Exception]) -> HTTPException:
+    """Map an error of the pipeline to the HTTP response that reports it.
+
+    Args:
+        error: The error reported by the pipeline, None if it ended without a response
+
+    Returns:
+        The exception FastAPI turns into the error response
+    """
+    if error is None:
+        return HTTPException(status_code=500, detail="The request ended without a response")
+    if isinstance(error, AdmissionRejected):
+        headers = None
+        if error.retry_after is not None:
+            headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))}
+        return HTTPException(status_code=429, detail=str(error), headers=headers)
+    from openai import APIError, APIStatusError
+
+    if isinstance(error, APIStatusError) and 400 <= error.status_code < 500 and error.status_code != 429:
+        return HTTPException(status_code=error.status_code, detail=str(error))
+    if isinstance(error, (APIError, StreamStalled)):
+        return HTTPException(status_code=502, detail=str(error))
+    if isinstance(error, ValueError):
+        return HTTPException(status_code=400, detail=str(error))
+    return HTTPException(status_code=500, detail=str(error))
+
+
+class HTTPCompletionHandler(WebSocketHandler):
+    """Handler serving a single chat completion over HTTP.
+
+    Validation, admission, caching, conversations, routing and metrics are
+    those of WebSocketHandler. The frames it would write to a socket are put
+    on a bounded queue instead, which is read either as Server-Sent Events
+    or collected into one JSON response. A full queue pauses the upstream
+    reads, like the pause slow-consumer policy of the WebSocket.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        """Initialize the handler with the dependencies of WebSocketHandler."""
+        super().__init__(*args, **kwargs)
+        self._frames: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._first: Optional[OutboundFrame] = None
+        self._error: Optional[Exception] = None
+
+    async def send_chunk(
+        self,
+        websocket: Any,
+        request_id: str,
+        content: str,
+        finished: bool,
+        metrics: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """Queue a chunk of the response for the HTTP client.
+
+        Args:
+            websocket: Unused, the HTTP request the chunk answers
+            request_id: Unique identifier for the request
+            content: Text content to send to the client
+            finished: Flag indicating if this is the final chunk
+            metrics: Optional performance metrics to include
+        """
+        await self._frames.put(
+            OutboundFrame(str(request_id), content=content, finished=finished, metrics=metrics)
+        )
+
+    async def handle_error(
+        self,
+        websocket: Any,
+        request_data: Dict[str, Any],
+        error: Exception
+    ) -> None:
+        """Queue the error that ended the request.
+
+        Args:
+            websocket: Unused, the HTTP request the error answers
+            request_data: The original request data
+            error: The exception that was raised
+        """
+        logger.error("Error processing request: %s", error)
+        self._error = error
+        request_id = str(request_data.get("request_id", "unknown"))
+        await self._frames.put(
+            OutboundFrame(
+                request_id,
+                kind=FRAME_ERROR,
+                content=str(error),
+                retry_after=getattr(error, "retry_after", None)
+            )
+        )
+
+    async def open(self, request: Request, chat_request: ChatCompletionRequest) -> None:
+        """Start the request and wait for its first frame.
+
+        Errors that happen before anything is produced, such as an admission
+        rejection or an upstream that refuses the request, are raised here so
+        that they become the status of the HTTP response. A request without a
+        trace id continues the trace of its traceparent header, if any, and
+        is traced when the caller sampled it.
+
+        Args:
+            request: The HTTP request
+            chat_request: The validated chat completion request
+
+        Raises:
+            HTTPException: When the request failed before its first frame
+        """
+        self.client_id = self._get_client_id(request)
+        if chat_request.trace_id is None:
+            trace_context = trace_context_from_headers(request.headers)
+            if trace_context is not None:
+                chat_request.trace_id, self.trace_sampled = trace_context
+        self._frames = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_MAX_FRAMES)
+        self._task = self._start_request(request, chat_request)
+        self._first = await self._next_frame()
+        if self._first is None or self._first.kind == FRAME_ERROR:
+            await self.shutdown()
+            raise _http_error(self._error)
+
+    async def events(self) -> AsyncGenerator[str, None]:
+        """Yield the frames of the request as Server-Sent Events.
+
+        Chunks are sent as message events carrying the JSON of a WebSocket
+        chunk, and an error after the stream started as an error event. When
+        the client goes away, the request is cancelled and its upstream
+        stream closed.
+
+        Yields:
+            The text of each event
+        """
+        try:
+            frame = self._first
+            while frame is not None:
+                if frame.kind == FRAME_ERROR:
+                    error = self.codec.encode_error(frame.request_id, frame.content, frame.retry_after)
+                    yield f"event: error\ndata: {error}\n\n"
+                    break
+                chunk = self.codec.encode_chunk(frame.request_id, frame.content, frame.finished, frame.metrics)
+                yield f"data: {chunk}\n\n"
+                if frame.finished:
+                    break
+                frame = await self._next_frame()
+        finally:
+            await self.shutdown()
+
+    async def collect(self) -> ChatCompletionResponse:
+        """Wait for the whole response of the request.
+
+        Returns:
+            The content of the response and its metrics
+
+        Raises:
+            HTTPException: When the request failed
+        """
+        parts = []
+        try:
+            frame = self._first
+            while frame is not None and frame.kind != FRAME_ERROR:
+                parts.append(frame.content)
+                if frame.finished:
+                    return ChatCompletionResponse(
+                        request_id=frame.request_id,
+                        content="".join(parts),
+                        metrics=frame.metrics
+                    )
+                frame = await self._next_frame()
+            raise _http_error(self._error)
+        finally:
+            await self.shutdown()
+
+    async def _next_frame(self) -> Optional[OutboundFrame]:
+        """Return the next frame of the request, or None once it ended without more.
+
+        Returns:
+            The next queued frame, or None
+        """
+        if self._frames.empty() and self._task.done():
+            return None
+        getter = asyncio.ensure_future(self._frames.get())
+        try:
+            await asyncio.wait((getter, self._task), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not getter.done():
+                getter.cancel()
+        if getter.done() and not getter.cancelled():
+            return getter.result()
+        return self._frames.get_nowait() if not self._frames.empty() else None
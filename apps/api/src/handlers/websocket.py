@@ -1,26 +1,272 @@
-import json
+import asyncio
+import inspect
 import time
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
 
 from fastapi import WebSocket
+from starlette.requests import HTTPConnection
 from starlette.websockets import WebSocketDisconnect
-from openai.types.chat import ChatCompletionChunk
 
-from src.models.chat import ChatCompletionRequest, ChatMessage, ErrorResponse, StreamChunk
-from src.adapters.openai import OpenAIAdapter
+from src.models.chat import (
+    CancelRequest,
+    ChatCompletionRequest,
+    CoalesceOptions,
+    ChatMessage,
+    StreamMetrics,
+)
+from src.adapters.router import ProviderRouter, RoutedResponse, RoutedStream
+from src.settings import settings
+from src.utils.admission import AdmissionController, AdmissionRejected
 from src.utils.app_resources import logger
+from src.utils.coalescing import coalesce_deltas
+from src.utils.completion_cache import CompletionCache, completion_cache_key, replay_chunks
+from src.utils.conversation_store import ConversationStore, new_conversation_id
+from src.utils.logs import SAMPLED
+from src.utils.metrics import ServiceMetrics, StreamRecorder
+from src.utils.send_queue import (
+    FRAME_ERROR,
+    FRAME_RELEASE,
+    SLOW_CONSUMER_CLOSE_CODE,
+    OutboundFrame,
+    SendQueue,
+    SendQueueMetrics,
+)
+from src.utils.serialization import FrameCodec, FrameDecodeError, JsonCodec, negotiate_codec
+from src.utils.single_flight import SingleFlightGroup
+from src.utils.stream_watchdog import watch_deltas
+from src.utils.token_budget import TokenBudget, estimate_tokens, strip_pins
+from src.utils.tracing import Trace, Tracer, activate, current_trace, record_span, span
+
+# Reasons a request task can be cancelled for
+CANCEL_REASON_CLIENT = "client"
+CANCEL_REASON_DISCONNECT = "disconnect"
+
+
+def _milliseconds(seconds: Optional[float]) -> Optional[float]:
+    """Convert a duration to milliseconds rounded to a tenth, keeping None."""
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+@dataclass
+class StreamProgress:
+    """Progress of a streamed completion, still readable after it is interrupted.
+    
+    Times are read from the monotonic clock, so they are only meaningful
+    relative to each other.
+    """
+    parts: List[str] = field(default_factory=list)
+    complete: bool = False
+    cached: bool = False
+    recorder: Optional[StreamRecorder] = None
+    started_at: float = field(default_factory=time.monotonic)
+    queue_wait: Optional[float] = None
+    connect_time: Optional[float] = None
+    connected_at: Optional[float] = None
+    first_token_at: Optional[float] = None
+    last_token_at: Optional[float] = None
+    gaps: List[float] = field(default_factory=list)
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    provider: Optional[str] = None
+    failovers: Optional[int] = None
+    conversation_id: Optional[str] = None
+
+    def add(self, content: str) -> None:
+        """Record a delta and when it arrived."""
+        now = time.monotonic()
+        self.parts.append(content)
+        if self.last_token_at is None:
+            self.first_token_at = now
+        else:
+            self.gaps.append(now - self.last_token_at)
+        self.last_token_at = now
+        if self.recorder is not None and not self.cached:
+            self.recorder.delta(now)
+
+    def set_usage(self, usage: Any) -> None:
+        """Record the token usage reported at the end of an upstream stream."""
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    def set_route(self, routed: Any) -> None:
+        """Record which provider serves the first upstream call made for the request."""
+        if isinstance(routed, (RoutedStream, RoutedResponse)) and self.provider is None:
+            self.provider = routed.provider.name
+            self.failovers = routed.failovers
+
+    @property
+    def content(self) -> str:
+        """The text streamed so far."""
+        return "".join(self.parts)
+
+    @property
+    def tokens(self) -> int:
+        """The number of deltas streamed so far, one per upstream token."""
+        return len(self.parts)
 
 
 class WebSocketHandler:
-    """Handler for WebSocket operations related to chat completion."""
+    """Handler for WebSocket operations related to chat completion.
+    
+    One handler serves one connection. Every request on the connection runs as
+    its own task, so several completions can stream at the same time while
+    the socket keeps being read.
+    """
 
-    def __init__(self, openai_adapter: OpenAIAdapter):
+    def __init__(
+        self,
+        router: ProviderRouter,
+        max_concurrent_requests: Optional[int] = None,
+        max_pending_requests: Optional[int] = None,
+        codec: Optional[FrameCodec] = None,
+        completion_cache: Optional[CompletionCache] = None,
+        single_flight: Optional[SingleFlightGroup] = None,
+        conversation_store: Optional[ConversationStore] = None,
+        token_budget: Optional[TokenBudget] = None,
+        admission: Optional[AdmissionController] = None,
+        send_queue_metrics: Optional[SendQueueMetrics] = None,
+        service_metrics: Optional[ServiceMetrics] = None,
+        tracer: Optional[Tracer] = None,
+    ):
         """Initialize the WebSocket handler with dependencies.
         
         Args:
-            openai_adapter: Adapter for interacting with the OpenAI API
+            router: Router picking the OpenAI-compatible provider of each completion
+            max_concurrent_requests: Completions allowed to stream at once on
+                this connection, defaults to the one in settings
+            max_pending_requests: Requests allowed to be running or waiting
+                for a slot on this connection, defaults to the one in settings
+            codec: Wire format of the connection, negotiated in accept and
+                JSON until then
+            completion_cache: Optional cache of completed responses
+            single_flight: Optional group sharing upstream streams between
+                identical deterministic requests
+            conversation_store: Optional server-side store of conversation
+                histories, required for requests that use a conversation
+            token_budget: Optional manager fitting requests into the context
+                window of their model
+            admission: Optional controller of per-client rate limits and
+                the worker-wide concurrency gate
+            send_queue_metrics: Optional worker-wide counters of the
+                connection's send queue
+            service_metrics: Worker-wide latency histograms and request
+                counters, private to the handler when not given
+            tracer: Optional tracer recording the stages of sampled requests
+        """
+        self.router = router
+        self.codec = codec or JsonCodec()
+        self.completion_cache = completion_cache
+        self.single_flight = single_flight
+        self.conversation_store = conversation_store
+        self.token_budget = token_budget
+        self.admission = admission
+        self.send_queue_metrics = send_queue_metrics
+        self.service_metrics = service_metrics if service_metrics is not None else ServiceMetrics()
+        self.tracer = tracer
+        # Sampling decision of the caller's traceparent header, None to sample by rate
+        self.trace_sampled: Optional[bool] = None
+        self.client_id = "unknown"
+        self.max_concurrent_requests = max_concurrent_requests or settings.WS_MAX_CONCURRENT_REQUESTS
+        self.max_pending_requests = max_pending_requests or settings.WS_MAX_PENDING_REQUESTS
+        self._active_requests: Dict[str, asyncio.Task] = {}
+        self._cancel_reasons: Dict[str, str] = {}
+        self._received_at: Dict[str, float] = {}
+        # Decode start, decode end and validation end of the last message parsed
+        self._parse_timings: Optional[Tuple[float, float, float]] = None
+        self._request_slots: Optional[asyncio.Semaphore] = None
+        self._send_queue: Optional[SendQueue] = None
+
+    async def accept(self, websocket: WebSocket) -> None:
+        """Accept the connection with the wire format the client prefers.
+        
+        From then on frames go through a bounded send queue drained by a
+        single writer, so a slow client does not hold up upstream reads.
+        
+        Args:
+            websocket: The WebSocket connection to accept
+        """
+        self.codec = negotiate_codec(websocket.scope.get("subprotocols", []))
+        self.client_id = self._get_client_id(websocket)
+        await websocket.accept(subprotocol=self.codec.subprotocol)
+        self.service_metrics.active_websockets.inc()
+        self._send_queue = SendQueue(
+            lambda frame: self._write_frame(websocket, frame),
+            max_frames=settings.WS_SEND_QUEUE_MAX_FRAMES,
+            policy=settings.WS_SLOW_CONSUMER_POLICY,
+            metrics=self.send_queue_metrics,
+            close=lambda: websocket.close(
+                code=SLOW_CONSUMER_CLOSE_CODE,
+                reason="Client is not reading fast enough"
+            )
+        )
+        self._send_queue.start()
+
+    def _get_client_id(self, connection: HTTPConnection) -> str:
+        """Identify the client of a connection for rate limiting.
+        
+        Args:
+            connection: The WebSocket connection or HTTP request
+            
+        Returns:
+            The client address, taken from X-Forwarded-For when the server
+            sits behind a trusted proxy
+        """
+        if settings.ADMISSION_TRUST_FORWARDED_FOR:
+            forwarded_for = connection.headers.get("x-forwarded-for")
+            if forwarded_for:
+                return forwarded_for.split(",")[0].strip()
+        return connection.client.host if connection.client else "unknown"
+
+    async def receive(self, websocket: WebSocket) -> Union[str, bytes]:
+        """Receive the next text or binary message from the client.
+        
+        Args:
+            websocket: The active WebSocket connection
+            
+        Returns:
+            The raw payload of the message
+            
+        Raises:
+            WebSocketDisconnect: When the client has disconnected
+        """
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+        text = message.get("text")
+        return text if text is not None else message.get("bytes", b"")
+
+    async def _send_frame(self, websocket: WebSocket, frame: Union[str, bytes]) -> None:
+        """Send an encoded frame as a text or binary message.
+        
+        Args:
+            websocket: The active WebSocket connection
+            frame: The frame payload produced by the codec
         """
-        self.openai_adapter = openai_adapter
+        if self.codec.binary:
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+    async def _write_frame(self, websocket: WebSocket, frame: OutboundFrame) -> None:
+        """Encode a queued frame and send it, called by the send queue's writer.
+        
+        Args:
+            websocket: The active WebSocket connection
+            frame: The next frame of the send queue
+        """
+        if frame.kind == FRAME_RELEASE:
+            self.codec.release(frame.request_id)
+        elif frame.kind == FRAME_ERROR:
+            await self._send_frame(
+                websocket,
+                self.codec.encode_error(frame.request_id, frame.content, frame.retry_after)
+            )
+        else:
+            await self._send_frame(
+                websocket,
+                self.codec.encode_chunk(frame.request_id, frame.content, frame.finished, frame.metrics)
+            )
 
     async def send_chunk(
         self,
@@ -32,6 +278,9 @@ class WebSocketHandler:
     ) -> None:
         """Send a chunk of the response to the WebSocket client.
         
+        The frame is encoded straight to the connection's wire format by its
+        codec rather than through a pydantic model and send_json.
+        
         Args:
             websocket: The active WebSocket connection
             request_id: Unique identifier for the request
@@ -40,19 +289,20 @@ class WebSocketHandler:
             metrics: Optional performance metrics to include
         """
         try:
-            await websocket.send_json(
-                StreamChunk(
-                    request_id=str(request_id),
-                    content=content,
-                    finished=finished,
-                    metrics=metrics
-                ).model_dump()
-            )
+            if self._send_queue is not None:
+                await self._send_queue.put(
+                    OutboundFrame(str(request_id), content=content, finished=finished, metrics=metrics)
+                )
+            else:
+                await self._send_frame(
+                    websocket,
+                    self.codec.encode_chunk(str(request_id), content, finished, metrics)
+                )
         except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected during send for request {request_id}")
+            logger.info("WebSocket disconnected during send for request %s", request_id, extra=SAMPLED)
             raise
         except Exception as e:
-            logger.error(f"Error sending chunk to WebSocket for request {request_id}: {str(e)}")
+            logger.error("Error sending chunk to WebSocket for request %s: %s", request_id, e)
             raise
 
     async def handle_error(
@@ -68,53 +318,203 @@ class WebSocketHandler:
             request_data: The original request data
             error: The exception that was raised
         """
-        logger.error(f"Error processing request: {str(error)}")
-        request_id = request_data.get("request_id", "unknown")
+        logger.error("Error processing request: %s", error)
+        request_id = request_data.get("request_id", "unknown") if isinstance(request_data, dict) else "unknown"
         
         # Ensure request_id is a string
         request_id = str(request_id) if hasattr(request_id, "__str__") else "unknown"
         
-        error_response = ErrorResponse(
-            request_id=request_id,
-            error=str(error)
-        )
-        
+        retry_after = getattr(error, "retry_after", None)
         try:
-            await websocket.send_json(error_response.model_dump())
+            if self._send_queue is not None:
+                await self._send_queue.put(
+                    OutboundFrame(request_id, kind=FRAME_ERROR, content=str(error), retry_after=retry_after)
+                )
+            else:
+                await self._send_frame(websocket, self.codec.encode_error(request_id, str(error), retry_after))
         except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected during error handling for request {request_id}")
+            logger.info("WebSocket disconnected during error handling for request %s", request_id, extra=SAMPLED)
         except RuntimeError as re:
             # This happens when trying to send after connection is closed
-            logger.info(f"Cannot send error response: {str(re)}")
+            logger.info("Cannot send error response: %s", re)
         except Exception as e:
-            logger.error(f"Error sending error response for request {request_id}: {str(e)}")
+            logger.error("Error sending error response for request %s: %s", request_id, e)
 
-    def _prepare_metrics(self, start_time: float, content_length: int) -> Dict[str, int]:
+    def _prepare_metrics(
+        self,
+        progress: StreamProgress,
+        content_length: int,
+        status: str = "completed"
+    ) -> Dict[str, Any]:
         """Calculate performance metrics for the request.
         
         Args:
-            start_time: Timestamp when processing started
+            progress: The timings and output of the request
             content_length: Length of the generated content
+            status: How the request ended, "completed" or "cancelled"
             
         Returns:
-            Dictionary containing performance metrics
+            The StreamMetrics of the request as the final chunk carries them,
+            without the fields that were not measured
         """
-        response_time = int((time.time() - start_time) * 1000)  # Convert to milliseconds
-        return {
-            "responseTime": response_time,
-            "length": content_length
-        }
+        started_at = progress.started_at
+        gaps = progress.gaps
+        traced = current_trace()
+        metrics = StreamMetrics(
+            response_time=int((time.monotonic() - started_at) * 1000),
+            length=content_length,
+            tokens=progress.tokens,
+            status=status,
+            cached=progress.cached,
+            queue_wait=_milliseconds(progress.queue_wait),
+            connect_time=_milliseconds(progress.connect_time),
+            time_to_first_token=_milliseconds(
+                progress.first_token_at - started_at if progress.first_token_at is not None else None
+            ),
+            mean_chunk_gap=_milliseconds(sum(gaps) / len(gaps) if gaps else None),
+            p95_chunk_gap=_milliseconds(sorted(gaps)[int(0.95 * (len(gaps) - 1))] if gaps else None),
+            prompt_tokens=progress.prompt_tokens,
+            completion_tokens=progress.completion_tokens,
+            provider=progress.provider,
+            failovers=progress.failovers,
+            trace_id=traced[0].trace_id if traced is not None else None,
+            conversation_id=progress.conversation_id,
+        )
+        return metrics.model_dump(by_alias=True, exclude_none=True)
     
     def _format_messages_for_openai(self, messages: List[ChatMessage]) -> List[Dict[str, str]]:
         """Convert our message models to the format OpenAI expects.
         
+        Pinned messages also carry a pinned marker for the token budget, which
+        is removed before the request is sent.
+        
         Args:
             messages: List of ChatMessage objects
             
         Returns:
             List of dictionaries in OpenAI's expected format
         """
-        return [{"role": msg.role, "content": msg.content} for msg in messages]
+        return [
+            {"role": msg.role, "content": msg.content, "pinned": True} if msg.pinned
+            else {"role": msg.role, "content": msg.content}
+            for msg in messages
+        ]
+
+    async def _with_history(
+        self,
+        chat_request: ChatCompletionRequest,
+        new_messages: List[Dict[str, str]]
+    ) -> List[Dict[str, str]]:
+        """Prepend the stored history of the request's conversation, if any.
+        
+        A request starting a conversation is given a new id here, so its turn
+        is recorded under an id only the client it is returned to knows.
+        
+        Args:
+            chat_request: The validated chat completion request
+            new_messages: The messages sent with this request, in OpenAI's format
+            
+        Returns:
+            The full list of messages to send upstream
+            
+        Raises:
+            ValueError: When the request uses a conversation but no store is
+                enabled, or its conversation_id is unknown or has expired
+        """
+        if chat_request.conversation_id is None and not chat_request.new_conversation:
+            return new_messages
+        if self.conversation_store is None:
+            raise ValueError("Conversations are not enabled on this server")
+        if chat_request.new_conversation:
+            chat_request.conversation_id = new_conversation_id()
+            logger.info("Starting a conversation for request %s", chat_request.request_id, extra=SAMPLED)
+            return new_messages
+        history = await self.conversation_store.get_history(chat_request.conversation_id)
+        if history is None:
+            raise ValueError("Unknown or expired conversation")
+        return history + new_messages
+
+    async def _fit_to_context(
+        self,
+        chat_request: ChatCompletionRequest,
+        messages: List[Dict[str, str]]
+    ) -> Tuple[List[Dict[str, str]], ChatCompletionRequest]:
+        """Fit the messages and max_tokens of a request into its model's context.
+        
+        Args:
+            chat_request: The validated chat completion request
+            messages: The full list of messages, possibly pinned
+            
+        Returns:
+            The messages to send upstream and the request with its fitted max_tokens
+            
+        Raises:
+            ContextWindowExceeded: When the messages that must be kept do not fit
+        """
+        if self.token_budget is None:
+            return strip_pins(messages), chat_request
+        fitted = await self.token_budget.fit(messages, chat_request.model, chat_request.max_tokens)
+        if fitted.max_tokens != chat_request.max_tokens:
+            chat_request = chat_request.model_copy(update={"max_tokens": fitted.max_tokens})
+        return fitted.messages, chat_request
+
+    def _get_cache_key(
+        self,
+        chat_request: ChatCompletionRequest,
+        messages: List[Dict[str, str]]
+    ) -> Optional[str]:
+        """Return the cache key of a request, or None if it must not use the cache.
+        
+        Only deterministic requests (temperature 0) are cached unless the
+        client opts in with cache=True, since any other request is expected
+        to get its own sample, like for _get_flight_key.
+        
+        Args:
+            chat_request: The validated chat completion request
+            messages: The messages in the format OpenAI expects
+            
+        Returns:
+            The cache key, or None when caching is disabled for this request
+        """
+        if self.completion_cache is None or chat_request.cache is False:
+            return None
+        if chat_request.temperature != 0 and chat_request.cache is not True:
+            return None
+        return completion_cache_key(
+            chat_request.model,
+            messages,
+            chat_request.temperature,
+            chat_request.max_tokens
+        )
+
+    def _get_flight_key(
+        self,
+        chat_request: ChatCompletionRequest,
+        messages: List[Dict[str, str]],
+        cache_key: Optional[str] = None
+    ) -> Optional[str]:
+        """Return the single-flight key of a request, or None if it must not share.
+        
+        Only deterministic streamed requests (temperature 0) share an
+        upstream stream, since any other request is expected to get its own
+        sample and non-streamed requests make no stream to share.
+        
+        Args:
+            chat_request: The validated chat completion request
+            messages: The messages in the format OpenAI expects
+            cache_key: The cache key of the request, reused when already computed
+            
+        Returns:
+            The key identical requests share, or None
+        """
+        if self.single_flight is None or chat_request.temperature != 0 or not chat_request.stream:
+            return None
+        return cache_key or completion_cache_key(
+            chat_request.model,
+            messages,
+            chat_request.temperature,
+            chat_request.max_tokens
+        )
 
     async def handle_chat_completion(
         self,
@@ -133,114 +533,811 @@ class WebSocketHandler:
         Raises:
             Exception: Any error that occurs during processing is logged and re-raised
         """
+        progress = StreamProgress(recorder=self.service_metrics.start_stream(chat_request.model))
+        received_at = self._received_at.get(chat_request.request_id)
+        if received_at is not None:
+            progress.queue_wait = progress.started_at - received_at
         try:
-            start_time = time.time()
-            
             # Convert our message models to the format OpenAI expects
-            messages = self._format_messages_for_openai(chat_request.messages)
+            new_messages = self._format_messages_for_openai(chat_request.messages)
+            with span("history"):
+                messages = await self._with_history(chat_request, new_messages)
+            with span("fit_context"):
+                messages, chat_request = await self._fit_to_context(chat_request, messages)
             
-            # Get streaming response from OpenAI
-            stream = await self.openai_adapter.generate_chat_completion(
-                messages=messages,
-                model=chat_request.model,
-                temperature=chat_request.temperature,
-                max_tokens=chat_request.max_tokens,
-                stream=True
-            )
-            
-            # Process the streaming response
-            collected_content = await self._process_stream(websocket, chat_request.request_id, stream)
+            cache_key = self._get_cache_key(chat_request, messages)
+            cached_chunks = None
+            if cache_key:
+                with span("cache_lookup") as lookup:
+                    cached_chunks = await self.completion_cache.get(cache_key)
+                    if lookup is not None:
+                        lookup.set(hit=cached_chunks is not None)
             
-            # Check if connection is still active before sending final message
-            metrics = self._prepare_metrics(start_time, len(collected_content))
-            try:
-                await self.send_chunk(
+            if cached_chunks is not None:
+                # Replay the stored response through the normal streaming path
+                progress.cached = True
+                if not chat_request.stream:
+                    cached_chunks = ["".join(cached_chunks)]
+                collected_content = await self._send_deltas(
                     websocket,
                     chat_request.request_id,
-                    "",
-                    True,
-                    metrics
+                    self._iter_cached(cached_chunks, progress),
+                    progress,
+                    chat_request.coalesce
                 )
+            else:
+                flight_key = self._get_flight_key(chat_request, messages, cache_key)
+                if not chat_request.stream:
+                    # Ask the upstream for the whole response and send it as one delta
+                    collected_content = await self._send_deltas(
+                        websocket,
+                        chat_request.request_id,
+                        self._track_deltas(self._complete_deltas(chat_request, messages, progress), progress),
+                        progress,
+                        chat_request.coalesce
+                    )
+                elif flight_key:
+                    # Join an identical request already streaming, or lead a new one
+                    collected_content = await self._process_shared_stream(
+                        websocket,
+                        chat_request.request_id,
+                        flight_key,
+                        lambda: self._upstream_deltas(chat_request, messages, progress=progress),
+                        progress,
+                        chat_request.coalesce
+                    )
+                else:
+                    # Get streaming response from OpenAI
+                    connect_started_at = time.monotonic()
+                    with span("upstream_connect"):
+                        stream = await self.router.generate_chat_completion(
+                            messages=messages,
+                            model=chat_request.model,
+                            temperature=chat_request.temperature,
+                            max_tokens=chat_request.max_tokens,
+                            stream=True
+                        )
+                    
+                    progress.connected_at = time.monotonic()
+                    progress.connect_time = progress.connected_at - connect_started_at
+                    progress.set_route(stream)
+                    
+                    # Process the streaming response, hedging it if its first token is late
+                    self.service_metrics.upstream_streams.inc()
+                    try:
+                        collected_content = await self._process_stream(
+                            websocket,
+                            chat_request.request_id,
+                            stream,
+                            progress,
+                            chat_request.coalesce,
+                            open_hedge=lambda: self._upstream_deltas(
+                                chat_request, messages, watched=False, progress=progress
+                            )
+                        )
+                    finally:
+                        self.service_metrics.upstream_streams.dec()
+                
+                if cache_key and progress.complete and progress.parts:
+                    with span("cache_store"):
+                        await self.completion_cache.set(cache_key, progress.parts)
+            
+            if chat_request.conversation_id is not None and progress.complete:
+                # Record the turn before the final chunk so the next one sees it
+                with span("conversation_append"):
+                    await self.conversation_store.append(
+                        chat_request.conversation_id,
+                        new_messages + [{"role": "assistant", "content": collected_content}]
+                    )
+                progress.conversation_id = chat_request.conversation_id
+            
+            if not progress.complete:
+                progress.recorder.disconnected()
+            elif not progress.cached:
+                progress.recorder.completed(progress.tokens)
+            
+            # Check if connection is still active before sending final message
+            self._record_stream_spans(progress)
+            metrics = self._prepare_metrics(progress, len(collected_content))
+            try:
+                with span("final_chunk"):
+                    await self.send_chunk(
+                        websocket,
+                        chat_request.request_id,
+                        "",
+                        True,
+                        metrics
+                    )
                 
                 # Log completion
-                logger.info(f"Completed streaming response for request {chat_request.request_id} in {metrics['responseTime']}ms with {metrics['length']} chars")
+                logger.info(
+                    "Completed streaming response for request %s in %sms with %s chars",
+                    chat_request.request_id, metrics["responseTime"], metrics["length"], extra=SAMPLED
+                )
             except WebSocketDisconnect:
-                logger.info(f"WebSocket disconnected before final message for request {chat_request.request_id}")
+                logger.info("WebSocket disconnected before final message for request %s", chat_request.request_id, extra=SAMPLED)
             
             return collected_content
             
         except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected during chat completion for request {chat_request.request_id}")
+            progress.recorder.disconnected()
+            logger.info("WebSocket disconnected during chat completion for request %s", chat_request.request_id, extra=SAMPLED)
             return None
+        except asyncio.CancelledError:
+            self._record_stream_spans(progress)
+            if self._cancel_reasons.get(chat_request.request_id) == CANCEL_REASON_CLIENT:
+                progress.recorder.cancelled()
+                await self._send_cancelled(websocket, chat_request.request_id, progress)
+            else:
+                progress.recorder.disconnected()
+            raise
         except Exception as e:
-            logger.error(f"Error in chat completion: {str(e)}")
+            progress.recorder.failed()
+            logger.error("Error in chat completion: %s", e)
             raise
 
+    def _record_stream_spans(self, progress: StreamProgress) -> None:
+        """Record the wait for the first token and the streaming of the rest, if traced.
+        
+        Args:
+            progress: The timings of the request
+        """
+        if progress.first_token_at is None or progress.cached or current_trace() is None:
+            return
+        record_span("first_token", progress.connected_at or progress.started_at, progress.first_token_at)
+        record_span("stream", progress.first_token_at, progress.last_token_at, tokens=progress.tokens)
+
+    async def _send_cancelled(
+        self,
+        websocket: WebSocket,
+        request_id: str,
+        progress: StreamProgress
+    ) -> None:
+        """Send the final chunk of a request the client cancelled.
+        
+        Args:
+            websocket: The active WebSocket connection
+            request_id: Unique identifier for the request
+            progress: What had been streamed before the cancellation
+        """
+        metrics = self._prepare_metrics(progress, len(progress.content), status="cancelled")
+        try:
+            await self.send_chunk(websocket, request_id, "", True, metrics)
+            logger.info("Cancelled request %s after %s tokens", request_id, progress.tokens, extra=SAMPLED)
+        except WebSocketDisconnect:
+            logger.info("WebSocket disconnected before cancellation message for request %s", request_id, extra=SAMPLED)
+
+    async def _close_stream(self, stream: Any) -> None:
+        """Close the upstream stream so its HTTP response is released right away.
+        
+        Args:
+            stream: The async stream from OpenAI, or any async iterator
+        """
+        close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+        if close is None:
+            return
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.warning("Error closing upstream stream: %s", e)
+
     async def _process_stream(
         self, 
         websocket: WebSocket, 
         request_id: str, 
-        stream: Any
+        stream: Any,
+        progress: Optional[StreamProgress] = None,
+        coalesce: Optional[CoalesceOptions] = None,
+        open_hedge: Optional[Callable[[], AsyncIterator[str]]] = None
     ) -> str:
         """Process the streaming response from OpenAI.
         
+        The stream is watched for its first-token and inter-token deadlines.
+        Deltas are batched into frames by the coalescing stage, with the first
+        token always sent on its own. The upstream stream is always closed on
+        the way out, so a disconnect, a cancellation or a stall stops token
+        generation immediately.
+        
         Args:
             websocket: The active WebSocket connection
             request_id: Unique identifier for the request
             stream: The async stream from OpenAI
+            progress: Optional progress tracker updated as chunks arrive
+            coalesce: Optional per-request coalescing overrides
+            open_hedge: Opens a duplicate upstream request if the first token is late
             
         Returns:
             The complete collected content from all chunks
+            
+        Raises:
+            StreamStalled: When the upstream misses a token deadline
         """
-        collected_content = ""
+        progress = progress if progress is not None else StreamProgress()
+        watched = self._watch_deltas(self._iter_deltas(stream, progress), open_hedge)
+        deltas = self._track_deltas(watched, progress)
         try:
-            async for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    collected_content += content
-                    
-                    # Send the chunk to the client
-                    await self.send_chunk(
-                        websocket, 
-                        request_id, 
-                        content, 
-                        False
-                    )
+            return await self._send_deltas(websocket, request_id, deltas, progress, coalesce)
+        finally:
+            await deltas.aclose()
+            await watched.aclose()
+            await self._close_stream(stream)
+
+    async def _process_shared_stream(
+        self,
+        websocket: WebSocket,
+        request_id: str,
+        flight_key: str,
+        open_source: Callable[[], AsyncIterator[str]],
+        progress: StreamProgress,
+        coalesce: Optional[CoalesceOptions] = None
+    ) -> str:
+        """Stream a response shared with identical requests in flight.
+        
+        The request receives every delta the shared upstream has produced so
+        far, then the live tail. Leaving early only unsubscribes this request;
+        the upstream is closed when its last subscriber leaves.
+        
+        Args:
+            websocket: The active WebSocket connection
+            request_id: Unique identifier for the request
+            flight_key: The key identical requests share
+            open_source: Opens the upstream deltas when no flight is in progress
+            progress: Progress tracker updated as deltas arrive
+            coalesce: Optional per-request coalescing overrides
             
-            return collected_content
+        Returns:
+            The complete collected content from all deltas
+        """
+        subscription = self.single_flight.subscribe(flight_key, open_source)
+        deltas = self._track_deltas(subscription, progress)
+        try:
+            return await self._send_deltas(websocket, request_id, deltas, progress, coalesce)
+        finally:
+            await deltas.aclose()
+            await subscription.aclose()
+
+    async def _upstream_deltas(
+        self,
+        chat_request: ChatCompletionRequest,
+        messages: List[Dict[str, str]],
+        watched: bool = True,
+        progress: Optional[StreamProgress] = None
+    ) -> AsyncGenerator[str, None]:
+        """Open an upstream stream and yield its text deltas until it ends.
+        
+        Args:
+            chat_request: The validated chat completion request
+            messages: The messages in the format OpenAI expects
+            watched: Whether to enforce token deadlines and hedge the stream;
+                hedges themselves are not watched again
+            progress: Optional tracker of the request that opened the stream,
+                which gets its connect time and token usage
+            
+        Yields:
+            The text content of each chunk that carries any
+        """
+        connect_started_at = time.monotonic()
+        with span("upstream_connect", hedge=not watched):
+            stream = await self.router.generate_chat_completion(
+                messages=messages,
+                model=chat_request.model,
+                temperature=chat_request.temperature,
+                max_tokens=chat_request.max_tokens,
+                stream=True
+            )
+        if progress is not None and progress.connect_time is None:
+            progress.connected_at = time.monotonic()
+            progress.connect_time = progress.connected_at - connect_started_at
+        if progress is not None:
+            progress.set_route(stream)
+        self.service_metrics.upstream_streams.inc()
+        deltas = self._iter_deltas(stream, progress)
+        if watched:
+            deltas = self._watch_deltas(
+                deltas,
+                lambda: self._upstream_deltas(chat_request, messages, watched=False, progress=progress)
+            )
+        try:
+            async for content in deltas:
+                yield content
+        finally:
+            await deltas.aclose()
+            await self._close_stream(stream)
+            self.service_metrics.upstream_streams.dec()
+
+    async def _complete_deltas(
+        self,
+        chat_request: ChatCompletionRequest,
+        messages: List[Dict[str, str]],
+        progress: StreamProgress
+    ) -> AsyncGenerator[str, None]:
+        """Request a non-streamed completion and yield its content as a single delta.
+        
+        Token deadlines and hedging do not apply, since nothing arrives
+        before the whole response; the client's read timeout bounds the call.
+        
+        Args:
+            chat_request: The validated chat completion request
+            messages: The messages in the format OpenAI expects
+            progress: Tracker of the request, which gets its connect time,
+                provider and token usage
+            
+        Yields:
+            The content of the response, if it has any
+        """
+        connect_started_at = time.monotonic()
+        with span("upstream_complete"):
+            response = await self.router.generate_chat_completion(
+                messages=messages,
+                model=chat_request.model,
+                temperature=chat_request.temperature,
+                max_tokens=chat_request.max_tokens,
+                stream=False
+            )
+        progress.connected_at = time.monotonic()
+        progress.connect_time = progress.connected_at - connect_started_at
+        progress.set_route(response)
+        if isinstance(response, RoutedResponse):
+            response = response.response
+        if getattr(response, "usage", None) is not None:
+            progress.set_usage(response.usage)
+        content = response.choices[0].message.content if response.choices else None
+        if content:
+            yield content
+
+    def _watch_deltas(
+        self,
+        deltas: AsyncIterator[str],
+        open_hedge: Optional[Callable[[], AsyncIterator[str]]] = None
+    ) -> AsyncGenerator[str, None]:
+        """Apply the configured token deadlines and hedging to upstream deltas.
+        
+        Args:
+            deltas: The text deltas of an upstream stream
+            open_hedge: Opens a duplicate upstream request if the first token is late
+            
+        Returns:
+            The watched deltas
+        """
+        return watch_deltas(
+            deltas,
+            first_token_timeout=settings.STREAM_FIRST_TOKEN_TIMEOUT,
+            inter_token_timeout=settings.STREAM_INTER_TOKEN_TIMEOUT,
+            open_hedge=open_hedge if settings.STREAM_HEDGE_ENABLED else None
+        )
+
+    async def _send_deltas(
+        self,
+        websocket: WebSocket,
+        request_id: str,
+        deltas: AsyncGenerator[str, None],
+        progress: StreamProgress,
+        coalesce: Optional[CoalesceOptions] = None
+    ) -> str:
+        """Coalesce text deltas into frames and send them to the client.
+        
+        Args:
+            websocket: The active WebSocket connection
+            request_id: Unique identifier for the request
+            deltas: The text deltas of the response, tracked in progress
+            progress: Progress tracker of the response
+            coalesce: Optional per-request coalescing overrides
+            
+        Returns:
+            The content collected so far, all of it if the stream completed
+        """
+        window, max_bytes = self._resolve_coalescing(coalesce)
+        frames = coalesce_deltas(deltas, window, max_bytes)
+        # Time spent handing frames to the send path, only measured when traced
+        traced = current_trace() is not None
+        first_sent_at = None
+        sending = 0.0
+        sent_frames = 0
+        try:
+            async for content in frames:
+                if traced:
+                    sent_at = time.monotonic()
+                    first_sent_at = first_sent_at or sent_at
+                # Send the chunk to the client
+                await self.send_chunk(
+                    websocket, 
+                    request_id, 
+                    content, 
+                    False
+                )
+                if traced:
+                    sending += time.monotonic() - sent_at
+                    sent_frames += 1
+            
+            progress.complete = True
+            return progress.content
         except WebSocketDisconnect:
-            logger.info(f"WebSocket disconnected during streaming for request {request_id}")
+            logger.info("WebSocket disconnected during streaming for request %s", request_id, extra=SAMPLED)
             # Return what we collected so far
-            return collected_content
+            return progress.content
         except Exception as e:
-            logger.error(f"Error processing stream for request {request_id}: {str(e)}")
+            logger.error("Error processing stream for request %s: %s", request_id, e)
             raise
+        finally:
+            await frames.aclose()
+            if first_sent_at is not None:
+                record_span("send", first_sent_at, frames=sent_frames, busy_ms=round(sending * 1000, 3))
 
-    async def process_message(
+    async def _iter_deltas(
+        self,
+        stream: Any,
+        progress: Optional[StreamProgress] = None
+    ) -> AsyncGenerator[str, None]:
+        """Yield the non-empty text deltas of an upstream stream.
+        
+        Args:
+            stream: The async stream from OpenAI
+            progress: Optional tracker given the usage report of the stream
+            
+        Yields:
+            The text content of each chunk that carries any
+        """
+        async for chunk in stream:
+            if not chunk.choices:
+                # The usage report comes last, in a chunk without choices
+                if progress is not None and getattr(chunk, "usage", None) is not None:
+                    progress.set_usage(chunk.usage)
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                yield content
+
+    async def _track_deltas(
+        self,
+        deltas: AsyncIterator[str],
+        progress: StreamProgress
+    ) -> AsyncGenerator[str, None]:
+        """Record text deltas in a progress tracker as they pass through.
+        
+        Args:
+            deltas: The source of text deltas
+            progress: Progress tracker updated as deltas arrive
+            
+        Yields:
+            Each delta of the source
+        """
+        async for content in deltas:
+            progress.add(content)
+            yield content
+
+    async def _iter_cached(
+        self,
+        chunks: List[str],
+        progress: StreamProgress
+    ) -> AsyncGenerator[str, None]:
+        """Yield the deltas of a cached response at the configured pace.
+        
+        Args:
+            chunks: The cached deltas in order
+            progress: Progress tracker updated as deltas are replayed
+            
+        Yields:
+            Each cached delta
+        """
+        delay = settings.COMPLETION_CACHE_REPLAY_DELAY_MS / 1000
+        async for content in replay_chunks(chunks, delay):
+            progress.add(content)
+            yield content
+
+    def _resolve_coalescing(self, coalesce: Optional[CoalesceOptions]) -> Tuple[float, int]:
+        """Resolve the coalescing window and size for a request.
+        
+        Args:
+            coalesce: Optional per-request coalescing overrides
+            
+        Returns:
+            The window in seconds and the flush size in bytes
+        """
+        window_ms = settings.STREAM_COALESCE_WINDOW_MS
+        max_bytes = settings.STREAM_COALESCE_MAX_BYTES
+        if coalesce is not None:
+            if coalesce.window_ms is not None:
+                window_ms = coalesce.window_ms
+            if coalesce.max_bytes is not None:
+                max_bytes = coalesce.max_bytes
+        return window_ms / 1000, max_bytes
+
+    def _get_request_slots(self) -> asyncio.Semaphore:
+        """Return the per-connection concurrency limit, creating it on first use.
+        
+        The semaphore is created lazily so it binds to the running event loop.
+        
+        Returns:
+            The semaphore guarding concurrent completions on this connection
+        """
+        if self._request_slots is None:
+            self._request_slots = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._request_slots
+
+    async def _parse_message(
         self,
         websocket: WebSocket,
-        data: str
-    ) -> None:
-        """Process a message received from the client.
+        data: Union[str, bytes]
+    ) -> Optional[Union[ChatCompletionRequest, CancelRequest]]:
+        """Parse and validate a message received from the client.
+        
+        Errors are reported to the client through handle_error.
         
         Args:
             websocket: The active WebSocket connection
-            data: The raw JSON string from the client
+            data: The raw payload from the client, in the connection's wire format
+            
+        Returns:
+            The validated chat completion or cancel request, or None if it was rejected
         """
         request_data = {}
+        self._parse_timings = None
+        started_at = time.monotonic()
         try:
-            # Parse the incoming JSON data
-            request_data = json.loads(data)
+            request_data = self.codec.decode(data)
+            decoded_at = time.monotonic()
+            if isinstance(request_data, dict) and request_data.get("type") == "cancel":
+                return CancelRequest(**request_data)
             chat_request = ChatCompletionRequest(**request_data)
+            self._parse_timings = (started_at, decoded_at, time.monotonic())
+            return chat_request
+        except FrameDecodeError as e:
+            logger.error("Invalid message received: %s", e.__cause__ or e)
+            await self.handle_error(websocket, request_data, Exception(str(e)))
+        except Exception as e:
+            await self.handle_error(websocket, request_data, e)
+        return None
+
+    async def _run_request(
+        self,
+        websocket: WebSocket,
+        chat_request: ChatCompletionRequest,
+        trace: Optional[Trace] = None
+    ) -> None:
+        """Run a single chat completion once a slot on the connection is free.
+        
+        Args:
+            websocket: The active WebSocket connection
+            chat_request: The validated chat completion request
+            trace: The trace of the request, None when it is not traced
+        """
+        started = False
+        outcome = "completed"
+        with activate(trace):
+            try:
+                if self.admission is not None:
+                    with span("rate_limit"):
+                        await self._check_rate(chat_request)
+                waiting_since = time.monotonic()
+                async with self._get_request_slots():
+                    record_span("connection_slot", waiting_since)
+                    if self.admission is None:
+                        started = True
+                        with span("completion"):
+                            await self.handle_chat_completion(websocket, chat_request)
+                    else:
+                        waiting_since = time.monotonic()
+                        async with self.admission.slot():
+                            record_span("admission_slot", waiting_since)
+                            started = True
+                            with span("completion"):
+                                await self.handle_chat_completion(websocket, chat_request)
+            except WebSocketDisconnect:
+                # No need to handle error for a disconnected client
+                outcome = "disconnected"
+                logger.info("WebSocket client disconnected during message processing", extra=SAMPLED)
+            except asyncio.CancelledError:
+                outcome = "cancelled"
+                # Requests cancelled while waiting for a slot never produced a chunk
+                request_id = chat_request.request_id
+                if not started and self._cancel_reasons.get(request_id) == CANCEL_REASON_CLIENT:
+                    await self._send_cancelled(websocket, request_id, StreamProgress())
+                raise
+            except AdmissionRejected as e:
+                outcome = "rejected"
+                self.service_metrics.rejections.inc()
+                await self.handle_error(websocket, {"request_id": chat_request.request_id}, e)
+            except Exception as e:
+                outcome = "failed"
+                await self.handle_error(websocket, {"request_id": chat_request.request_id}, e)
+            finally:
+                if trace is not None:
+                    self.tracer.finish(trace, status=outcome)
+
+    def _start_trace(
+        self,
+        chat_request: ChatCompletionRequest,
+        parse_timings: Optional[Tuple[float, float, float]] = None
+    ) -> Optional[Trace]:
+        """Start the trace of a request if the tracer samples it.
+        
+        Args:
+            chat_request: The validated chat completion request
+            parse_timings: When the message was received, decoded and
+                validated, if it came through _parse_message
             
-            # Handle the chat completion
-            await self.handle_chat_completion(websocket, chat_request)
+        Returns:
+            The trace, or None when the request is not traced
+        """
+        if self.tracer is None:
+            return None
+        trace = self.tracer.start_trace(
+            chat_request.trace_id,
+            start=parse_timings[0] if parse_timings is not None else None,
+            sampled=self.trace_sampled,
+            request_id=chat_request.request_id,
+            model=chat_request.model,
+            stream=chat_request.stream
+        )
+        if trace is not None and parse_timings is not None:
+            started_at, decoded_at, validated_at = parse_timings
+            trace.add_span("decode", started_at, decoded_at, codec=self.codec.subprotocol or "json")
+            trace.add_span("validate", decoded_at, validated_at)
+        return trace
+
+    async def _check_rate(self, chat_request: ChatCompletionRequest) -> None:
+        """Charge a request to its client's rate limits.
+        
+        Rejections are fast and carry a retry hint to the client.
+        
+        Args:
+            chat_request: The validated chat completion request
             
-        except json.JSONDecodeError as e:
-            logger.error(f"Invalid JSON received: {str(e)}")
-            await self.handle_error(websocket, request_data, Exception("Invalid JSON format"))
-        except WebSocketDisconnect:
-            # No need to handle error for a disconnected client
-            logger.info("WebSocket client disconnected during message processing")
-        except Exception as e:
-            await self.handle_error(websocket, request_data, e) 
\ No newline at end of file
+        Raises:
+            AdmissionRejected: When the client is over one of its rates
+        """
+        await self.admission.check_rate(self.client_id, self._estimate_request_tokens(chat_request))
+
+    def _estimate_request_tokens(self, chat_request: ChatCompletionRequest) -> int:
+        """Estimate the tokens a request will use, for its client's token bucket.
+        
+        Args:
+            chat_request: The validated chat completion request
+            
+        Returns:
+            The estimated tokens of the messages sent plus the completion limit
+        """
+        if self.token_budget is not None:
+            prompt_tokens = sum(
+                self.token_budget.count_message({"role": msg.role, "content": msg.content})
+                for msg in chat_request.messages
+            )
+        else:
+            prompt_tokens = sum(estimate_tokens(msg.content) for msg in chat_request.messages)
+        return prompt_tokens + (chat_request.max_tokens or 0)
+
+    async def process_message(
+        self,
+        websocket: WebSocket,
+        data: Union[str, bytes]
+    ) -> None:
+        """Process a message received from the client and wait for it to finish.
+        
+        Args:
+            websocket: The active WebSocket connection
+            data: The raw payload from the client, in the connection's wire format
+        """
+        chat_request = await self._parse_message(websocket, data)
+        if isinstance(chat_request, CancelRequest):
+            self.cancel_request(chat_request.request_id)
+        elif chat_request is not None:
+            await self._run_request(websocket, chat_request, self._start_trace(chat_request, self._parse_timings))
+
+    async def dispatch_message(
+        self,
+        websocket: WebSocket,
+        data: Union[str, bytes]
+    ) -> Optional[asyncio.Task]:
+        """Start processing a message as its own task and return immediately.
+        
+        The caller can keep reading the socket while the completion streams.
+        Chunks from concurrent requests are interleaved on the connection and
+        told apart by their request_id.
+        
+        Args:
+            websocket: The active WebSocket connection
+            data: The raw payload from the client, in the connection's wire format
+            
+        Returns:
+            The task running the request, or None if it was rejected
+        """
+        chat_request = await self._parse_message(websocket, data)
+        if chat_request is None:
+            return None
+        if isinstance(chat_request, CancelRequest):
+            self.cancel_request(chat_request.request_id)
+            return None
+        
+        request_id = chat_request.request_id
+        if request_id in self._active_requests:
+            await self.handle_error(
+                websocket,
+                {"request_id": request_id},
+                Exception(f"Request {request_id} is already in progress")
+            )
+            return None
+        if len(self._active_requests) >= self.max_pending_requests:
+            await self.handle_error(
+                websocket,
+                {"request_id": request_id},
+                Exception("Too many requests in progress on this connection")
+            )
+            return None
+        
+        return self._start_request(websocket, chat_request, self._parse_timings)
+
+    def _start_request(
+        self,
+        websocket: WebSocket,
+        chat_request: ChatCompletionRequest,
+        parse_timings: Optional[Tuple[float, float, float]] = None
+    ) -> asyncio.Task:
+        """Run an accepted request as its own task, tracked until it finishes.
+        
+        Args:
+            websocket: The active WebSocket connection
+            chat_request: The validated chat completion request
+            parse_timings: When the message was received, decoded and
+                validated, if it came through _parse_message
+            
+        Returns:
+            The task running the request
+        """
+        request_id = chat_request.request_id
+        # Queue wait is measured from here to the start of processing
+        self._received_at[request_id] = time.monotonic()
+        trace = self._start_trace(chat_request, parse_timings)
+        task = asyncio.create_task(self._run_request(websocket, chat_request, trace))
+        self._active_requests[request_id] = task
+        task.add_done_callback(lambda _: self._forget_request(request_id))
+        return task
+
+    def _forget_request(self, request_id: str) -> None:
+        """Drop the bookkeeping of a request whose task has finished.
+        
+        Args:
+            request_id: Unique identifier for the request
+        """
+        self._active_requests.pop(request_id, None)
+        self._cancel_reasons.pop(request_id, None)
+        self._received_at.pop(request_id, None)
+        if self._send_queue is not None:
+            # Its frames may still be queued, release it after them
+            self._send_queue.release(request_id)
+        else:
+            self.codec.release(request_id)
+
+    def cancel_request(self, request_id: str, reason: str = CANCEL_REASON_CLIENT) -> bool:
+        """Cancel a request that is running on this connection.
+        
+        The request task closes its upstream stream and, when the client asked
+        for the cancellation, sends a final chunk with a "cancelled" status.
+        
+        Args:
+            request_id: Unique identifier for the request
+            reason: Why the request is cancelled
+            
+        Returns:
+            True if a running request was cancelled, False otherwise
+        """
+        task = self._active_requests.get(request_id)
+        if task is None or task.done():
+            logger.info("Cancel ignored for request %s: not in progress", request_id, extra=SAMPLED)
+            return False
+        self._cancel_reasons.setdefault(request_id, reason)
+        task.cancel()
+        return True
+
+    async def shutdown(self) -> None:
+        """Cancel every request still running on this connection and wait for them."""
+        tasks = list(self._active_requests.values())
+        for request_id in list(self._active_requests):
+            self.cancel_request(request_id, CANCEL_REASON_DISCONNECT)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._send_queue is not None:
+            await self._send_queue.close()
+            self._send_queue = None
+            self.service_metrics.active_websockets.dec()
@@ -0,0 +1,380 @@
+"""Offline chat completion jobs over JSONL files, for backfills too large for a batch.
+
+Each line of the input file is a ``JobRequest``, with at least ``messages``.
+The file is streamed, never loaded whole, and its lines are completed by a
+bounded number of concurrent requests through ``OpenAIAdapter``. Every
+result is appended to the output file as a ``JobResult`` as soon as it
+completes, carrying the number of its input line.
+
+The output file is also the checkpoint: a run started again with the same
+output skips the lines already in it, after dropping a last line the crash
+cut short, so an interrupted job resumes where it stopped. With
+``--retry-failed`` the lines that failed are run again, and the later
+result of a line supersedes the earlier one.
+
+Requests are paced by optional client-side request and token rates. When
+the upstream still answers with a rate limit after the adapter's own
+retries, every request of the job pauses for as long as it asked before the
+line is tried again, up to JOB_RATE_LIMIT_RETRIES times.
+
+Usage:
+    python -m src.jobs INPUT OUTPUT [--concurrency 16] [--requests-per-minute N]
+        [--tokens-per-minute N] [--retry-failed]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator, Optional, Set, TextIO, Tuple
+
+from openai import APIError
+from pydantic import ValidationError
+
+from src.adapters.openai import OpenAIAdapter
+from src.models.chat import JobRequest, JobResult
+from src.settings import settings
+from src.utils.logs import configure_logging
+from src.utils.retry import retry_after_seconds, retry_reason
+from src.utils.shared_state import TokenBucket
+from src.utils.token_budget import estimate_tokens
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Longest pause after a rate limit that did not say how long to wait
+MAX_RATE_LIMIT_PAUSE = 60.0
+
+
+class JobPacer:
+    """Paces the requests of a job by request and token rates.
+
+    Rates of 0 are not limited. Buckets hold one second of their rate, so a
+    job ramps up smoothly instead of spending a minute's allowance at once.
+    A request estimated above one second of tokens is charged in full,
+    leaving the bucket in debt, so large requests cannot exceed the rate.
+    A pause, after the upstream answered with a rate limit, holds back every
+    request of the job until it ends.
+    """
+
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        """Initialize the pacer.
+
+        Args:
+            requests_per_minute: Requests the job may start per minute
+            tokens_per_minute: Estimated tokens the job may use per minute
+        """
+        now = time.monotonic()
+        self._buckets = [
+            (TokenBucket(rate / 60, max(1.0, rate / 60), now), is_tokens)
+            for rate, is_tokens in ((requests_per_minute, False), (tokens_per_minute, True))
+            if rate > 0
+        ]
+        self._resume_at = now
+        self.pauses = 0
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait until a request of an estimated size may start.
+
+        Args:
+            tokens: Tokens the request is expected to use
+        """
+        while True:
+            now = time.monotonic()
+            wait = max(
+                [self._resume_at - now] +
+                [bucket.wait_time(tokens if is_tokens else 1, now) for bucket, is_tokens in self._buckets]
+            )
+            if wait <= 0:
+                for bucket, is_tokens in self._buckets:
+                    # Not consume(), which caps the charge at the capacity
+                    bucket.tokens -= tokens if is_tokens else 1
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every request of the job for a number of seconds.
+
+        Args:
+            seconds: How long the upstream asked us to wait
+        """
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+        self.pauses += 1
+        logger.warning("Upstream rate limit, pausing the job for %.2fs", seconds)
+
+
+@dataclass
+class JobSummary:
+    """Counters of a job run, printed when it ends."""
+    completed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    rate_limit_pauses: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def requests_per_second(self) -> float:
+        """Lines completed or failed per second of this run."""
+        return (self.completed + self.failed) / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Completion tokens received per second of this run."""
+        return self.completion_tokens / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    def as_dict(self) -> dict:
+        """Return the counters and rates as plain data."""
+        return {
+            **asdict(self),
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "requests_per_second": round(self.requests_per_second, 2),
+            "tokens_per_second": round(self.tokens_per_second, 1),
+        }
+
+
+def load_checkpoint(output_path: str, retry_failed: bool = False) -> Set[int]:
+    """Return the input lines an earlier run already wrote to the output.
+
+    A last line without its newline was cut short by a crash and is
+    truncated away, so that the next result starts on a line of its own.
+
+    Args:
+        output_path: The output file of the job
+        retry_failed: Leave the lines that failed out, so they run again
+
+    Returns:
+        The numbers of the input lines to skip
+    """
+    done: Set[int] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "rb+") as output:
+        kept = 0
+        for raw in output:
+            if not raw.endswith(b"\n"):
+                break
+            kept += len(raw)
+            result = JobResult.model_validate_json(raw)
+            if result.error is None or not retry_failed:
+                done.add(result.line)
+        if kept != output.tell():
+            logger.warning("Dropping a partial last line of %s", output_path)
+            output.truncate(kept)
+    return done
+
+
+class JobRunner:
+    """Runs the lines of an input file and appends their results to an output file."""
+
+    def __init__(
+        self,
+        adapter: OpenAIAdapter,
+        input_path: str,
+        output_path: str,
+        concurrency: int = 16,
+        pacer: Optional[JobPacer] = None,
+        rate_limit_retries: int = 5,
+        progress_interval: float = 10.0,
+        retry_failed: bool = False,
+    ):
+        """Initialize the runner.
+
+        Args:
+            adapter: Adapter the completions are requested from
+            input_path: JSONL file of JobRequest lines
+            output_path: JSONL file the JobResult lines are appended to
+            concurrency: Requests run at once
+            pacer: Paces the requests, not paced if not given
+            rate_limit_retries: Times a line is tried again after a rate limit
+            progress_interval: Seconds between two progress reports
+            retry_failed: Run again the lines that failed in an earlier run
+        """
+        self.adapter = adapter
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.pacer = pacer or JobPacer()
+        self.rate_limit_retries = rate_limit_retries
+        self.progress_interval = progress_interval
+        self.retry_failed = retry_failed
+        self.summary = JobSummary()
+        self._output: Optional[TextIO] = None
+
+    async def run(self) -> JobSummary:
+        """Run every line not yet in the output and return the summary of this run.
+
+        Returns:
+            The counters of the run
+        """
+        done = load_checkpoint(self.output_path, self.retry_failed)
+        if done:
+            logger.info("Resuming %s, %s lines already done", self.output_path, len(done))
+        started = time.monotonic()
+        with open(self.input_path, encoding="utf-8") as source, \
+                open(self.output_path, "a", encoding="utf-8") as self._output:
+            lines = self._pending_lines(source, done)
+            workers = [asyncio.ensure_future(self._work(lines)) for _ in range(self.concurrency)]
+            progress = asyncio.ensure_future(self._report_progress(started))
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers + [progress]:
+                    task.cancel()
+                await asyncio.gather(*workers, progress, return_exceptions=True)
+                self._output.flush()
+                os.fsync(self._output.fileno())
+        self.summary.elapsed_seconds = time.monotonic() - started
+        self.summary.rate_limit_pauses = self.pacer.pauses
+        return self.summary
+
+    def _pending_lines(self, source: TextIO, done: Set[int]) -> Iterator[Tuple[int, str]]:
+        """Yield the numbered lines of the input that are left to run.
+
+        Args:
+            source: The open input file
+            done: Numbers of the lines already in the output
+
+        Yields:
+            The number and the text of each line
+        """
+        for number, text in enumerate(source, 1):
+            if not text.strip():
+                continue
+            if number in done:
+                self.summary.skipped += 1
+                continue
+            yield number, text
+
+    async def _work(self, lines: Iterator[Tuple[int, str]]) -> None:
+        """Run lines one after the other until the input is exhausted.
+
+        Args:
+            lines: The lines left to run, shared by every worker
+        """
+        for number, text in lines:
+            result = await self._run_line(number, text)
+            if result.error is None:
+                self.summary.completed += 1
+                self.summary.prompt_tokens += result.prompt_tokens or 0
+                self.summary.completion_tokens += result.completion_tokens or 0
+            else:
+                self.summary.failed += 1
+            self._output.write(result.model_dump_json(exclude_none=True) + "\n")
+            self._output.flush()
+
+    async def _run_line(self, number: int, text: str) -> JobResult:
+        """Complete one line of the input.
+
+        Args:
+            number: The number of the line in the input
+            text: The JSON text of the line
+
+        Returns:
+            The result of the line, with its error if it failed
+        """
+        try:
+            job_request = JobRequest.model_validate_json(text)
+        except ValidationError as e:
+            return JobResult(line=number, error=f"Invalid request: {e.errors()[0]['msg']}")
+
+        messages = [{"role": msg.role, "content": msg.content} for msg in job_request.messages]
+        tokens = sum(estimate_tokens(msg["content"]) for msg in messages) + (job_request.max_tokens or 0)
+        attempts = 0
+        while True:
+            await self.pacer.acquire(tokens)
+            request_start = time.monotonic()
+            try:
+                response = await self.adapter.generate_chat_completion(
+                    messages=messages,
+                    model=job_request.model,
+                    temperature=job_request.temperature,
+                    max_tokens=job_request.max_tokens,
+                    stream=False
+                )
+                break
+            except APIError as e:
+                if retry_reason(e) != "rate_limit" or attempts >= self.rate_limit_retries:
+                    return JobResult(line=number, request_id=job_request.request_id, error=str(e))
+                attempts += 1
+                requested = retry_after_seconds(e)
+                self.pacer.pause(requested if requested is not None else min(2.0 ** attempts, MAX_RATE_LIMIT_PAUSE))
+            except Exception as e:
+                logger.error("Error processing line %s: %s", number, e)
+                return JobResult(line=number, request_id=job_request.request_id, error=str(e))
+
+        try:
+            usage = getattr(response, "usage", None)
+            return JobResult(
+                line=number,
+                request_id=job_request.request_id,
+                content=response.choices[0].message.content or "",
+                prompt_tokens=getattr(usage, "prompt_tokens", None),
+                completion_tokens=getattr(usage, "completion_tokens", None),
+                response_time=int((time.monotonic() - request_start) * 1000)
+            )
+        except Exception as e:
+            # An empty or malformed response fails this line, not the job
+            logger.error("Invalid response to line %s: %s", number, e)
+            return JobResult(line=number, request_id=job_request.request_id, error=f"Invalid response: {e}")
+
+    async def _report_progress(self, started: float) -> None:
+        """Log the progress of the job and sync the output to disk periodically.
+
+        Args:
+            started: Monotonic time the run started at
+        """
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.summary.elapsed_seconds = time.monotonic() - started
+            os.fsync(self._output.fileno())
+            logger.info(
+                "Job progress: %s completed, %s failed, %s skipped, %.1f requests/s, %.0f tokens/s",
+                self.summary.completed, self.summary.failed, self.summary.skipped,
+                self.summary.requests_per_second, self.summary.tokens_per_second
+            )
+
+
+async def run_job(args: argparse.Namespace) -> JobSummary:
+    """Run a job with the adapter configured by the application settings."""
+    adapter = OpenAIAdapter()
+    runner = JobRunner(
+        adapter,
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        pacer=JobPacer(args.requests_per_minute, args.tokens_per_minute),
+        rate_limit_retries=settings.JOB_RATE_LIMIT_RETRIES,
+        progress_interval=settings.JOB_PROGRESS_INTERVAL,
+        retry_failed=args.retry_failed,
+    )
+    try:
+        return await runner.run()
+    finally:
+        await adapter.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file with one request per line")
+    parser.add_argument("output", help="JSONL file results are appended to, and resumed from")
+    parser.add_argument("--concurrency", type=int, default=settings.JOB_CONCURRENCY)
+    parser.add_argument("--requests-per-minute", type=int, default=settings.JOB_REQUESTS_PER_MINUTE)
+    parser.add_argument("--tokens-per-minute", type=int, default=settings.JOB_TOKENS_PER_MINUTE)
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="run again the lines that failed in an earlier run")
+    args = parser.parse_args()
+
+    configure_logging(settings)
+    summary = asyncio.run(run_job(args))
+    print(json.dumps(summary.as_dict(), indent=2))
+    if summary.failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
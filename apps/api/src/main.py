@@ -2,7 +2,9 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.routing import APIRoute, APIWebSocketRoute
 
+from src.api.debug import router as debug_router
 from src.api.health import router as health_router
+from src.api.metrics import router as metrics_router
 from src.api.v1.chat import router as v1_router
 from src.settings import settings
 from src.utils.app_resources import app_resources_lifespan, logger
@@ -18,16 +20,16 @@ def get_application() -> FastAPI:
     logger.info("FastAPI application initalised successfully.")
 
     # Add routers
-    for router in [health_router, v1_router]:
+    for router in [health_router, metrics_router, debug_router, v1_router]:
         app.include_router(router)
         # Log the routes that have been added
         for route in router.routes:
             if isinstance(route, APIRoute):
-                logger.info(f"HTTP Route added: {route.path} - {route.methods}")
+                logger.info("HTTP Route added: %s - %s", route.path, route.methods)
             elif isinstance(route, APIWebSocketRoute):
-                logger.info(f"WebSocket Route added: {route.path}")
+                logger.info("WebSocket Route added: %s", route.path)
             else:
-                logger.info(f"Other Route added: {route.path}")
+                logger.info("Other Route added: %s", route.path)
 
     app.add_middleware(
         CORSMiddleware,
@@ -1,12 +1,23 @@
-from typing import List, Literal, Optional
+import uuid
+from typing import Any, List, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from pydantic.alias_generators import to_camel
+
+from src.settings import settings
 
 
 class ChatMessage(BaseModel):
     """Represents a message in a chat conversation."""
     role: Literal["system", "user", "assistant"]
     content: str
+    pinned: bool = False
+
+
+class CoalesceOptions(BaseModel):
+    """Per-request overrides for batching streamed deltas into frames."""
+    window_ms: Optional[int] = Field(default=None, ge=0, le=1000)
+    max_bytes: Optional[int] = Field(default=None, ge=1)
 
 
 class ChatCompletionRequest(BaseModel):
@@ -17,6 +28,80 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = None
     stream: bool = True
+    coalesce: Optional[CoalesceOptions] = None
+    # Temperature 0 requests use the cache unless False, others only when True
+    cache: Optional[bool] = None
+    # Continues a conversation the server started, by the id it returned
+    conversation_id: Optional[str] = None
+    # Starts a conversation, whose id is returned in the metrics of the response
+    new_conversation: bool = False
+    # Traces the request under this id when it is sampled, e.g. the trace id of the caller
+    trace_id: Optional[str] = Field(default=None, max_length=64, pattern=r"^[A-Za-z0-9._-]+$")
+
+    @model_validator(mode="after")
+    def _one_conversation(self) -> "ChatCompletionRequest":
+        if self.new_conversation and self.conversation_id is not None:
+            raise ValueError("A request cannot both continue and start a conversation")
+        return self
+
+
+class HTTPChatCompletionRequest(ChatCompletionRequest):
+    """Chat completion request sent over HTTP, where the request id is optional."""
+    request_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class BatchCompletionRequest(BaseModel):
+    """A batch of chat completion requests run with bounded parallelism."""
+    requests: List[HTTPChatCompletionRequest] = Field(min_length=1)
+    parallelism: Optional[int] = Field(default=None, ge=1)
+
+    @field_validator("requests", mode="before")
+    @classmethod
+    def _within_size_limit(cls, requests: Any) -> Any:
+        # Checked on the raw list, so an oversized batch is never validated item by item
+        if isinstance(requests, list) and len(requests) > settings.BATCH_MAX_REQUESTS:
+            raise ValueError(f"A batch holds at most {settings.BATCH_MAX_REQUESTS} requests")
+        return requests
+
+    @model_validator(mode="after")
+    def _unique_request_ids(self) -> "BatchCompletionRequest":
+        request_ids = [request.request_id for request in self.requests]
+        if len(set(request_ids)) != len(request_ids):
+            raise ValueError("Request ids must be unique within a batch")
+        return self
+
+
+class CancelRequest(BaseModel):
+    """Request to stop a chat completion that is still in progress."""
+    type: Literal["cancel"]
+    request_id: str
+
+
+class StreamMetrics(BaseModel):
+    """Timings and usage of a streamed completion, sent with its final chunk.
+    
+    Durations are in milliseconds, measured with a monotonic clock from when
+    the request started processing. Fields that could not be measured, e.g.
+    the upstream timings of a cached response, are left out of the frame.
+    """
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    response_time: int
+    length: int
+    tokens: int = 0
+    status: Literal["completed", "cancelled"] = "completed"
+    cached: bool = False
+    queue_wait: Optional[float] = None
+    connect_time: Optional[float] = None
+    time_to_first_token: Optional[float] = None
+    mean_chunk_gap: Optional[float] = None
+    p95_chunk_gap: Optional[float] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    provider: Optional[str] = None
+    failovers: Optional[int] = None
+    trace_id: Optional[str] = None
+    conversation_id: Optional[str] = None
 
 
 class StreamChunk(BaseModel):
@@ -27,7 +112,45 @@ class StreamChunk(BaseModel):
     metrics: Optional[dict] = None
 
 
+class ChatCompletionResponse(BaseModel):
+    """Response to a non-streamed chat completion over HTTP."""
+    request_id: str
+    content: str
+    metrics: Optional[dict] = None
+
+
+class BatchCompletionResult(BaseModel):
+    """Outcome of one request of a batch, a line of the NDJSON response."""
+    index: int
+    request_id: str
+    content: Optional[str] = None
+    error: Optional[str] = None
+    retry_after: Optional[float] = None
+    metrics: Optional[dict] = None
+
+
+class JobRequest(BaseModel):
+    """A line of the input file of an offline job."""
+    request_id: Optional[str] = None
+    model: str = "gpt-4o-mini"
+    messages: List[ChatMessage] = Field(min_length=1)
+    temperature: Optional[float] = 0.7
+    max_tokens: Optional[int] = None
+
+
+class JobResult(BaseModel):
+    """Outcome of a line of an offline job, a line of its output file."""
+    line: int
+    request_id: Optional[str] = None
+    content: Optional[str] = None
+    error: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    response_time: Optional[int] = None
+
+
 class ErrorResponse(BaseModel):
     """Response model for error conditions."""
     request_id: str
-    error: str 
\ No newline at end of file
+    error: str
+    retry_after: Optional[float] = None 
\ No newline at end of file
@@ -1,14 +1,151 @@
-from typing import Literal
+from typing import List, Literal, Optional
 
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class ProviderSettings(BaseModel):
+    """An OpenAI-compatible upstream, as listed in OPENAI_PROVIDERS."""
+    name: str
+    base_url: Optional[str] = None
+    # Defaults to OPENAI_API_KEY
+    api_key: Optional[str] = None
+    # Models the provider serves, empty for any
+    models: List[str] = []
+
+
 class Settings(BaseSettings):
     API_NAME: str
     API_VERSION: str
     API_DESCRIPTION: str
     LOGGING_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
     OPENAI_API_KEY: str
+    # Records are queued to a background writer, as JSON lines or text; a
+    # full queue drops records, and sampled call sites keep one record in N
+    LOG_FORMAT: Literal["json", "text"] = "json"
+    LOG_QUEUE_MAX_RECORDS: int = 10000
+    LOG_SAMPLE_EVERY: int = 10
+    # OpenAI-compatible endpoint to use instead of the public API, e.g. the
+    # stand-in of the load tests
+    OPENAI_BASE_URL: Optional[str] = None
+    # Several upstreams as a JSON list of {"name", "base_url", "api_key",
+    # "models"}, each with its own connection pool; empty uses the one above
+    OPENAI_PROVIDERS: List[ProviderSettings] = []
+
+    # Shared upstream connection pool
+    OPENAI_MAX_CONNECTIONS: int = 100
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    OPENAI_KEEPALIVE_EXPIRY: float = 30.0
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_READ_TIMEOUT: float = 60.0
+    OPENAI_POOL_TIMEOUT: float = 10.0
+    OPENAI_WARMUP_ON_STARTUP: bool = True
+    # Ask for the token usage report at the end of every stream
+    OPENAI_STREAM_INCLUDE_USAGE: bool = True
+
+    # Upstream retries, only before the first token and under a total deadline
+    OPENAI_RETRY_MAX_ATTEMPTS: int = 4
+    OPENAI_RETRY_BASE_DELAY: float = 0.5
+    OPENAI_RETRY_MAX_DELAY: float = 8.0
+    OPENAI_RETRY_DEADLINE: float = 20.0
+
+    # Routing between providers: EWMA smoothing of their time to first
+    # token and error rate, and how long a provider whose error rate
+    # reached the threshold is left out
+    PROVIDER_LATENCY_EWMA_ALPHA: float = 0.3
+    PROVIDER_ERROR_EWMA_ALPHA: float = 0.2
+    PROVIDER_EJECT_ERROR_RATE: float = 0.5
+    PROVIDER_EJECT_SECONDS: float = 30.0
+
+    # Per-connection request multiplexing
+    WS_MAX_CONCURRENT_REQUESTS: int = 4
+    WS_MAX_PENDING_REQUESTS: int = 16
+
+    # Batch submissions: most requests per batch, default and largest
+    # number run at once, and how long a batch waits out its client's rate
+    # limits before an entry fails with the rejection
+    BATCH_MAX_REQUESTS: int = 1000
+    BATCH_DEFAULT_PARALLELISM: int = 8
+    BATCH_MAX_PARALLELISM: int = 32
+    BATCH_RATE_LIMIT_MAX_WAIT: float = 60.0
+
+    # Offline JSONL jobs run with python -m src.jobs; rate limits of 0
+    # leave the pacing to the upstream's rate-limit responses
+    JOB_CONCURRENCY: int = 16
+    JOB_REQUESTS_PER_MINUTE: int = 0
+    JOB_TOKENS_PER_MINUTE: int = 0
+    JOB_RATE_LIMIT_RETRIES: int = 5
+    JOB_PROGRESS_INTERVAL: float = 10.0
+
+    # Per-request tracing: a share of the requests, and those whose
+    # traceparent header is sampled, are traced into a ring buffer served on
+    # /debug/traces when the debug endpoints are enabled, or into a rotating
+    # JSONL file
+    TRACING_ENABLED: bool = True
+    TRACING_SAMPLE_RATE: float = 0.01
+    TRACING_EXPORTER: Literal["memory", "file"] = "memory"
+    TRACING_BUFFER_SIZE: int = 1000
+    TRACING_FILE_PATH: str = ".cache/traces.jsonl"
+    TRACING_FILE_MAX_BYTES: int = 16 * 1024 * 1024
+    TRACING_FILE_BACKUPS: int = 3
+    DEBUG_ENDPOINTS_ENABLED: bool = False
+
+    # Per-connection send queue; a full queue coalesces deltas, pauses the
+    # upstream reads or disconnects the slow client
+    WS_SEND_QUEUE_MAX_FRAMES: int = 256
+    WS_SLOW_CONSUMER_POLICY: Literal["coalesce", "pause", "disconnect"] = "coalesce"
+
+    # Outbound frame coalescing, a window of 0 sends every delta on its own
+    STREAM_COALESCE_WINDOW_MS: int = 30
+    STREAM_COALESCE_MAX_BYTES: int = 1024
+
+    # Upstream token deadlines in seconds, 0 waits forever; a late first
+    # token starts a hedged duplicate request when hedging is enabled
+    STREAM_FIRST_TOKEN_TIMEOUT: float = 15.0
+    STREAM_INTER_TOKEN_TIMEOUT: float = 30.0
+    STREAM_HEDGE_ENABLED: bool = True
+
+    # Exact-match completion cache, off unless enabled
+    COMPLETION_CACHE_ENABLED: bool = False
+    COMPLETION_CACHE_PATH: str = ".cache/completion_cache.db"
+    COMPLETION_CACHE_TTL_SECONDS: int = 86400
+    COMPLETION_CACHE_MAX_ENTRIES: int = 1024
+    COMPLETION_CACHE_REPLAY_DELAY_MS: int = 0
+
+    # Share one upstream stream between identical deterministic requests
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Server-side history for requests that send a conversation_id
+    CONVERSATION_STORE_ENABLED: bool = True
+    CONVERSATION_STORE_PATH: str = ".cache/conversations.db"
+    CONVERSATION_IDLE_TTL_SECONDS: int = 3600
+    CONVERSATION_STORE_MAX_BYTES: int = 64 * 1024 * 1024
+
+    # Context-window budgeting before requests leave the process
+    TOKEN_BUDGET_ENABLED: bool = True
+    TOKEN_BUDGET_RESERVED_COMPLETION_TOKENS: int = 1024
+    TOKEN_BUDGET_CACHE_SIZE: int = 65536
+    TOKEN_BUDGET_OFFLOAD_CHARS: int = 200000
+
+    # Admission control; rate limits are kept in the shared state, the
+    # concurrency gate is per worker with an optional limit for the host.
+    # Clients are told apart by address, so behind a proxy or load balancer
+    # enable it only with ADMISSION_TRUST_FORWARDED_FOR
+    ADMISSION_ENABLED: bool = False
+    ADMISSION_REQUESTS_PER_SECOND: float = Field(default=2.0, gt=0)
+    ADMISSION_REQUEST_BURST: int = Field(default=10, gt=0)
+    ADMISSION_TOKENS_PER_MINUTE: int = Field(default=200000, gt=0)
+    ADMISSION_MAX_CONCURRENT: int = 64
+    ADMISSION_MAX_CONCURRENT_HOST: int = 0
+    ADMISSION_MAX_QUEUE: int = 128
+    ADMISSION_QUEUE_TIMEOUT: float = 10.0
+    ADMISSION_MAX_CLIENTS: int = 10000
+    ADMISSION_TRUST_FORWARDED_FOR: bool = False
+
+    # State shared by the workers of a host: "local" keeps it in each
+    # process, "sqlite" shares it through a WAL-mode database file
+    SHARED_STATE_BACKEND: Literal["local", "sqlite"] = "local"
+    SHARED_STATE_PATH: str = ".cache/shared_state.db"
 
     model_config = SettingsConfigDict(env_file=".env")
 
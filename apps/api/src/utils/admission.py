@@ -0,0 +1,199 @@
+"""Admission control: per-client rate limits and a global concurrency gate."""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional
+
+from src.settings import Settings
+from src.utils.logs import SAMPLED
+from src.utils.shared_state import BucketCharge, LocalSharedState, SharedState
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Retry hint given when the wait queue is full
+BUSY_RETRY_AFTER = 1.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted, with a hint of when to retry."""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        """Initialize the rejection.
+
+        Args:
+            message: Why the request was rejected
+            retry_after: Seconds after which a retry may be admitted
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConcurrencyGate:
+    """A global limit on running completions with a bounded FIFO wait queue."""
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        """Initialize the gate.
+
+        Args:
+            max_concurrent: Completions allowed to run at once
+            max_queue: Requests allowed to wait for a slot, beyond which they
+                are rejected immediately
+            queue_timeout: Seconds a request may wait for a slot
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        """The number of requests waiting for a slot."""
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        """Take a slot, waiting in line for one if needed.
+
+        Raises:
+            AdmissionRejected: When the queue is full or the wait times out
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected("The server is at capacity, please retry later", BUSY_RETRY_AFTER)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            done, _ = await asyncio.wait((waiter,), timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+        if not done:
+            self._abandon(waiter)
+            raise AdmissionRejected(
+                f"No capacity became available within {self.queue_timeout:g}s, please retry later",
+                BUSY_RETRY_AFTER
+            )
+
+    def release(self) -> None:
+        """Give a slot back, handing it straight to the next waiter if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        """Leave the queue, passing on a slot handed over in the meantime."""
+        if waiter.done():
+            self.release()
+        else:
+            waiter.cancel()
+            self._waiters.remove(waiter)
+
+
+class AdmissionController:
+    """Decides which chat requests run, shared by every connection of a worker.
+
+    Each client gets two token buckets, one for requests per second and one
+    for estimated tokens per minute, and a request must fit both. Admitted
+    requests then take a slot of the worker's concurrency gate and are
+    recorded as streams of the host. The buckets and streams live in the
+    shared state, so with a shared backend the limits hold across workers.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float,
+        request_burst: int,
+        tokens_per_minute: int,
+        max_concurrent: int,
+        max_queue: int,
+        queue_timeout: float,
+        max_clients: int,
+        state: Optional[SharedState] = None,
+        max_concurrent_host: int = 0,
+    ):
+        """Initialize the controller.
+
+        Args:
+            requests_per_second: Sustained request rate allowed per client
+            request_burst: Requests a client may make at once
+            tokens_per_minute: Estimated tokens a client may use per minute
+            max_concurrent: Completions allowed to run at once in the worker
+            max_queue: Requests allowed to wait for a slot
+            queue_timeout: Seconds a request may wait for a slot
+            max_clients: Clients whose buckets are remembered in process
+                state, least recently seen first to be forgotten
+            state: Where buckets and streams are kept, in the process if not given
+            max_concurrent_host: Completions allowed to run at once on the
+                whole host, 0 for no limit beyond the worker's
+        """
+        self.requests_per_second = requests_per_second
+        self.request_burst = request_burst
+        self.tokens_per_minute = tokens_per_minute
+        self.max_clients = max_clients
+        self.max_concurrent_host = max_concurrent_host
+        self.gate = ConcurrencyGate(max_concurrent, max_queue, queue_timeout)
+        self.state = state if state is not None else LocalSharedState(max_keys=max_clients)
+
+    @classmethod
+    def from_settings(
+        cls, settings_instance: Settings, state: Optional[SharedState] = None
+    ) -> "AdmissionController":
+        """Build a controller configured by the application settings."""
+        return cls(
+            requests_per_second=settings_instance.ADMISSION_REQUESTS_PER_SECOND,
+            request_burst=settings_instance.ADMISSION_REQUEST_BURST,
+            tokens_per_minute=settings_instance.ADMISSION_TOKENS_PER_MINUTE,
+            max_concurrent=settings_instance.ADMISSION_MAX_CONCURRENT,
+            max_queue=settings_instance.ADMISSION_MAX_QUEUE,
+            queue_timeout=settings_instance.ADMISSION_QUEUE_TIMEOUT,
+            max_clients=settings_instance.ADMISSION_MAX_CLIENTS,
+            state=state,
+            max_concurrent_host=settings_instance.ADMISSION_MAX_CONCURRENT_HOST,
+        )
+
+    async def check_rate(self, client_id: str, estimated_tokens: int) -> None:
+        """Charge a request to its client's buckets.
+
+        Args:
+            client_id: Identifies the client, e.g. its address
+            estimated_tokens: Tokens the request is expected to use
+
+        Raises:
+            AdmissionRejected: When either bucket is short, with the wait
+                until both would admit the request
+        """
+        wait = await self.state.charge(client_id, (
+            BucketCharge(self.requests_per_second, self.request_burst, 1),
+            BucketCharge(self.tokens_per_minute / 60, self.tokens_per_minute, estimated_tokens),
+        ))
+        if wait > 0:
+            logger.info("Rate limited client %s for %.2fs", client_id, wait, extra=SAMPLED)
+            raise AdmissionRejected(f"Rate limit exceeded, retry after {wait:.2f}s", round(wait, 3))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """Hold a slot of the worker's concurrency gate and record the stream on the host.
+
+        Raises:
+            AdmissionRejected: When the queue is full, the wait times out or
+                the host runs as many completions as it may
+        """
+        await self.gate.acquire()
+        try:
+            stream_id = await self.state.register_stream(self.max_concurrent_host)
+            if stream_id is None:
+                raise AdmissionRejected("The server is at capacity, please retry later", BUSY_RETRY_AFTER)
+            try:
+                yield
+            finally:
+                await self.state.unregister_stream(stream_id)
+        finally:
+            self.gate.release()
@@ -1,23 +1,129 @@
+import asyncio
 import logging
-import sqlite3
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from src.adapters.router import ProviderRouter
 from src.settings import settings
+from src.utils.admission import AdmissionController
+from src.utils.completion_cache import CompletionCache
+from src.utils.conversation_store import ConversationStore
+from src.utils.logs import configure_logging
+from src.utils.metrics import ServiceMetrics
+from src.utils.send_queue import SendQueueMetrics
+from src.utils.shared_state import SHARED_STATE_SQLITE, SharedState
+from src.utils.single_flight import SingleFlightGroup
+from src.utils.token_budget import TokenBudget
+from src.utils.tracing import Tracer
 
-logging.basicConfig(
-    level=getattr(logging, settings.LOGGING_LEVEL),  # Set the logging level
-    format="[%(asctime)s][%(name)s] %(levelname)s: %(message)s",  # Format for log messages
-    datefmt="%Y-%m-%d %H:%M:%S",  # Date format
-)
+# Records are written by a background thread, never by the event loop
+configure_logging(settings)
 logger = logging.getLogger(__name__)
 
 
+async def warm_up(app: FastAPI) -> None:
+    """Wait for the providers to be built and warm their connection pools up.
+
+    The worker reports ready once this returns, even when no provider
+    answered the warmup. When it fails, the worker reports neither ready
+    nor live, so that it is restarted.
+
+    Args:
+        app: The application whose state holds the router and its build
+    """
+    try:
+        # Shielded, since cancelling cannot stop the thread building the router
+        app.state.provider_router = await asyncio.shield(app.state.router_build)
+        logger.info("Routing completions between %s providers.", len(app.state.provider_router.providers))
+        if settings.OPENAI_WARMUP_ON_STARTUP and not await app.state.provider_router.warmup():
+            logger.warning("No provider answered the warmup, the first requests open their connections.")
+        logger.info("Worker ready to serve completions.")
+    except Exception:
+        logger.exception("Worker failed to start, it reports neither live nor ready.")
+        raise
+
+
 @asynccontextmanager
 async def app_resources_lifespan(app: FastAPI):
+    # One pooled upstream client per provider, shared by every connection. The
+    # SDK is imported and the router built on a worker thread, so the port is
+    # bound before they are loaded and /health/ready only answers once the
+    # connection pools are warm. Connections arriving earlier wait for the build.
+    app.state.provider_router = None
+    app.state.router_build = asyncio.ensure_future(asyncio.to_thread(ProviderRouter.from_settings, settings))
+    app.state.startup = asyncio.create_task(warm_up(app))
+
+    # Rate limits and active streams, shared with the other workers of the host
+    app.state.shared_state = SharedState.from_settings(settings)
+    app.state.shared_state.open()
+    logger.info("Shared state backend: %s.", settings.SHARED_STATE_BACKEND)
+
+    app.state.completion_cache = None
+    if settings.COMPLETION_CACHE_ENABLED:
+        app.state.completion_cache = CompletionCache(
+            path=settings.COMPLETION_CACHE_PATH,
+            ttl_seconds=settings.COMPLETION_CACHE_TTL_SECONDS,
+            max_entries=settings.COMPLETION_CACHE_MAX_ENTRIES,
+        )
+        app.state.completion_cache.open()
+        logger.info("Completion cache opened at %s.", settings.COMPLETION_CACHE_PATH)
+
+    # Identical deterministic requests share one upstream stream app-wide
+    app.state.single_flight = SingleFlightGroup() if settings.SINGLE_FLIGHT_ENABLED else None
+
+    app.state.conversation_store = None
+    if settings.CONVERSATION_STORE_ENABLED:
+        app.state.conversation_store = ConversationStore(
+            path=settings.CONVERSATION_STORE_PATH,
+            idle_ttl_seconds=settings.CONVERSATION_IDLE_TTL_SECONDS,
+            max_bytes=settings.CONVERSATION_STORE_MAX_BYTES,
+            # Other workers may have added turns to a history held in memory
+            shared=settings.SHARED_STATE_BACKEND == SHARED_STATE_SQLITE,
+        )
+        app.state.conversation_store.open()
+        logger.info("Conversation store opened at %s.", settings.CONVERSATION_STORE_PATH)
+
+    # Token counts are memoized app-wide, so histories are measured once
+    app.state.token_budget = None
+    if settings.TOKEN_BUDGET_ENABLED:
+        app.state.token_budget = TokenBudget.from_settings(settings)
+
+    # Rate limits and the concurrency gate apply across every connection
+    app.state.admission = None
+    if settings.ADMISSION_ENABLED:
+        app.state.admission = AdmissionController.from_settings(settings, app.state.shared_state)
+
+    # Depth and slow-consumer counters of every connection's send queue
+    app.state.send_queue_metrics = SendQueueMetrics()
+    # Latency histograms and request counters exposed on /metrics
+    app.state.service_metrics = ServiceMetrics()
+    # Stages of sampled requests, kept in memory or written to a file
+    app.state.tracer = Tracer.from_settings(settings) if settings.TRACING_ENABLED else None
     try:
         yield
     finally:
         # Cleanup resources
-        logger.info("Database connection closed.")
+        app.state.startup.cancel()
+        await asyncio.gather(app.state.startup, return_exceptions=True)
+        # A router whose build outlived the startup is closed once it is done
+        router = (await asyncio.gather(app.state.router_build, return_exceptions=True))[0]
+        app.state.startup = None
+        app.state.router_build = None
+        app.state.provider_router = None
+        if not isinstance(router, BaseException):
+            await router.close()
+            logger.info("OpenAI connection pools closed.")
+        if app.state.completion_cache is not None:
+            app.state.completion_cache.close()
+            app.state.completion_cache = None
+            logger.info("Database connection closed.")
+        if app.state.conversation_store is not None:
+            app.state.conversation_store.close()
+            app.state.conversation_store = None
+            logger.info("Conversation store closed.")
+        app.state.shared_state.close()
+        app.state.shared_state = None
+        if app.state.tracer is not None:
+            app.state.tracer.close()
+            app.state.tracer = None
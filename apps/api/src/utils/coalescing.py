@@ -0,0 +1,106 @@
+"""Coalescing of streamed text deltas into fewer, larger outbound frames."""
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, List, Optional
+
+# Marks the end of the source iterator inside a pending read
+_END = object()
+
+
+async def _next_delta(iterator: AsyncIterator[str]) -> object:
+    """Read the next delta, reporting the end of the iterator as a sentinel.
+
+    Args:
+        iterator: The source of text deltas
+
+    Returns:
+        The delta, or _END when the iterator is exhausted
+    """
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+def _size_in_bytes(text: str) -> int:
+    """Return the UTF-8 size of a delta without encoding ASCII text."""
+    return len(text) if text.isascii() else len(text.encode("utf-8"))
+
+
+async def coalesce_deltas(
+    deltas: AsyncIterator[str],
+    window: float,
+    max_bytes: int,
+) -> AsyncGenerator[str, None]:
+    """Batch text deltas by time window and size.
+
+    The first delta is always yielded immediately so time-to-first-token is
+    unaffected. Later deltas are buffered until the window since the oldest
+    buffered delta elapses, the buffer reaches max_bytes, or the source ends.
+    A timer is only armed while something is buffered.
+
+    Args:
+        deltas: The source of text deltas
+        window: Longest time in seconds a delta may wait in the buffer,
+            0 disables coalescing
+        max_bytes: Buffered size in bytes that triggers an immediate flush
+
+    Yields:
+        Batches of concatenated deltas
+    """
+    iterator = deltas.__aiter__()
+    if window <= 0:
+        async for delta in iterator:
+            yield delta
+        return
+
+    first = await _next_delta(iterator)
+    if first is _END:
+        return
+    yield first
+
+    loop = asyncio.get_running_loop()
+    buffer: List[str] = []
+    size = 0
+    deadline = 0.0
+    pending: Optional[asyncio.Task] = None
+    try:
+        while True:
+            if buffer:
+                # Race the next read against the window of the buffered deltas
+                if pending is None:
+                    pending = asyncio.ensure_future(_next_delta(iterator))
+                timeout = deadline - loop.time()
+                if timeout > 0:
+                    await asyncio.wait((pending,), timeout=timeout)
+                if not pending.done():
+                    # Window elapsed while the upstream is still quiet
+                    yield "".join(buffer)
+                    buffer.clear()
+                    size = 0
+                    continue
+                delta = pending.result()
+                pending = None
+            elif pending is not None:
+                delta = await pending
+                pending = None
+            else:
+                delta = await _next_delta(iterator)
+
+            if delta is _END:
+                break
+
+            if not buffer:
+                deadline = loop.time() + window
+            buffer.append(delta)
+            size += _size_in_bytes(delta)
+            if size >= max_bytes:
+                yield "".join(buffer)
+                buffer.clear()
+                size = 0
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait((pending,))
+
+    if buffer:
+        yield "".join(buffer)
@@ -0,0 +1,191 @@
+"""Exact-match cache of streamed chat completions."""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, Dict, List, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of the expired entries of the SQLite tier
+PURGE_INTERVAL_SECONDS = 300.0
+
+
+def completion_cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+) -> str:
+    """Build the canonical hash that identifies a completion request.
+
+    Args:
+        model: The model used for generation
+        messages: Messages in the format OpenAI expects
+        temperature: Sampling temperature of the request
+        max_tokens: Maximum number of tokens to generate
+
+    Returns:
+        A hex SHA-256 digest of the canonical request
+    """
+    canonical = json.dumps(
+        {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+async def replay_chunks(chunks: List[str], delay: float = 0.0) -> AsyncGenerator[str, None]:
+    """Replay cached deltas, optionally pacing them like a live stream.
+
+    Args:
+        chunks: The cached deltas in order
+        delay: Pause in seconds between deltas, 0 replays at full speed
+
+    Yields:
+        Each cached delta
+    """
+    for index, chunk in enumerate(chunks):
+        if delay > 0 and index:
+            await asyncio.sleep(delay)
+        yield chunk
+
+
+class CompletionCache:
+    """Two-tier cache of completed responses, stored as their streamed deltas.
+
+    A bounded in-memory LRU serves hot entries. Every entry is also written to
+    a SQLite database so it survives restarts until its TTL expires. Expired
+    rows are purged when the database is opened and then on writes, at most
+    every PURGE_INTERVAL_SECONDS. SQLite is only touched from worker threads
+    so the event loop never blocks on disk.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_entries: int):
+        """Initialize the cache.
+
+        Args:
+            path: Location of the SQLite database, ":memory:" for no persistence
+            ttl_seconds: How long an entry stays valid after it is stored
+            max_entries: Entries kept in the in-memory tier
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+    def open(self) -> None:
+        """Open the SQLite database and drop entries that have expired."""
+        directory = os.path.dirname(self.path)
+        if directory and self.path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        with self._lock, self._connection:
+            # Let the workers of a host read while one of them writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions ("
+                " key TEXT PRIMARY KEY,"
+                " chunks TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._purge(time.time())
+
+    def close(self) -> None:
+        """Close the SQLite database."""
+        if self._connection is not None:
+            with self._lock:
+                self._connection.close()
+            self._connection = None
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        """Look up a cached response.
+
+        Args:
+            key: The request key from completion_cache_key
+
+        Returns:
+            The cached deltas, or None on a miss
+        """
+        entry = self._memory.get(key)
+        if entry is not None:
+            expires_at, chunks = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                return chunks
+            del self._memory[key]
+
+        entry = await asyncio.to_thread(self._load, key)
+        if entry is None:
+            return None
+        self._remember(key, *entry)
+        return entry[1]
+
+    async def set(self, key: str, chunks: List[str]) -> None:
+        """Store a completed response.
+
+        Args:
+            key: The request key from completion_cache_key
+            chunks: The deltas of the response in order
+        """
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, expires_at, chunks)
+        await asyncio.to_thread(self._store, key, expires_at, chunks)
+
+    def _remember(self, key: str, expires_at: float, chunks: List[str]) -> None:
+        """Put an entry in the in-memory tier, evicting the least recently used."""
+        self._memory[key] = (expires_at, chunks)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[Tuple[float, List[str]]]:
+        """Read a valid entry from SQLite."""
+        if self._connection is None:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT expires_at, chunks FROM completions WHERE key = ? AND expires_at > ?",
+                (key, time.time()),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _store(self, key: str, expires_at: float, chunks: List[str]) -> None:
+        """Write an entry to SQLite."""
+        if self._connection is None:
+            return
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO completions (key, chunks, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(chunks, ensure_ascii=False), expires_at),
+                )
+                now = time.time()
+                if now - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                    self._purge(now)
+        except sqlite3.Error as e:
+            logger.warning("Failed to persist cached completion: %s", e)
+
+    def _purge(self, now: float) -> None:
+        """Delete the expired rows, with the lock held."""
+        self._connection.execute("DELETE FROM completions WHERE expires_at <= ?", (now,))
+        self._purged_at = now
+
@@ -0,0 +1,302 @@
+"""Server-side history of conversations, so clients only send new messages."""
+import asyncio
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Purging scans the whole store, so writes only do it this often
+PURGE_INTERVAL_SECONDS = 300.0
+
+
+def _message_size(message: Dict[str, str]) -> int:
+    """Return the approximate memory footprint of a message in bytes."""
+    return len(message["role"]) + len(message["content"])
+
+
+def new_conversation_id() -> str:
+    """Return an unguessable identifier for a conversation the server starts.
+
+    The identifier is the only credential of a conversation, so it is never
+    chosen by clients.
+    """
+    return secrets.token_urlsafe(32)
+
+
+@dataclass
+class Conversation:
+    """The history of one conversation held in memory."""
+    messages: List[Dict[str, str]] = field(default_factory=list)
+    size: int = 0
+    last_used: float = 0.0
+
+
+class ConversationStore:
+    """Two-tier store of conversation histories keyed by conversation_id.
+
+    Histories are kept in memory already in the format OpenAI expects, so
+    earlier messages are never parsed or validated again. Every message is
+    also written to SQLite, indexed by conversation and position, so a
+    history evicted from memory is reloaded on its next turn and survives
+    restarts. Conversations idle for longer than the TTL are dropped from
+    both tiers; the memory tier is additionally bounded by total size, least
+    recently used first. Expired rows are purged when the database is opened
+    and then on writes, at most every PURGE_INTERVAL_SECONDS. SQLite is only
+    touched from worker threads.
+
+    When the database is shared by several worker processes, the turns of a
+    conversation may be served by different workers. A shared store then
+    reads the messages other workers appended after its in-memory copy on
+    every use, instead of trusting that copy.
+    """
+
+    def __init__(self, path: str, idle_ttl_seconds: float, max_bytes: int, shared: bool = False):
+        """Initialize the store.
+
+        Args:
+            path: Location of the SQLite database, ":memory:" for no persistence
+            idle_ttl_seconds: How long a conversation lives after its last use
+            max_bytes: Total size of the histories kept in memory
+            shared: Whether other processes write to the same database
+        """
+        self.path = path
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._memory: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._memory_bytes = 0
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+
+    @property
+    def memory_bytes(self) -> int:
+        """The total size of the histories currently held in memory."""
+        return self._memory_bytes
+
+    def open(self) -> None:
+        """Open the SQLite database and drop conversations that have expired."""
+        directory = os.path.dirname(self.path)
+        if directory and self.path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        with self._lock, self._connection:
+            # Let the workers of a host read while one of them writes
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY,"
+                " last_used REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_messages ("
+                " conversation_id TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " pinned INTEGER NOT NULL DEFAULT 0,"
+                " PRIMARY KEY (conversation_id, position))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS conversations_last_used ON conversations (last_used)"
+            )
+            self._purge_expired(time.time())
+
+    def close(self) -> None:
+        """Close the SQLite database."""
+        if self._connection is not None:
+            with self._lock:
+                self._connection.close()
+            self._connection = None
+
+    async def get_history(self, conversation_id: str) -> Optional[List[Dict[str, str]]]:
+        """Return the messages of a conversation so far.
+
+        Args:
+            conversation_id: Identifier issued by new_conversation_id
+
+        Returns:
+            The history in the format OpenAI expects, or None if the
+            conversation is unknown or has expired
+        """
+        conversation = await self._get(conversation_id)
+        return conversation.messages if conversation is not None else None
+
+    async def append(self, conversation_id: str, messages: List[Dict[str, str]]) -> None:
+        """Append messages to a conversation, starting it if it is unknown.
+
+        Args:
+            conversation_id: Identifier issued by new_conversation_id
+            messages: Messages in the format OpenAI expects
+        """
+        now = time.time()
+        conversation = await self._get(conversation_id)
+        if conversation is None:
+            conversation = Conversation()
+            self._memory[conversation_id] = conversation
+        start = len(conversation.messages)
+        conversation.messages.extend(messages)
+        added = sum(_message_size(message) for message in messages)
+        conversation.size += added
+        conversation.last_used = now
+        self._memory_bytes += added
+        self._memory.move_to_end(conversation_id)
+        self._evict(now, keep=conversation_id)
+        await asyncio.to_thread(self._store, conversation_id, start, messages, now)
+
+    async def _get(self, conversation_id: str) -> Optional[Conversation]:
+        """Find a live conversation in memory, or load it from SQLite."""
+        now = time.time()
+        conversation = self._memory.get(conversation_id)
+        if conversation is not None and self.shared:
+            newer = await asyncio.to_thread(self._load, conversation_id, now, len(conversation.messages))
+            if newer is None:
+                # Expired, or restarted under this id, by another worker
+                self._forget(conversation_id)
+                conversation = None
+            elif newer:
+                conversation.messages.extend(newer)
+                added = sum(_message_size(message) for message in newer)
+                conversation.size += added
+                self._memory_bytes += added
+        if conversation is not None:
+            if now - conversation.last_used < self.idle_ttl_seconds:
+                conversation.last_used = now
+                self._memory.move_to_end(conversation_id)
+                return conversation
+            self._forget(conversation_id)
+
+        messages = await asyncio.to_thread(self._load, conversation_id, now)
+        if messages is None or conversation_id in self._memory:
+            return self._memory.get(conversation_id)
+        conversation = Conversation(
+            messages=messages,
+            size=sum(_message_size(message) for message in messages),
+            last_used=now,
+        )
+        self._memory[conversation_id] = conversation
+        self._memory_bytes += conversation.size
+        self._evict(now, keep=conversation_id)
+        return conversation
+
+    def _forget(self, conversation_id: str) -> None:
+        """Drop a conversation from the memory tier."""
+        conversation = self._memory.pop(conversation_id, None)
+        if conversation is not None:
+            self._memory_bytes -= conversation.size
+
+    def _evict(self, now: float, keep: str) -> None:
+        """Drop idle conversations, then the least recently used until under budget.
+
+        Args:
+            now: The current time
+            keep: A conversation that must stay, the one being used
+        """
+        while self._memory:
+            oldest, conversation = next(iter(self._memory.items()))
+            if now - conversation.last_used < self.idle_ttl_seconds:
+                # Entries are in order of use, the rest are more recent
+                break
+            self._forget(oldest)
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            oldest = next(iter(self._memory))
+            if oldest == keep:
+                break
+            self._forget(oldest)
+
+    def _load(
+        self, conversation_id: str, now: float, start: int = 0
+    ) -> Optional[List[Dict[str, str]]]:
+        """Read the messages of a live conversation from SQLite, from a position on.
+
+        Returns None if the conversation is not live, or holds fewer than
+        start messages and so is not the one already read.
+        """
+        if self._connection is None:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM conversations WHERE id = ? AND last_used > ?",
+                (conversation_id, now - self.idle_ttl_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            if start:
+                (stored,) = self._connection.execute(
+                    "SELECT COUNT(*) FROM conversation_messages WHERE conversation_id = ?",
+                    (conversation_id,),
+                ).fetchone()
+                if stored < start:
+                    return None
+            rows = self._connection.execute(
+                "SELECT role, content, pinned FROM conversation_messages"
+                " WHERE conversation_id = ? AND position >= ? ORDER BY position",
+                (conversation_id, start),
+            ).fetchall()
+        messages = []
+        for role, content, pinned in rows:
+            message = {"role": role, "content": content}
+            if pinned:
+                message["pinned"] = True
+            messages.append(message)
+        return messages
+
+    def _store(
+        self,
+        conversation_id: str,
+        start: int,
+        messages: List[Dict[str, str]],
+        now: float,
+    ) -> None:
+        """Write new messages of a conversation to SQLite."""
+        if self._connection is None:
+            return
+        try:
+            with self._lock, self._connection:
+                if start == 0:
+                    # A new conversation may reuse the id of an expired one
+                    self._connection.execute(
+                        "DELETE FROM conversation_messages WHERE conversation_id = ?",
+                        (conversation_id,),
+                    )
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO conversations (id, last_used) VALUES (?, ?)",
+                    (conversation_id, now),
+                )
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO conversation_messages"
+                    " (conversation_id, position, role, content, pinned) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            conversation_id,
+                            start + offset,
+                            message["role"],
+                            message["content"],
+                            int(bool(message.get("pinned"))),
+                        )
+                        for offset, message in enumerate(messages)
+                    ],
+                )
+                if now - self._purged_at >= PURGE_INTERVAL_SECONDS:
+                    self._purge_expired(now)
+        except sqlite3.Error as e:
+            logger.warning("Failed to persist conversation %s: %s", conversation_id, e)
+
+    def _purge_expired(self, now: float) -> None:
+        """Delete conversations idle for longer than the TTL, lock already held."""
+        cutoff = now - self.idle_ttl_seconds
+        self._connection.execute(
+            "DELETE FROM conversation_messages WHERE conversation_id IN"
+            " (SELECT id FROM conversations WHERE last_used <= ?)",
+            (cutoff,),
+        )
+        self._connection.execute("DELETE FROM conversations WHERE last_used <= ?", (cutoff,))
+        self._purged_at = now
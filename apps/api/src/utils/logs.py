@@ -0,0 +1,167 @@
+"""Logging off the event loop: queued records, JSON lines and per-call-site sampling."""
+import atexit
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+
+from src.settings import Settings
+
+# Output formats
+LOG_FORMAT_JSON = "json"
+LOG_FORMAT_TEXT = "text"
+
+TEXT_FORMAT = "[%(asctime)s][%(name)s] %(levelname)s: %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Pass as extra= from high-frequency call sites to have their records sampled
+SAMPLED = {"sampled": True}
+
+# Attributes every record has, the others were passed in extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Third-party loggers that write for themselves instead of propagating to the root
+_SERVER_LOGGERS = ("uvicorn", "uvicorn.access")
+
+_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line.
+
+    The object has the time in UTC, the level, the logger name and the
+    message, then the fields passed in extra= and the formatted exception.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class CallSiteSampler(logging.Filter):
+    """Keeps one in every N records of each call site that asks to be sampled.
+
+    Call sites opt in with extra=SAMPLED and are told apart by file and
+    line, so a noisy site is thinned without hiding rare ones. Kept records
+    carry sample_every, the number of records each one stands for.
+    """
+
+    def __init__(self, every: int):
+        """Initialize the sampler.
+
+        Args:
+            every: Records of a site per record kept, 1 keeps them all
+        """
+        super().__init__()
+        self.every = every
+        self._counts: Dict[Tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every <= 1 or not getattr(record, "sampled", False):
+            return True
+        site = (record.pathname, record.lineno)
+        count = self._counts.get(site, 0)
+        self._counts[site] = count + 1
+        if count % self.every:
+            return False
+        record.sample_every = self.every
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hands records to the listener thread as they are, never waiting for room.
+
+    Unlike QueueHandler, the message is not formatted here, so the %-style
+    arguments of a call are only merged by the listener thread. A full queue
+    drops the record and counts it rather than holding up the event loop.
+    """
+
+    def __init__(self, records: queue.Queue):
+        """Initialize the handler.
+
+        Args:
+            records: Bounded queue read by the listener thread
+        """
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def build_formatter(log_format: str) -> logging.Formatter:
+    """Return the formatter of an output format.
+
+    Args:
+        log_format: LOG_FORMAT_JSON or LOG_FORMAT_TEXT
+
+    Returns:
+        The formatter the listener thread writes records with
+    """
+    if log_format == LOG_FORMAT_JSON:
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT, datefmt=TEXT_DATE_FORMAT)
+
+
+def configure_logging(settings_instance: Settings) -> NonBlockingQueueHandler:
+    """Route the records of the process through a queue to a background writer.
+
+    The root logger and the server's own loggers put their records on a
+    bounded queue, and a listener thread formats them and writes them to
+    stderr. A slow sink then fills the queue instead of blocking the event
+    loop. The listener is stopped, and the queue drained, at exit. Calling
+    this again returns the handler installed the first time.
+
+    Args:
+        settings_instance: Settings holding the level, format, queue size
+            and sampling of the logs
+
+    Returns:
+        The handler every record goes through
+    """
+    global _handler
+    if _handler is not None:
+        return _handler
+
+    sink = logging.StreamHandler()
+    sink.setFormatter(build_formatter(settings_instance.LOG_FORMAT))
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=settings_instance.LOG_QUEUE_MAX_RECORDS))
+    handler.addFilter(CallSiteSampler(settings_instance.LOG_SAMPLE_EVERY))
+    listener = QueueListener(handler.queue, sink)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, settings_instance.LOGGING_LEVEL))
+    root.addHandler(handler)
+    for name in _SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        if server_logger.handlers:
+            server_logger.handlers = [handler]
+    _handler = handler
+    return handler
+
+
+def log_queue_stats() -> Tuple[int, int]:
+    """Return the records waiting for the writer and the records dropped so far."""
+    if _handler is None:
+        return 0, 0
+    return _handler.queue.qsize(), _handler.dropped
@@ -0,0 +1,369 @@
+"""Prometheus-compatible metrics of the streaming pipeline.
+
+Recording happens once per upstream delta, so the metric types here are kept
+minimal: a labelled child is resolved once per request and an observation is
+a bisect plus two additions. Every worker records from its own event loop, so
+no locking is needed. render() produces the Prometheus text exposition
+format (version 0.0.4) on scrape.
+"""
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from src.adapters.models import OpenAIModel
+
+# Content type of the text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Models reported by name; any other is reported as "other" so that clients
+# cannot grow the number of label sets
+KNOWN_MODELS = frozenset(model.value for model in OpenAIModel)
+
+# Bucket upper bounds, in seconds unless stated otherwise
+FIRST_TOKEN_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 20.0)
+INTER_TOKEN_BUCKETS = (0.005, 0.01, 0.02, 0.03, 0.05, 0.075, 0.1, 0.2, 0.5, 1.0, 2.5)
+STREAM_DURATION_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+TOKENS_PER_SECOND_BUCKETS = (5.0, 10.0, 20.0, 40.0, 60.0, 80.0, 100.0, 150.0, 200.0, 400.0)
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value the way Prometheus parses it."""
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Format a label set, empty when there are no labels."""
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric(ABC):
+    """A named metric family with optional labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        """Initialize the metric family.
+
+        Args:
+            name: The metric name
+            documentation: The HELP text
+            label_names: Names of the labels every sample carries
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Return the child of a label set, creating it on first use.
+
+        Resolve it once and keep it when recording in a hot loop.
+        """
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Return the state of a new label set."""
+
+    def render(self, lines: List[str]) -> None:
+        """Append the exposition lines of the family."""
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        if not self.label_names:
+            # Unlabelled families always expose their sample, 0 until recorded
+            self.labels()
+        for values, child in self._children.items():
+            self._render_child(lines, _format_labels(self.label_names, values), child)
+
+    def _render_child(self, lines: List[str], labels: str, child) -> None:
+        lines.append(f"{self.name}{labels} {_format_value(child.value)}")
+
+
+class _Value:
+    """A single sample value."""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the unlabelled counter."""
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1) -> None:
+        """Increment the unlabelled gauge."""
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1) -> None:
+        """Decrement the unlabelled gauge."""
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        """Set the unlabelled gauge."""
+        self.labels().set(value)
+
+
+class _Buckets:
+    """Observations of one histogram child, counted per bucket."""
+
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    """Observations counted in fixed buckets, rendered cumulatively."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = FIRST_TOKEN_BUCKETS,
+    ):
+        """Initialize the histogram.
+
+        Args:
+            name: The metric name
+            documentation: The HELP text
+            label_names: Names of the labels every sample carries
+            buckets: Upper bounds of the buckets, +Inf is implied
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def _render_child(self, lines: List[str], labels: str, child: _Buckets) -> None:
+        prefix = labels[:-1] + "," if labels else "{"
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{prefix}le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+def render(metrics: Iterable[_Metric]) -> str:
+    """Render metric families in the text exposition format.
+
+    Args:
+        metrics: The families to render
+
+    Returns:
+        The exposition text
+    """
+    lines: List[str] = []
+    for metric in metrics:
+        metric.render(lines)
+    return "\n".join(lines) + "\n"
+
+
+class StreamRecorder:
+    """Records the timings and outcome of one streamed completion."""
+
+    __slots__ = ("_metrics", "_model", "_first_token", "_inter_token", "_start", "_last", "_finished")
+
+    def __init__(self, metrics: "ServiceMetrics", model: str):
+        """Start recording a completion.
+
+        Args:
+            metrics: The service metrics to record into
+            model: The model the completion is requested from
+        """
+        self._metrics = metrics
+        self._model = model
+        self._first_token = metrics.time_to_first_token.labels(model)
+        self._inter_token = metrics.inter_token_latency.labels(model)
+        self._start = time.monotonic()
+        self._last: Optional[float] = None
+        self._finished = False
+        metrics.requests.labels(model).inc()
+
+    def delta(self, now: Optional[float] = None) -> None:
+        """Record the arrival of an upstream delta.
+
+        Args:
+            now: The monotonic time it arrived, read from the clock if not given
+        """
+        if now is None:
+            now = time.monotonic()
+        if self._last is None:
+            self._first_token.observe(now - self._start)
+        else:
+            self._inter_token.observe(now - self._last)
+        self._last = now
+
+    def completed(self, tokens: int) -> None:
+        """Record a stream that ran to its end.
+
+        Args:
+            tokens: The number of deltas streamed
+        """
+        if self._finish():
+            duration = time.monotonic() - self._start
+            self._metrics.stream_duration.labels(self._model).observe(duration)
+            if tokens and duration > 0:
+                self._metrics.tokens_per_second.labels(self._model).observe(tokens / duration)
+
+    def failed(self) -> None:
+        """Record a completion that ended with an error."""
+        if self._finish():
+            self._metrics.errors.labels(self._model).inc()
+
+    def cancelled(self) -> None:
+        """Record a completion the client cancelled."""
+        if self._finish():
+            self._metrics.cancellations.labels(self._model).inc()
+
+    def disconnected(self) -> None:
+        """Record a completion interrupted by the client disconnecting."""
+        if self._finish():
+            self._metrics.disconnects.labels(self._model).inc()
+
+    def _finish(self) -> bool:
+        """Mark the outcome as recorded, returning False if it already was."""
+        if self._finished:
+            return False
+        self._finished = True
+        return True
+
+
+class ServiceMetrics:
+    """The metrics a worker records while serving completions."""
+
+    def __init__(self):
+        """Create the metric families."""
+        self.time_to_first_token = Histogram(
+            "singularity_time_to_first_token_seconds",
+            "Time from receiving a request to its first upstream token.",
+            ("model",),
+            FIRST_TOKEN_BUCKETS,
+        )
+        self.inter_token_latency = Histogram(
+            "singularity_inter_token_latency_seconds",
+            "Time between two upstream tokens of a stream.",
+            ("model",),
+            INTER_TOKEN_BUCKETS,
+        )
+        self.stream_duration = Histogram(
+            "singularity_stream_duration_seconds",
+            "Time from receiving a request to the end of its stream.",
+            ("model",),
+            STREAM_DURATION_BUCKETS,
+        )
+        self.tokens_per_second = Histogram(
+            "singularity_tokens_per_second",
+            "Tokens streamed per second over a whole completion.",
+            ("model",),
+            TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.requests = Counter(
+            "singularity_requests_total", "Chat completion requests started.", ("model",)
+        )
+        self.errors = Counter(
+            "singularity_request_errors_total", "Chat completion requests that failed.", ("model",)
+        )
+        self.cancellations = Counter(
+            "singularity_request_cancellations_total",
+            "Chat completion requests cancelled by the client.",
+            ("model",),
+        )
+        self.disconnects = Counter(
+            "singularity_request_disconnects_total",
+            "Chat completion requests interrupted by a client disconnect.",
+            ("model",),
+        )
+        self.rejections = Counter(
+            "singularity_admission_rejections_total",
+            "Requests rejected by rate limits or a full admission queue.",
+        )
+        self.active_websockets = Gauge(
+            "singularity_active_websockets", "WebSocket connections currently open."
+        )
+        self.upstream_streams = Gauge(
+            "singularity_upstream_streams", "Upstream completion streams currently open."
+        )
+
+    def families(self) -> List[_Metric]:
+        """Return every metric family recorded by the worker."""
+        return [
+            self.time_to_first_token,
+            self.inter_token_latency,
+            self.stream_duration,
+            self.tokens_per_second,
+            self.requests,
+            self.errors,
+            self.cancellations,
+            self.disconnects,
+            self.rejections,
+            self.active_websockets,
+            self.upstream_streams,
+        ]
+
+    def start_stream(self, model: str) -> StreamRecorder:
+        """Start recording a chat completion.
+
+        Args:
+            model: The model the completion is requested from
+
+        Returns:
+            The recorder of the completion
+        """
+        return StreamRecorder(self, model if model in KNOWN_MODELS else "other")
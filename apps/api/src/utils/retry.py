@@ -0,0 +1,179 @@
+"""Retry policy for upstream calls made before any token has been streamed."""
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    retry_if_exception,
+    stop_after_attempt,
+    stop_before_delay,
+    wait_random_exponential,
+)
+from tenacity.wait import wait_base
+
+from src.utils.logs import SAMPLED
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt besides 429 and 5xx
+_RETRYABLE_STATUSES = {408, 409}
+
+# Rate limit errors that no amount of waiting fixes
+_FATAL_RATE_LIMIT_CODES = {"insufficient_quota"}
+
+
+def retry_reason(error: BaseException) -> Optional[str]:
+    """Classify an upstream error as retryable or fatal.
+
+    Args:
+        error: The error raised by the OpenAI client
+
+    Returns:
+        A short label for a retryable error, or None for a fatal one
+    """
+    # Imported here so the retry counters can be used before the SDK is loaded
+    from openai import (
+        APIConnectionError,
+        APIStatusError,
+        APITimeoutError,
+        InternalServerError,
+        RateLimitError,
+    )
+
+    if isinstance(error, APITimeoutError):
+        return "timeout"
+    if isinstance(error, APIConnectionError):
+        return "connection"
+    if isinstance(error, RateLimitError):
+        return None if getattr(error, "code", None) in _FATAL_RATE_LIMIT_CODES else "rate_limit"
+    if isinstance(error, InternalServerError):
+        return "server_error"
+    if isinstance(error, APIStatusError) and error.status_code in _RETRYABLE_STATUSES:
+        return f"status_{error.status_code}"
+    return None
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Read how long the upstream asked us to wait from its response headers.
+
+    Both the ``retry-after-ms`` header OpenAI sends and the standard
+    ``Retry-After`` header, in seconds or as an HTTP date, are understood.
+
+    Args:
+        error: The error raised by the OpenAI client
+
+    Returns:
+        The delay in seconds, or None when the response did not set one
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(float(retry_after_ms) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class wait_retry_after_or_jitter(wait_base):
+    """Wait as long as the upstream asked, or a jittered exponential backoff."""
+
+    def __init__(self, base_delay: float, max_delay: float):
+        """Initialize the wait strategy.
+
+        Args:
+            base_delay: Scale of the exponential backoff in seconds
+            max_delay: Longest wait in seconds, also caps Retry-After
+        """
+        self.max_delay = max_delay
+        self.backoff = wait_random_exponential(multiplier=base_delay, max=max_delay)
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        error = retry_state.outcome.exception() if retry_state.outcome else None
+        requested = retry_after_seconds(error) if error is not None else None
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return self.backoff(retry_state)
+
+
+@dataclass
+class RetryMetrics:
+    """Counters of upstream retries, shared by every request of an adapter."""
+    retries: int = 0
+    exhausted: int = 0
+    by_reason: Counter = field(default_factory=Counter)
+
+    def record_retry(self, reason: str) -> None:
+        """Count a failed attempt that is about to be retried."""
+        self.retries += 1
+        self.by_reason[reason] += 1
+
+    def as_dict(self) -> dict:
+        """Return the counters as plain data."""
+        return {
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+            "byReason": dict(self.by_reason),
+        }
+
+
+def build_retrying(
+    max_attempts: int,
+    base_delay: float,
+    max_delay: float,
+    deadline: float,
+    metrics: RetryMetrics,
+) -> AsyncRetrying:
+    """Build the retry controller for one upstream call.
+
+    Only retryable errors are retried. Attempts stop after max_attempts, or
+    as soon as the next one could not start within the total deadline.
+
+    Args:
+        max_attempts: Attempts in total, the first one included
+        base_delay: Scale of the exponential backoff in seconds
+        max_delay: Longest single wait in seconds
+        deadline: Total time in seconds the call may spend retrying
+        metrics: Counters updated before every retry
+
+    Returns:
+        A tenacity controller that re-raises the last error when it gives up
+    """
+
+    def before_sleep(retry_state: RetryCallState) -> None:
+        error = retry_state.outcome.exception()
+        reason = retry_reason(error) or "unknown"
+        metrics.record_retry(reason)
+        logger.warning(
+            "Upstream call failed (%s), retrying in %.2fs (attempt %s/%s)",
+            reason, retry_state.next_action.sleep, retry_state.attempt_number, max_attempts, extra=SAMPLED
+        )
+
+    return AsyncRetrying(
+        retry=retry_if_exception(lambda error: retry_reason(error) is not None),
+        wait=wait_retry_after_or_jitter(base_delay, max_delay),
+        stop=stop_after_attempt(max_attempts) | stop_before_delay(deadline),
+        before_sleep=before_sleep,
+        reraise=True,
+    )
@@ -0,0 +1,238 @@
+"""Bounded per-connection send queue decoupling upstream reads from socket writes."""
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from starlette.websockets import WebSocketDisconnect
+
+from src.utils.logs import SAMPLED
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# What a full queue does with a new frame
+SLOW_CONSUMER_COALESCE = "coalesce"
+SLOW_CONSUMER_PAUSE = "pause"
+SLOW_CONSUMER_DISCONNECT = "disconnect"
+
+# Close code sent to a consumer dropped for being too slow ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Kinds of outbound frames
+FRAME_CHUNK = "chunk"
+FRAME_ERROR = "error"
+FRAME_RELEASE = "release"
+
+
+@dataclass
+class OutboundFrame:
+    """A frame waiting to be encoded and written to the socket.
+
+    Frames are kept unencoded so that pending deltas of a request can still
+    be merged, and so the codec sees them in the order they are written.
+    Release frames carry no payload: they free the request's stream id in
+    the codec once everything sent before them has been written.
+    """
+    request_id: str
+    kind: str = FRAME_CHUNK
+    content: str = ""
+    finished: bool = False
+    metrics: Optional[Dict[str, Any]] = None
+    retry_after: Optional[float] = None
+
+    @property
+    def mergeable(self) -> bool:
+        """Whether later deltas of the same request may be appended to this frame."""
+        return self.kind == FRAME_CHUNK and not self.finished
+
+
+@dataclass
+class SendQueueMetrics:
+    """Counters of the send queues of every connection of a worker."""
+    connections: int = 0
+    queued_frames: int = 0
+    max_depth: int = 0
+    coalesced: int = 0
+    paused: int = 0
+    disconnected: int = 0
+
+    def as_dict(self) -> dict:
+        """Return the counters as plain data."""
+        return {
+            "connections": self.connections,
+            "queuedFrames": self.queued_frames,
+            "maxDepth": self.max_depth,
+            "coalesced": self.coalesced,
+            "paused": self.paused,
+            "disconnected": self.disconnected,
+        }
+
+
+class SendQueue:
+    """Buffers the outbound frames of one connection for a single writer task.
+
+    Request tasks put frames and go back to reading their upstream while the
+    writer drains the queue to the socket. When a slow client lets the queue
+    reach max_frames, the policy decides what happens to the next frame:
+
+    - coalesce: a delta is appended to the request's frame that is still
+      waiting, so the queue stops growing while the upstream keeps streaming
+    - pause: the request waits for room, which stops its upstream reads
+    - disconnect: the connection is closed and every pending send fails
+
+    Final and error frames are never merged; under coalesce they wait for room.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[OutboundFrame], Awaitable[None]],
+        max_frames: int,
+        policy: str = SLOW_CONSUMER_COALESCE,
+        metrics: Optional[SendQueueMetrics] = None,
+        close: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        """Initialize the queue.
+
+        Args:
+            send: Encodes and writes one frame to the socket
+            max_frames: Frames allowed to wait before the policy applies
+            policy: One of coalesce, pause or disconnect
+            metrics: Optional worker-wide counters to update
+            close: Closes the connection of a slow consumer
+        """
+        self.max_frames = max_frames
+        self.policy = policy
+        self.metrics = metrics if metrics is not None else SendQueueMetrics()
+        self.depth = 0
+        self._send = send
+        self._close = close
+        self._frames: Deque[OutboundFrame] = deque()
+        self._tails: Dict[str, OutboundFrame] = {}
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._writer: Optional[asyncio.Task] = None
+        self._aborting: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def start(self) -> None:
+        """Start the writer task."""
+        self.metrics.connections += 1
+        self._writer = asyncio.create_task(self._write())
+
+    async def put(self, frame: OutboundFrame) -> None:
+        """Queue a frame for the writer, applying the policy when the queue is full.
+
+        Args:
+            frame: The frame to send
+
+        Raises:
+            WebSocketDisconnect: When the connection is closed or was
+                dropped as a slow consumer
+        """
+        self._check_open()
+        while self.depth >= self.max_frames:
+            if self.policy == SLOW_CONSUMER_COALESCE and frame.mergeable:
+                tail = self._tails.get(frame.request_id)
+                if tail is not None and tail.mergeable:
+                    tail.content += frame.content
+                    self.metrics.coalesced += 1
+                    return
+            if self.policy == SLOW_CONSUMER_DISCONNECT:
+                self._abort()
+                self._check_open()
+            self.metrics.paused += 1
+            self._writable.clear()
+            await self._writable.wait()
+            self._check_open()
+
+        self._frames.append(frame)
+        self._tails[frame.request_id] = frame
+        self.depth += 1
+        self.metrics.queued_frames += 1
+        self.metrics.max_depth = max(self.metrics.max_depth, self.depth)
+        self._readable.set()
+
+    def release(self, request_id: str) -> None:
+        """Queue the release of a finished request's stream id after its frames.
+
+        Args:
+            request_id: Unique identifier for the request
+        """
+        if not self._closed:
+            self._frames.append(OutboundFrame(request_id, kind=FRAME_RELEASE))
+            self._readable.set()
+
+    async def close(self) -> None:
+        """Stop the writer and drop whatever is still queued."""
+        if self._writer is not None and not self._closed:
+            self.metrics.connections -= 1
+        self._closed = True
+        self._writable.set()
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+        if self._aborting is not None:
+            # Let a slow consumer's close frame go out
+            await asyncio.gather(self._aborting, return_exceptions=True)
+        self._drop_pending()
+
+    def _check_open(self) -> None:
+        """Raise WebSocketDisconnect once the queue no longer accepts frames."""
+        if self._closed:
+            raise WebSocketDisconnect(SLOW_CONSUMER_CLOSE_CODE, "The connection is closed")
+
+    async def _write(self) -> None:
+        """Write queued frames in order until the queue is closed or a send fails."""
+        while True:
+            while not self._frames:
+                self._readable.clear()
+                await self._readable.wait()
+            frame = self._frames.popleft()
+            if frame.kind != FRAME_RELEASE:
+                if self._tails.get(frame.request_id) is frame:
+                    del self._tails[frame.request_id]
+                self.depth -= 1
+                self.metrics.queued_frames -= 1
+                self._writable.set()
+            try:
+                await self._send(frame)
+            except Exception as e:
+                logger.info("Stopped writing to the WebSocket: %s", e, extra=SAMPLED)
+                self._closed = True
+                self.metrics.connections -= 1
+                self._writable.set()
+                self._drop_pending()
+                return
+
+    def _abort(self) -> None:
+        """Drop a slow consumer: stop writing and close its connection."""
+        if self._closed:
+            return
+        logger.warning("Disconnecting slow WebSocket consumer with %s frames queued", self.depth, extra=SAMPLED)
+        self._closed = True
+        self.metrics.connections -= 1
+        self.metrics.disconnected += 1
+        self._writable.set()
+        self._drop_pending()
+        self._aborting = asyncio.ensure_future(self._shut_down_writer())
+
+    async def _shut_down_writer(self) -> None:
+        """Cancel the writer, which may be stuck on the socket, then close it."""
+        if self._writer is not None and not self._writer.done():
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+        if self._close is not None:
+            try:
+                await self._close()
+            except Exception as e:
+                logger.info("Error closing slow WebSocket consumer: %s", e, extra=SAMPLED)
+
+    def _drop_pending(self) -> None:
+        """Forget every queued frame, keeping the shared gauge accurate."""
+        self.metrics.queued_frames -= self.depth
+        self.depth = 0
+        self._frames.clear()
+        self._tails.clear()
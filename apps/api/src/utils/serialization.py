@@ -0,0 +1,352 @@
+"""Wire formats for the WebSocket chat protocol.
+
+Two formats are supported and negotiated through the WebSocket subprotocol
+header:
+
+* JSON text frames (``singularity.json.v1``, also the fallback when the client
+  offers no subprotocol). The fast encoders below are byte-for-byte identical
+  to what ``websocket.send_json(StreamChunk(...).model_dump())`` sends, i.e.
+  the model dumped in field order and encoded with ``json.dumps(...,
+  separators=(",", ":"), ensure_ascii=False)``, without building a pydantic
+  model or an intermediate dict per chunk.
+* MessagePack binary frames (``singularity.msgpack.v1``). Client messages are
+  maps with the same keys as the JSON messages. Server frames are compact
+  arrays that refer to a request by a short integer stream id, bound to the
+  request_id by the first frame of each stream:
+
+  - ``[1, stream_id, content]`` a delta, plus ``request_id`` as a 4th item on
+    the first frame of a stream
+  - ``[2, stream_id, content, metrics]`` the final chunk, plus ``request_id``
+    as a 5th item when it is also the first frame of the stream
+  - ``[3, request_id, error]`` an error, plus ``retry_after`` in seconds as a
+    4th item when the request may be retried later
+
+permessage-deflate is negotiated separately by the server (see the
+``--ws-per-message-deflate`` option of uvicorn) and applies to both formats.
+"""
+import json
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from json.encoder import encode_basestring
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import msgpack
+from pydantic import BaseModel
+
+from src.models.chat import ErrorResponse, StreamChunk
+
+JSON_SUBPROTOCOL = "singularity.json.v1"
+MSGPACK_SUBPROTOCOL = "singularity.msgpack.v1"
+
+# MessagePack frame types
+MSGPACK_CHUNK = 1
+MSGPACK_FINAL = 2
+MSGPACK_ERROR = 3
+
+_CONTENT_KEY = ',"content":'
+_OPEN_TAIL = ',"finished":false,"metrics":null}'
+_FINISHED_TAIL = ',"finished":true,"metrics":null}'
+_OPEN_METRICS = ',"finished":false,"metrics":'
+_FINISHED_METRICS = ',"finished":true,"metrics":'
+
+
+@lru_cache(maxsize=4096)
+def _chunk_prefix(request_id: str) -> str:
+    """Return the encoded start of every chunk of a request, up to its content.
+
+    Args:
+        request_id: Unique identifier for the request
+
+    Returns:
+        The pre-encoded ``{"request_id":...,"content":`` prefix
+    """
+    return '{"request_id":' + encode_basestring(request_id) + _CONTENT_KEY
+
+
+def _encode_value(value: Any) -> str:
+    """Encode a value the way starlette's send_json would."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def encode_stream_chunk(
+    request_id: str,
+    content: str,
+    finished: bool,
+    metrics: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Encode a StreamChunk frame.
+
+    Only the delta text is escaped per call; the request_id prefix is cached.
+
+    Args:
+        request_id: Unique identifier for the request
+        content: Text content of the chunk
+        finished: Flag indicating if this is the final chunk
+        metrics: Optional performance metrics to include
+
+    Returns:
+        The JSON text of the frame
+    """
+    if metrics is None:
+        return _chunk_prefix(request_id) + encode_basestring(content) + (
+            _FINISHED_TAIL if finished else _OPEN_TAIL
+        )
+    return (
+        _chunk_prefix(request_id)
+        + encode_basestring(content)
+        + (_FINISHED_METRICS if finished else _OPEN_METRICS)
+        + _encode_value(metrics)
+        + "}"
+    )
+
+
+def encode_error_response(request_id: str, error: str, retry_after: Optional[float] = None) -> str:
+    """Encode an ErrorResponse frame.
+
+    Args:
+        request_id: Unique identifier for the request
+        error: Description of the error
+        retry_after: Seconds after which the request may be retried
+
+    Returns:
+        The JSON text of the frame
+    """
+    return (
+        '{"request_id":' + encode_basestring(request_id)
+        + ',"error":' + encode_basestring(error)
+        + ',"retry_after":' + _encode_value(retry_after) + "}"
+    )
+
+
+class FrameDecodeError(ValueError):
+    """Raised when a frame received from a peer cannot be decoded."""
+
+
+class FrameCodec(ABC):
+    """Encodes and decodes the frames of one WebSocket connection."""
+
+    subprotocol: Optional[str] = None
+    binary: bool = False
+
+    @abstractmethod
+    def decode(self, data: Union[str, bytes]) -> Any:
+        """Decode a message received from the client.
+
+        Args:
+            data: The raw frame payload
+
+        Returns:
+            The decoded message
+
+        Raises:
+            FrameDecodeError: When the payload is not valid in this format
+        """
+
+    @abstractmethod
+    def encode_request(self, request: BaseModel) -> Union[str, bytes]:
+        """Encode a client message such as a ChatCompletionRequest.
+
+        Args:
+            request: The message to encode
+
+        Returns:
+            The frame payload
+        """
+
+    @abstractmethod
+    def encode_chunk(
+        self,
+        request_id: str,
+        content: str,
+        finished: bool,
+        metrics: Optional[Dict[str, Any]] = None,
+    ) -> Union[str, bytes]:
+        """Encode a StreamChunk frame.
+
+        Args:
+            request_id: Unique identifier for the request
+            content: Text content of the chunk
+            finished: Flag indicating if this is the final chunk
+            metrics: Optional performance metrics to include
+
+        Returns:
+            The frame payload
+        """
+
+    @abstractmethod
+    def encode_error(
+        self,
+        request_id: str,
+        error: str,
+        retry_after: Optional[float] = None,
+    ) -> Union[str, bytes]:
+        """Encode an ErrorResponse frame.
+
+        Args:
+            request_id: Unique identifier for the request
+            error: Description of the error
+            retry_after: Seconds after which the request may be retried
+
+        Returns:
+            The frame payload
+        """
+
+    @abstractmethod
+    def decode_frame(self, data: Union[str, bytes]) -> Union[StreamChunk, ErrorResponse]:
+        """Decode a frame sent by the server, as a client would.
+
+        Args:
+            data: The raw frame payload
+
+        Returns:
+            The decoded chunk or error
+        """
+
+    def release(self, request_id: str) -> None:
+        """Forget any per-request state once a request is over.
+
+        Args:
+            request_id: Unique identifier for the request
+        """
+
+
+class JsonCodec(FrameCodec):
+    """JSON text frames, the default wire format."""
+
+    def __init__(self, subprotocol: Optional[str] = None):
+        """Initialize the codec.
+
+        Args:
+            subprotocol: The negotiated subprotocol, None when the client
+                offered none
+        """
+        self.subprotocol = subprotocol
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        try:
+            return json.loads(data)
+        except ValueError as e:
+            raise FrameDecodeError("Invalid JSON format") from e
+
+    def encode_request(self, request: BaseModel) -> str:
+        return request.model_dump_json(exclude_none=True)
+
+    def encode_chunk(
+        self,
+        request_id: str,
+        content: str,
+        finished: bool,
+        metrics: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        return encode_stream_chunk(request_id, content, finished, metrics)
+
+    def encode_error(self, request_id: str, error: str, retry_after: Optional[float] = None) -> str:
+        return encode_error_response(request_id, error, retry_after)
+
+    def decode_frame(self, data: Union[str, bytes]) -> Union[StreamChunk, ErrorResponse]:
+        frame = json.loads(data)
+        if "error" in frame:
+            return ErrorResponse(**frame)
+        return StreamChunk(**frame)
+
+
+class MsgPackCodec(FrameCodec):
+    """MessagePack binary frames with integer stream ids."""
+
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def __init__(self):
+        """Initialize the codec with no streams assigned yet."""
+        self._stream_ids: Dict[str, int] = {}
+        self._request_ids: Dict[int, str] = {}
+        self._next_stream_id = 1
+        self._packer = msgpack.Packer()
+
+    def decode(self, data: Union[str, bytes]) -> Any:
+        if isinstance(data, str):
+            raise FrameDecodeError("Invalid MessagePack format: expected a binary frame")
+        try:
+            return msgpack.unpackb(data)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise FrameDecodeError("Invalid MessagePack format") from e
+
+    def encode_request(self, request: BaseModel) -> bytes:
+        return self._packer.pack(request.model_dump(exclude_none=True))
+
+    def encode_chunk(
+        self,
+        request_id: str,
+        content: str,
+        finished: bool,
+        metrics: Optional[Dict[str, Any]] = None,
+    ) -> bytes:
+        stream_id = self._stream_ids.get(request_id)
+        frame: List[Any]
+        if finished:
+            frame = [MSGPACK_FINAL, stream_id, content, metrics]
+        else:
+            frame = [MSGPACK_CHUNK, stream_id, content]
+        if stream_id is None:
+            # First frame of the stream binds a new id to the request_id
+            stream_id = self._next_stream_id
+            self._next_stream_id += 1
+            self._stream_ids[request_id] = stream_id
+            frame[1] = stream_id
+            frame.append(request_id)
+        if finished:
+            self.release(request_id)
+        return self._packer.pack(frame)
+
+    def encode_error(self, request_id: str, error: str, retry_after: Optional[float] = None) -> bytes:
+        frame = [MSGPACK_ERROR, request_id, error]
+        if retry_after is not None:
+            frame.append(retry_after)
+        return self._packer.pack(frame)
+
+    def decode_frame(self, data: Union[str, bytes]) -> Union[StreamChunk, ErrorResponse]:
+        frame = msgpack.unpackb(data)
+        frame_type = frame[0]
+        if frame_type == MSGPACK_ERROR:
+            return ErrorResponse(
+                request_id=frame[1],
+                error=frame[2],
+                retry_after=frame[3] if len(frame) > 3 else None,
+            )
+
+        finished = frame_type == MSGPACK_FINAL
+        binding_index = 4 if finished else 3
+        if len(frame) > binding_index:
+            self._request_ids[frame[1]] = frame[binding_index]
+        request_id = self._request_ids[frame[1]]
+        if finished:
+            del self._request_ids[frame[1]]
+        return StreamChunk(
+            request_id=request_id,
+            content=frame[2],
+            finished=finished,
+            metrics=frame[3] if finished else None,
+        )
+
+    def release(self, request_id: str) -> None:
+        self._stream_ids.pop(request_id, None)
+
+
+def negotiate_codec(offered: Sequence[str]) -> FrameCodec:
+    """Pick the wire format for a connection from the client's subprotocols.
+
+    The first supported subprotocol in the client's order of preference wins.
+    Clients that offer none, or none we support, get plain JSON.
+
+    Args:
+        offered: The subprotocols offered by the client
+
+    Returns:
+        A codec for the connection
+    """
+    for subprotocol in offered:
+        if subprotocol == MSGPACK_SUBPROTOCOL:
+            return MsgPackCodec()
+        if subprotocol == JSON_SUBPROTOCOL:
+            return JsonCodec(JSON_SUBPROTOCOL)
+    return JsonCodec()
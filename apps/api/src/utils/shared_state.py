@@ -0,0 +1,353 @@
+"""State shared by the workers of one host: rate-limit buckets and active streams."""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Sequence, Set, Tuple
+
+from src.settings import Settings
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Shared state backends
+SHARED_STATE_LOCAL = "local"
+SHARED_STATE_SQLITE = "sqlite"
+
+# Charges between two purges of the buckets that have refilled
+PURGE_INTERVAL = 1000
+
+
+class TokenBucket:
+    """A token bucket refilled continuously at a fixed rate."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        """Initialize a full bucket.
+
+        Args:
+            rate: Tokens added per second
+            capacity: Most tokens the bucket holds
+            now: The current monotonic time
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Return how long until the bucket holds an amount, 0 if it does now.
+
+        Amounts above the capacity only need a full bucket, so that no
+        request is refused forever.
+
+        Args:
+            amount: Tokens the request needs
+            now: The current monotonic time
+
+        Returns:
+            The wait in seconds
+        """
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+        missing = min(amount, self.capacity) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, amount: float) -> None:
+        """Take an amount out of the bucket, after wait_time returned 0."""
+        self.tokens -= min(amount, self.capacity)
+
+
+class BucketCharge(NamedTuple):
+    """An amount to take from one of a key's buckets, and how that bucket refills."""
+    rate: float
+    capacity: float
+    amount: float
+
+
+def _charge_buckets(buckets: Sequence[TokenBucket], charges: Sequence[BucketCharge], now: float) -> float:
+    """Take every charge from its bucket if all of them fit, returning the wait otherwise."""
+    wait = max(bucket.wait_time(charge.amount, now) for bucket, charge in zip(buckets, charges))
+    if wait == 0:
+        for bucket, charge in zip(buckets, charges):
+            bucket.consume(charge.amount)
+    return wait
+
+
+class SharedState(ABC):
+    """Per-host state the workers must agree on.
+
+    Rate-limit buckets are charged atomically, all of a key's buckets or
+    none, so a client is limited the same however many workers serve it.
+    The stream registry counts the completions running on the whole host.
+    Every operation is a coroutine, so backends that go to disk can do so
+    off the event loop.
+    """
+
+    @classmethod
+    def from_settings(cls, settings_instance: Settings) -> "SharedState":
+        """Build the backend configured by the application settings."""
+        if settings_instance.SHARED_STATE_BACKEND == SHARED_STATE_SQLITE:
+            return SQLiteSharedState(settings_instance.SHARED_STATE_PATH)
+        return LocalSharedState(max_keys=settings_instance.ADMISSION_MAX_CLIENTS)
+
+    def open(self) -> None:
+        """Prepare the backend for use."""
+
+    def close(self) -> None:
+        """Release the backend and forget the streams of this process."""
+
+    @abstractmethod
+    async def charge(self, key: str, charges: Sequence[BucketCharge]) -> float:
+        """Take amounts from the buckets of a key, all of them or none.
+
+        Buckets start full the first time a key is seen.
+
+        Args:
+            key: Whose buckets to charge, e.g. a client id
+            charges: One charge per bucket of the key, always in the same order
+
+        Returns:
+            0 if the charges were taken, otherwise the seconds until all of
+            them would fit
+        """
+
+    @abstractmethod
+    async def register_stream(self, limit: int = 0) -> Optional[str]:
+        """Record a completion starting on this host.
+
+        Args:
+            limit: Most streams allowed on the host at once, 0 for no limit
+
+        Returns:
+            An id to unregister the stream with, or None when the host is
+            at its limit and the stream was not recorded
+        """
+
+    @abstractmethod
+    async def unregister_stream(self, stream_id: str) -> None:
+        """Record the end of a completion.
+
+        Args:
+            stream_id: The id returned by register_stream
+        """
+
+    @abstractmethod
+    async def active_streams(self) -> int:
+        """Return the number of completions running on the host."""
+
+
+class LocalSharedState(SharedState):
+    """State held in the process, for a single worker."""
+
+    def __init__(self, max_keys: int):
+        """Initialize empty state.
+
+        Args:
+            max_keys: Keys whose buckets are remembered, least recently
+                charged first to be forgotten
+        """
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list[TokenBucket]]" = OrderedDict()
+        self._streams: Set[str] = set()
+
+    async def charge(self, key: str, charges: Sequence[BucketCharge]) -> float:
+        now = time.monotonic()
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = [TokenBucket(charge.rate, charge.capacity, now) for charge in charges]
+            self._buckets[key] = buckets
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return _charge_buckets(buckets, charges, now)
+
+    async def register_stream(self, limit: int = 0) -> Optional[str]:
+        if limit and len(self._streams) >= limit:
+            return None
+        stream_id = uuid.uuid4().hex
+        self._streams.add(stream_id)
+        return stream_id
+
+    async def unregister_stream(self, stream_id: str) -> None:
+        self._streams.discard(stream_id)
+
+    async def active_streams(self) -> int:
+        return len(self._streams)
+
+
+def _process_alive(pid: int) -> bool:
+    """Return whether a process with this id is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SQLiteSharedState(SharedState):
+    """State shared by the worker processes of a host through one SQLite file.
+
+    The database runs in WAL mode so that readers never wait for a writer,
+    and every change is a short IMMEDIATE transaction, which serializes the
+    read-modify-write of a bucket across processes. Bucket times are wall
+    clock seconds, the one clock every process agrees on. A bucket that has
+    refilled is the same as no bucket, so those rows are purged from time to
+    time. Streams are recorded with the pid of their worker, and the streams
+    of workers that died are dropped when a worker opens the database.
+    SQLite is only touched from worker threads.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the backend.
+
+        Args:
+            path: Location of the database file every worker opens
+        """
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._charges = 0
+
+    def open(self) -> None:
+        """Open the database, creating its tables, and drop the streams of dead workers."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are started explicitly, so they can be IMMEDIATE
+        self._connection = sqlite3.connect(
+            self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets ("
+                " key TEXT NOT NULL,"
+                " position INTEGER NOT NULL,"
+                " tokens REAL NOT NULL,"
+                " updated REAL NOT NULL,"
+                " full_at REAL NOT NULL,"
+                " PRIMARY KEY (key, position))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS rate_buckets_full_at ON rate_buckets (full_at)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS active_streams ("
+                " id TEXT PRIMARY KEY,"
+                " pid INTEGER NOT NULL,"
+                " started REAL NOT NULL)"
+            )
+            pids = [row[0] for row in self._connection.execute("SELECT DISTINCT pid FROM active_streams")]
+            dead = [(pid,) for pid in pids if not _process_alive(pid)]
+            if dead:
+                self._connection.executemany("DELETE FROM active_streams WHERE pid = ?", dead)
+                logger.info("Dropped the streams of %s workers that are gone", len(dead))
+
+    def close(self) -> None:
+        """Forget the streams of this worker and close the database."""
+        if self._connection is None:
+            return
+        with self._lock:
+            try:
+                self._connection.execute("DELETE FROM active_streams WHERE pid = ?", (os.getpid(),))
+            except sqlite3.Error as e:
+                logger.warning("Failed to clear the streams of this worker: %s", e)
+            self._connection.close()
+        self._connection = None
+
+    async def charge(self, key: str, charges: Sequence[BucketCharge]) -> float:
+        return await asyncio.to_thread(self._charge, key, charges)
+
+    async def register_stream(self, limit: int = 0) -> Optional[str]:
+        return await asyncio.to_thread(self._register_stream, limit)
+
+    async def unregister_stream(self, stream_id: str) -> None:
+        await asyncio.to_thread(self._execute, "DELETE FROM active_streams WHERE id = ?", (stream_id,))
+
+    async def active_streams(self) -> int:
+        return await asyncio.to_thread(self._count_streams)
+
+    def _charge(self, key: str, charges: Sequence[BucketCharge]) -> float:
+        """Charge the buckets of a key in one transaction."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                stored = dict(
+                    (position, (tokens, updated))
+                    for position, tokens, updated in self._connection.execute(
+                        "SELECT position, tokens, updated FROM rate_buckets WHERE key = ?", (key,)
+                    )
+                )
+                buckets = []
+                for position, charge in enumerate(charges):
+                    bucket = TokenBucket(charge.rate, charge.capacity, now)
+                    if position in stored:
+                        bucket.tokens, bucket.updated = stored[position]
+                    buckets.append(bucket)
+                wait = _charge_buckets(buckets, charges, now)
+                self._connection.executemany(
+                    "INSERT OR REPLACE INTO rate_buckets (key, position, tokens, updated, full_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (key, position, bucket.tokens, bucket.updated, self._full_at(bucket))
+                        for position, bucket in enumerate(buckets)
+                    ],
+                )
+                self._charges += 1
+                if self._charges >= PURGE_INTERVAL:
+                    self._charges = 0
+                    self._connection.execute("DELETE FROM rate_buckets WHERE full_at <= ?", (now,))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return wait
+
+    @staticmethod
+    def _full_at(bucket: TokenBucket) -> float:
+        """Return when a bucket will have refilled."""
+        return bucket.updated + (bucket.capacity - bucket.tokens) / bucket.rate
+
+    def _register_stream(self, limit: int) -> Optional[str]:
+        """Insert a stream unless the host is at its limit, in one transaction."""
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                if limit:
+                    (active,) = self._connection.execute("SELECT COUNT(*) FROM active_streams").fetchone()
+                    if active >= limit:
+                        self._connection.execute("ROLLBACK")
+                        return None
+                self._connection.execute(
+                    "INSERT INTO active_streams (id, pid, started) VALUES (?, ?, ?)",
+                    (stream_id, os.getpid(), time.time()),
+                )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return stream_id
+
+    def _count_streams(self) -> int:
+        """Count the streams of every worker."""
+        with self._lock:
+            (active,) = self._connection.execute("SELECT COUNT(*) FROM active_streams").fetchone()
+        return active
+
+    def _execute(self, statement: str, parameters: Tuple) -> None:
+        """Run a single statement in its own transaction."""
+        with self._lock:
+            self._connection.execute(statement, parameters)
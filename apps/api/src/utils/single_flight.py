@@ -0,0 +1,131 @@
+"""Single-flight sharing of identical in-flight completions."""
+import asyncio
+import logging
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional
+
+from src.utils.logs import SAMPLED
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One upstream stream whose deltas are shared by every subscriber."""
+
+    def __init__(self, key: str):
+        """Initialize an empty flight.
+
+        Args:
+            key: The request key the flight serves
+        """
+        self.key = key
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    def notify(self) -> None:
+        """Wake every subscriber waiting for new deltas."""
+        self._updated.set()
+        self._updated.clear()
+
+    async def wait(self) -> None:
+        """Wait until a delta is added or the flight ends."""
+        await self._updated.wait()
+
+
+class SingleFlightGroup:
+    """Shares one upstream stream between identical requests made at the same time.
+
+    The first request for a key starts the upstream stream in a background
+    task. Requests for the same key that arrive while it is running subscribe
+    to it instead of opening their own: they receive every delta produced so
+    far followed by the live tail. The upstream is cancelled only when the
+    last subscriber leaves.
+    """
+
+    def __init__(self):
+        """Initialize the group with no flights in progress."""
+        self._flights: Dict[str, Flight] = {}
+
+    def in_flight(self) -> int:
+        """Return the number of upstream streams currently shared."""
+        return len(self._flights)
+
+    async def subscribe(
+        self,
+        key: str,
+        open_source: Callable[[], AsyncIterator[str]],
+    ) -> AsyncGenerator[str, None]:
+        """Stream the deltas of the flight for a key, starting it if needed.
+
+        Args:
+            key: The request key, identical requests share it
+            open_source: Opens the upstream delta stream; only called when no
+                flight for the key is in progress
+
+        Yields:
+            Every delta of the shared response, from the first one
+
+        Raises:
+            Exception: The error of the upstream stream, for every subscriber
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(flight, open_source))
+        else:
+            logger.debug("Joined in-flight completion %.12s", key, extra=SAMPLED)
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(flight.parts):
+                    delta = flight.parts[index]
+                    index += 1
+                    yield delta
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more, stop paying for the upstream
+                self._forget(flight)
+                flight.task.cancel()
+
+    async def _run(self, flight: Flight, open_source: Callable[[], AsyncIterator[str]]) -> None:
+        """Read the upstream stream into the flight until it ends.
+
+        Args:
+            flight: The flight to fill
+            open_source: Opens the upstream delta stream
+        """
+        source = open_source()
+        try:
+            async for delta in source:
+                flight.parts.append(delta)
+                flight.notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._forget(flight)
+            flight.notify()
+            aclose = getattr(source, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def _forget(self, flight: Flight) -> None:
+        """Stop routing new subscribers to a flight."""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
@@ -0,0 +1,138 @@
+"""Deadlines and hedging for upstream token streams."""
+import asyncio
+import logging
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, Optional
+
+from src.utils.logs import SAMPLED
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Marks the end of a delta iterator inside a pending read
+_END = object()
+
+
+class StreamStalled(Exception):
+    """Raised when the upstream misses its first-token or inter-token deadline."""
+
+
+async def _next_delta(iterator: AsyncIterator[str]) -> object:
+    """Read the next delta, reporting the end of the iterator as a sentinel."""
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+async def _discard(task: asyncio.Task, iterator: AsyncIterator[str]) -> None:
+    """Cancel a pending read and close the stream it was reading."""
+    if not task.done():
+        task.cancel()
+        await asyncio.wait((task,))
+    elif not task.cancelled() and task.exception() is not None:
+        logger.debug("Discarded upstream attempt failed: %s", task.exception(), extra=SAMPLED)
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+async def watch_deltas(
+    deltas: AsyncIterator[str],
+    first_token_timeout: float,
+    inter_token_timeout: float,
+    open_hedge: Optional[Callable[[], AsyncIterator[str]]] = None,
+) -> AsyncGenerator[str, None]:
+    """Enforce token deadlines on an upstream stream, hedging a slow first token.
+
+    Each upstream attempt gets first_token_timeout to produce its first delta.
+    When the primary misses it and open_hedge is given, a second request is
+    started and both race: the first to produce a delta wins and the other is
+    cancelled. Once streaming, every gap between deltas must stay under
+    inter_token_timeout. A missed deadline raises StreamStalled rather than
+    waiting forever.
+
+    Args:
+        deltas: The text deltas of the primary upstream stream
+        first_token_timeout: Seconds an attempt may take to its first delta,
+            0 waits forever
+        inter_token_timeout: Seconds allowed between two deltas, 0 waits forever
+        open_hedge: Opens the deltas of a duplicate upstream request
+
+    Yields:
+        The deltas of the winning stream
+
+    Raises:
+        StreamStalled: When a deadline passes without a delta
+    """
+    primary = deltas.__aiter__()
+    contenders: Dict[asyncio.Task, AsyncIterator[str]] = {
+        asyncio.ensure_future(_next_delta(primary)): primary
+    }
+    winner: Optional[AsyncIterator[str]] = None
+    first: object = _END
+    try:
+        hedged = False
+        while winner is None:
+            done, _ = await asyncio.wait(
+                contenders,
+                timeout=first_token_timeout or None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                if open_hedge is not None and not hedged:
+                    hedged = True
+                    logger.info(
+                        "No first token after %gs, hedging the upstream request", first_token_timeout, extra=SAMPLED
+                    )
+                    hedge = open_hedge().__aiter__()
+                    contenders[asyncio.ensure_future(_next_delta(hedge))] = hedge
+                    continue
+                raise StreamStalled(
+                    f"The upstream did not send a first token within {first_token_timeout:g}s"
+                )
+
+            for task in done:
+                if task.exception() is None:
+                    winner = contenders.pop(task)
+                    first = task.result()
+                    break
+            else:
+                if len(done) == len(contenders):
+                    # Every attempt failed, report the error of one of them
+                    raise next(iter(done)).exception()
+                for task in done:
+                    logger.warning("Upstream attempt failed while hedging: %s", task.exception(), extra=SAMPLED)
+                    await _discard(task, contenders.pop(task))
+
+        if hedged:
+            logger.info(
+                "%s upstream request won the race", "Hedged" if winner is not primary else "Primary", extra=SAMPLED
+            )
+        for task, iterator in list(contenders.items()):
+            del contenders[task]
+            await _discard(task, iterator)
+
+        if first is _END:
+            return
+        yield first
+
+        while True:
+            if inter_token_timeout:
+                try:
+                    delta = await asyncio.wait_for(_next_delta(winner), inter_token_timeout)
+                except asyncio.TimeoutError:
+                    raise StreamStalled(
+                        f"The upstream stalled, no token for {inter_token_timeout:g}s"
+                    ) from None
+            else:
+                delta = await _next_delta(winner)
+            if delta is _END:
+                return
+            yield delta
+    finally:
+        for task, iterator in contenders.items():
+            await _discard(task, iterator)
+        if winner is not None:
+            aclose = getattr(winner, "aclose", None)
+            if aclose is not None:
+                await aclose()
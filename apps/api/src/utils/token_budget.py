@@ -0,0 +1,228 @@
+"""Context-window budgeting of chat requests before they are sent upstream."""
+import asyncio
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from src.adapters.models import OpenAIModel
+from src.settings import Settings
+from src.utils.logs import SAMPLED
+
+# Configure logger
+logger = logging.getLogger(__name__)
+
+# Tokens every message costs on top of its content, and those priming the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Splits text roughly the way the OpenAI tokenizers pre-split it: words with
+# their leading space, digit groups of up to three, punctuation runs, spaces
+_PIECES = re.compile(r"\s?[^\W\d_]+|\d{1,3}|\s?(?:[^\w\s]|_)+|\s+")
+
+
+@dataclass(frozen=True)
+class ContextWindow:
+    """Token limits of a model."""
+    context_tokens: int
+    max_output_tokens: int
+
+
+MODEL_CONTEXT_WINDOWS: Dict[str, ContextWindow] = {
+    OpenAIModel.GPT_4O.value: ContextWindow(context_tokens=128000, max_output_tokens=16384),
+    OpenAIModel.GPT_4O_MINI.value: ContextWindow(context_tokens=128000, max_output_tokens=16384),
+    OpenAIModel.O3_MINI.value: ContextWindow(context_tokens=200000, max_output_tokens=100000),
+}
+
+
+class ContextWindowExceeded(ValueError):
+    """Raised when the messages that must be kept do not fit the model's context."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text without a tokenizer.
+
+    Every pre-split piece counts as one token per 8 ASCII characters, or one
+    per 3 UTF-8 bytes otherwise. This slightly overestimates real counts for
+    English and most other languages, which is the safe side for budgeting.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        The estimated token count
+    """
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        if piece.isascii():
+            tokens += (len(piece) + 7) // 8
+        else:
+            tokens += (len(piece.encode("utf-8")) + 2) // 3
+    return tokens
+
+
+def strip_pins(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Remove the pinned markers that OpenAI does not accept from messages.
+
+    Args:
+        messages: Messages in the format OpenAI expects, possibly pinned
+
+    Returns:
+        The messages with only their role and content
+    """
+    if not any("pinned" in message for message in messages):
+        return messages
+    return [{"role": message["role"], "content": message["content"]} for message in messages]
+
+
+@dataclass
+class FittedRequest:
+    """Messages and completion limit of a request after fitting its model's context."""
+    messages: List[Dict[str, str]]
+    max_tokens: Optional[int]
+    prompt_tokens: int
+    dropped: int = 0
+
+
+class TokenBudget:
+    """Fits chat requests into the context window of their model.
+
+    Token counts are estimated locally and memoized per message, keyed by its
+    role and content, so the history of a conversation is only measured once
+    however many turns it takes part in. When the prompt plus the room kept
+    for the reply exceeds the context window, the oldest messages are dropped
+    first; system messages, pinned messages and the latest message are always
+    kept. The requested max_tokens is then clamped to what is left.
+    """
+
+    def __init__(
+        self,
+        reserved_completion_tokens: int,
+        cache_size: int,
+        offload_chars: int,
+    ):
+        """Initialize the budget manager.
+
+        Args:
+            reserved_completion_tokens: Room kept for the reply when the
+                request does not set max_tokens
+            cache_size: Number of per-message counts kept in memory
+            offload_chars: Total content size above which fitting runs in a
+                worker thread instead of the event loop
+        """
+        self.reserved_completion_tokens = reserved_completion_tokens
+        self.cache_size = cache_size
+        self.offload_chars = offload_chars
+        self._counts: "OrderedDict[tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings_instance: Settings) -> "TokenBudget":
+        """Build a budget manager configured by the application settings."""
+        return cls(
+            reserved_completion_tokens=settings_instance.TOKEN_BUDGET_RESERVED_COMPLETION_TOKENS,
+            cache_size=settings_instance.TOKEN_BUDGET_CACHE_SIZE,
+            offload_chars=settings_instance.TOKEN_BUDGET_OFFLOAD_CHARS,
+        )
+
+    def count_message(self, message: Dict[str, str]) -> int:
+        """Return the tokens a message costs, memoized by its content.
+
+        Args:
+            message: A message in the format OpenAI expects
+
+        Returns:
+            The estimated token count, including the per-message overhead
+        """
+        key = (message["role"], message["content"])
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+        count = TOKENS_PER_MESSAGE + estimate_tokens(key[0]) + estimate_tokens(key[1])
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    async def fit(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int] = None,
+    ) -> FittedRequest:
+        """Fit a request into its model's context without blocking the event loop.
+
+        Large histories are measured in a worker thread.
+
+        Args:
+            messages: Messages in the format OpenAI expects, possibly pinned
+            model: The model the request is sent to
+            max_tokens: The completion limit requested by the client
+
+        Returns:
+            The messages to send and the fitted completion limit
+
+        Raises:
+            ContextWindowExceeded: When the messages that must be kept do not fit
+        """
+        if sum(len(message["content"]) for message in messages) > self.offload_chars:
+            return await asyncio.to_thread(self.fit_messages, messages, model, max_tokens)
+        return self.fit_messages(messages, model, max_tokens)
+
+    def fit_messages(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int] = None,
+    ) -> FittedRequest:
+        """Fit a request into its model's context.
+
+        Args:
+            messages: Messages in the format OpenAI expects, possibly pinned
+            model: The model the request is sent to
+            max_tokens: The completion limit requested by the client
+
+        Returns:
+            The messages to send and the fitted completion limit
+
+        Raises:
+            ContextWindowExceeded: When the messages that must be kept do not fit
+        """
+        counts = [self.count_message(message) for message in messages]
+        prompt_tokens = sum(counts) + TOKENS_PER_REPLY
+        window = MODEL_CONTEXT_WINDOWS.get(model)
+        if window is None:
+            # Unknown model, nothing to fit against
+            return FittedRequest(strip_pins(messages), max_tokens, prompt_tokens)
+
+        reserved = min(max_tokens or self.reserved_completion_tokens, window.max_output_tokens)
+        budget = window.context_tokens - reserved
+        kept = messages
+        dropped = 0
+        if prompt_tokens > budget:
+            last = len(messages) - 1
+            keep = [True] * len(messages)
+            for index, message in enumerate(messages[:last]):
+                if prompt_tokens <= budget:
+                    break
+                if message["role"] == "system" or message.get("pinned"):
+                    continue
+                keep[index] = False
+                prompt_tokens -= counts[index]
+                dropped += 1
+            kept = [message for message, keep_it in zip(messages, keep) if keep_it]
+            logger.info("Dropped %s oldest messages to fit the context of %s", dropped, model, extra=SAMPLED)
+
+        remaining = window.context_tokens - prompt_tokens
+        if remaining < 1:
+            raise ContextWindowExceeded(
+                f"Messages need about {prompt_tokens} tokens but {model} accepts {window.context_tokens}"
+            )
+        if max_tokens is not None:
+            max_tokens = min(max_tokens, window.max_output_tokens, remaining)
+        return FittedRequest(strip_pins(kept), max_tokens, prompt_tokens, dropped)
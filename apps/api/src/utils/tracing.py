@@ -0,0 +1,419 @@
+"""Per-request span tracing with a ring buffer or rotating file exporter."""
+import json
+import logging
+import os
+import queue
+import random
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueListener, RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.settings import Settings
+from src.utils.logs import NonBlockingQueueHandler
+
+# Trace exporters
+TRACING_EXPORTER_MEMORY = "memory"
+TRACING_EXPORTER_FILE = "file"
+
+# Longest trace id accepted from a client
+MAX_TRACE_ID_LENGTH = 64
+
+# version-trace_id-parent_id-flags, as in the W3C Trace Context header
+_TRACEPARENT = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-([0-9a-f]{2})$")
+# Flag of a traceparent header telling the caller records the trace
+_SAMPLED_FLAG = 0x01
+_W3C_TRACE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# The trace and span the running task records into, None when it is not traced
+_current: ContextVar[Optional[Tuple["Trace", "Span"]]] = ContextVar("current_span", default=None)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+class Span:
+    """A timed stage of a request, with its parent and attributes."""
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(
+        self,
+        name: str,
+        parent_id: Optional[str],
+        start: float,
+        end: Optional[float] = None,
+        attributes: Optional[Dict[str, Any]] = None,
+    ):
+        """Initialize a span.
+
+        Args:
+            name: The stage the span times
+            parent_id: Id of the enclosing span, None for the root
+            start: Monotonic time the stage started at
+            end: Monotonic time the stage ended at, None while it runs
+            attributes: Details of the stage
+        """
+        self.name = name
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.start = start
+        self.end = end
+        self.attributes = attributes if attributes is not None else {}
+
+    def set(self, **attributes: Any) -> None:
+        """Add details to the span."""
+        self.attributes.update(attributes)
+
+    def finish(self, end: Optional[float] = None) -> None:
+        """End the span, now unless given a monotonic time."""
+        if self.end is None:
+            self.end = end if end is not None else time.monotonic()
+
+
+class Trace:
+    """The spans of one request, under a root span named after the request."""
+
+    __slots__ = ("trace_id", "root", "spans", "wall_start")
+
+    def __init__(self, trace_id: str, name: str = "request", start: Optional[float] = None):
+        """Initialize a trace with its root span started.
+
+        Args:
+            trace_id: Identifies the trace, given by the client or generated
+            name: Name of the root span
+            start: Monotonic time the request arrived at, now if not given
+        """
+        now = time.monotonic()
+        start = start if start is not None else now
+        self.trace_id = trace_id
+        self.root = Span(name, None, start)
+        self.spans: List[Span] = [self.root]
+        self.wall_start = time.time() - (now - start)
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: Optional[float] = None,
+        parent: Optional[Span] = None,
+        **attributes: Any
+    ) -> Span:
+        """Record a span, under the root unless given a parent.
+
+        Args:
+            name: The stage the span times
+            start: Monotonic time the stage started at
+            end: Monotonic time the stage ended at, None while it runs
+            parent: The enclosing span
+
+        Returns:
+            The span
+        """
+        span = Span(name, (parent or self.root).span_id, start, end, attributes)
+        self.spans.append(span)
+        return span
+
+    def traceparent(self, span: Span) -> Optional[str]:
+        """Return the W3C traceparent header continuing the trace from a span.
+
+        Returns:
+            The header, or None when the trace id is not a W3C one
+        """
+        if not _W3C_TRACE_ID.match(self.trace_id):
+            return None
+        return f"00-{self.trace_id}-{span.span_id}-01"
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the trace as a tree of spans, with times in milliseconds from its start."""
+        origin = self.root.start
+        nodes = {}
+        for span in self.spans:
+            node = {
+                "name": span.name,
+                "span_id": span.span_id,
+                "start_ms": round((span.start - origin) * 1000, 3),
+                "duration_ms": None if span.end is None else round((span.end - span.start) * 1000, 3),
+            }
+            if span.attributes:
+                node["attributes"] = span.attributes
+            nodes[span.span_id] = node
+        for span in self.spans[1:]:
+            nodes.get(span.parent_id, nodes[self.root.span_id]).setdefault("children", []).append(
+                nodes[span.span_id]
+            )
+        return {
+            "trace_id": self.trace_id,
+            "start": datetime.fromtimestamp(self.wall_start, timezone.utc).isoformat(timespec="milliseconds"),
+            "duration_ms": nodes[self.root.span_id]["duration_ms"],
+            "root": nodes[self.root.span_id],
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the id, start, duration and root attributes of the trace."""
+        tree = self.as_dict()
+        return {
+            "trace_id": self.trace_id,
+            "start": tree["start"],
+            "duration_ms": tree["duration_ms"],
+            **self.root.attributes,
+        }
+
+    def __str__(self) -> str:
+        return json.dumps(self.as_dict(), default=str)
+
+
+def current_trace() -> Optional[Tuple[Trace, Span]]:
+    """Return the trace and span the running task records into, if it is traced."""
+    return _current.get()
+
+
+@contextmanager
+def activate(trace: Optional[Trace]) -> Iterator[None]:
+    """Make a trace's root the current span of the running task.
+
+    Args:
+        trace: The trace of the request, None when it is not traced
+    """
+    if trace is None:
+        yield
+        return
+    token = _current.set((trace, trace.root))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time a stage as a child of the current span.
+
+    Costs one context variable lookup when the request is not traced. Only
+    wrap awaits of coroutines, never a yield of a generator, since the span
+    is current for everything the task runs inside the block.
+
+    Args:
+        name: The stage the span times
+        attributes: Details of the stage
+
+    Yields:
+        The span, or None when the request is not traced
+    """
+    current = _current.get()
+    if current is None:
+        yield None
+        return
+    trace, parent = current
+    child = trace.add_span(name, time.monotonic(), parent=parent, **attributes)
+    token = _current.set((trace, child))
+    try:
+        yield child
+    except BaseException as e:
+        child.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def record_span(name: str, start: float, end: Optional[float] = None, **attributes: Any) -> Optional[Span]:
+    """Record a stage timed by the caller as a child of the current span.
+
+    Args:
+        name: The stage the span times
+        start: Monotonic time the stage started at
+        end: Monotonic time the stage ended at, now if not given
+
+    Returns:
+        The span, or None when the request is not traced
+    """
+    current = _current.get()
+    if current is None:
+        return None
+    trace, parent = current
+    return trace.add_span(name, start, end if end is not None else time.monotonic(), parent=parent, **attributes)
+
+
+def current_traceparent() -> Optional[str]:
+    """Return the traceparent header an upstream call of the current span should carry."""
+    current = _current.get()
+    if current is None:
+        return None
+    trace, parent = current
+    return trace.traceparent(parent)
+
+
+def trace_context_from_headers(headers: Any) -> Optional[Tuple[str, bool]]:
+    """Read a W3C traceparent header, if the request has a valid one.
+
+    Returns:
+        The trace id and whether the caller sampled the trace, or None
+    """
+    match = _TRACEPARENT.match(headers.get("traceparent", "").strip().lower())
+    if match is None:
+        return None
+    return match.group(1), bool(int(match.group(2), 16) & _SAMPLED_FLAG)
+
+
+class MemoryTraceExporter:
+    """Keeps the most recent traces in memory, for the debug endpoint."""
+
+    def __init__(self, max_traces: int):
+        """Initialize the exporter.
+
+        Args:
+            max_traces: Traces kept, the oldest first to be dropped
+        """
+        self.max_traces = max_traces
+        self.duplicates = 0
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+
+    def export(self, trace: Trace) -> None:
+        """Keep a finished trace, unless one with the same id is kept already.
+
+        Clients choose their trace ids, so a request cannot replace the trace
+        of another one by reusing its id.
+        """
+        if trace.trace_id in self._traces:
+            self.duplicates += 1
+            return
+        self._traces[trace.trace_id] = trace
+        while len(self._traces) > self.max_traces:
+            self._traces.popitem(last=False)
+
+    def get(self, trace_id: str) -> Optional[Trace]:
+        """Return a kept trace by its id."""
+        return self._traces.get(trace_id)
+
+    def recent(self, limit: int) -> List[Trace]:
+        """Return the most recent traces, newest first."""
+        traces = []
+        for trace in reversed(self._traces.values()):
+            if len(traces) >= limit:
+                break
+            traces.append(trace)
+        return traces
+
+    def close(self) -> None:
+        """Nothing to release."""
+
+
+class FileTraceExporter:
+    """Appends traces as JSON lines to a rotating file, written by a background thread.
+
+    Traces go through the same non-blocking queue as the logs, so they are
+    only serialized on the writer thread, and dropped when it falls behind.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int, max_queued: int = 10000):
+        """Initialize the exporter and start its writer thread.
+
+        Args:
+            path: File the traces are appended to
+            max_bytes: Size at which the file is rotated
+            backups: Rotated files kept
+            max_queued: Traces allowed to wait for the writer
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, delay=True)
+        self._handler = NonBlockingQueueHandler(queue.Queue(maxsize=max_queued))
+        self._listener = QueueListener(self._handler.queue, self._file)
+        self._listener.start()
+
+    @property
+    def dropped(self) -> int:
+        """Traces dropped because the writer fell behind."""
+        return self._handler.dropped
+
+    def export(self, trace: Trace) -> None:
+        """Queue a finished trace for the writer thread."""
+        self._handler.handle(logging.makeLogRecord({"msg": trace, "levelno": logging.INFO}))
+
+    def close(self) -> None:
+        """Write the traces still queued and close the file."""
+        self._listener.stop()
+        self._file.close()
+
+
+class Tracer:
+    """Decides which requests are traced and exports their traces when they end.
+
+    A share of the requests is sampled, whether or not they bring their own
+    trace id. A request continuing a W3C trace follows the sampling decision
+    of its caller instead, so the trace is recorded end to end or not at all.
+    """
+
+    def __init__(self, exporter: Any, sample_rate: float):
+        """Initialize the tracer.
+
+        Args:
+            exporter: Where finished traces go, a memory or file exporter
+            sample_rate: Share of the requests without a trace id to trace
+        """
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_settings(cls, settings_instance: Settings) -> "Tracer":
+        """Build the tracer configured by the application settings."""
+        if settings_instance.TRACING_EXPORTER == TRACING_EXPORTER_FILE:
+            exporter = FileTraceExporter(
+                settings_instance.TRACING_FILE_PATH,
+                max_bytes=settings_instance.TRACING_FILE_MAX_BYTES,
+                backups=settings_instance.TRACING_FILE_BACKUPS,
+            )
+        else:
+            exporter = MemoryTraceExporter(settings_instance.TRACING_BUFFER_SIZE)
+        return cls(exporter, settings_instance.TRACING_SAMPLE_RATE)
+
+    def start_trace(
+        self,
+        trace_id: Optional[str] = None,
+        start: Optional[float] = None,
+        sampled: Optional[bool] = None,
+        **attributes: Any
+    ) -> Optional[Trace]:
+        """Start the trace of a request if it is to be traced.
+
+        Args:
+            trace_id: The trace id the client sent, if any
+            start: Monotonic time the request arrived at, now if not given
+            sampled: The sampling decision of the caller's traceparent
+                header, None to apply the sample rate
+            attributes: Details of the request for the root span
+
+        Returns:
+            The trace, or None when the request is not sampled
+        """
+        if sampled is None:
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled:
+            return None
+        trace = Trace(trace_id or _new_id(128), start=start)
+        trace.root.set(**attributes)
+        return trace
+
+    def finish(self, trace: Optional[Trace], **attributes: Any) -> None:
+        """End the root span of a trace and export it.
+
+        Args:
+            trace: The trace of the request, None when it is not traced
+            attributes: Details of how the request ended
+        """
+        if trace is None:
+            return
+        trace.root.set(**attributes)
+        trace.root.finish()
+        self.exporter.export(trace)
+
+    def close(self) -> None:
+        """Flush and release the exporter."""
+        self.exporter.close()
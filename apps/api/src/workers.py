@@ -0,0 +1,18 @@
+"""Gunicorn worker class for the multi-process serving mode."""
+import os
+
+from uvicorn.workers import UvicornWorker as BaseUvicornWorker
+
+
+class UvicornWorker(BaseUvicornWorker):
+    """A uvicorn worker serving WebSockets the way `make app` does.
+
+    The websockets implementation is used, with permessage-deflate unless
+    WS_PER_MESSAGE_DEFLATE is false.
+    """
+
+    CONFIG_KWARGS = {
+        **BaseUvicornWorker.CONFIG_KWARGS,
+        "ws": "websockets",
+        "ws_per_message_deflate": os.environ.get("WS_PER_MESSAGE_DEFLATE", "true").lower() != "false",
+    }
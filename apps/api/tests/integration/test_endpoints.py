@@ -14,6 +14,58 @@ def test_health_endpoint():
     assert response.status_code == 200
     assert response.text == '"OK"'
 
+
+def wait_until_ready(test_client, timeout=5.0):
+    """Poll the readiness check until the lifespan finished warming up."""
+    import time
+
+    deadline = time.monotonic() + timeout
+    while test_client.get("/health/ready").status_code != 200:
+        assert time.monotonic() < deadline, "The worker never reported ready"
+        time.sleep(0.01)
+
+
+def test_readiness_waits_for_the_warmup():
+    """Test the worker is live at once but only ready once its connection pools are warm."""
+    import asyncio
+
+    async def slow_warmup():
+        await asyncio.sleep(0.3)
+        return False
+
+    with patch('src.utils.app_resources.settings.OPENAI_WARMUP_ON_STARTUP', True), \
+            patch('src.adapters.router.ProviderRouter.warmup', side_effect=slow_warmup) as mock_warmup:
+        with TestClient(application) as lifespan_client:
+            assert lifespan_client.get("/health/live").status_code == 200
+            response = lifespan_client.get("/health/ready")
+            assert response.status_code == 503
+            assert response.json() == {"detail": "Warming up"}
+
+            wait_until_ready(lifespan_client)
+            assert mock_warmup.await_count == 1
+
+    # Without the lifespan the router is built on first use, so the worker is ready
+    assert client.get("/health/ready").status_code == 200
+
+
+def test_shutdown_closes_a_router_built_late():
+    """Test a router whose build outlives the startup is still closed on shutdown."""
+    import time
+
+    router = MagicMock()
+    router.close = AsyncMock()
+
+    def slow_build(settings_instance):
+        time.sleep(0.3)
+        return router
+
+    with patch('src.utils.app_resources.ProviderRouter.from_settings', side_effect=slow_build):
+        with TestClient(application):
+            pass
+
+    router.close.assert_awaited_once()
+
+
 def test_websocket_connection():
     """Test that the WebSocket endpoint accepts connections."""
     with client.websocket_connect("/api/v1/ws") as websocket:
@@ -23,8 +75,10 @@ def test_websocket_connection():
 @patch('src.handlers.websocket.WebSocketHandler.handle_chat_completion')
 def test_websocket_chat_request(mock_handle_chat_completion):
     """Test sending a chat request through WebSocket."""
-    # Setup mock to handle the request
-    async def async_mock(*args, **kwargs):
+    # Setup mock to handle the request and acknowledge it on the socket,
+    # so the test can wait for the handler instead of racing it
+    async def async_mock(websocket, chat_request):
+        await websocket.send_json({"request_id": chat_request.request_id})
         return "Generated response"
     
     mock_handle_chat_completion.side_effect = async_mock
@@ -42,8 +96,9 @@ def test_websocket_chat_request(mock_handle_chat_completion):
         # Send request data
         websocket.send_text(json.dumps(request_data))
         
-        # We don't need to receive anything since we've mocked the handler
-        # The test is successful if the WebSocket connection remains open
+        # Wait for the mocked handler's acknowledgement
+        assert websocket.receive_json() == {"request_id": "test-123"}
+        
         # Verify the handler was called with the expected arguments
         mock_handle_chat_completion.assert_called_once()
         call_args = mock_handle_chat_completion.call_args
@@ -137,4 +192,313 @@ def test_websocket_end_to_end(mock_generate):
         assert response3["finished"] is True
         assert "metrics" in response3
         assert "responseTime" in response3["metrics"]
-        assert response3["metrics"]["length"] == len("Hello world!")
\ No newline at end of file
+        assert response3["metrics"]["length"] == len("Hello world!")
+        assert response3["metrics"]["provider"] == "default"
+
+    metrics = client.get("/metrics").text
+    assert 'singularity_time_to_first_token_seconds_count{model="gpt-4o-mini"}' in metrics
+    assert 'singularity_requests_total{model="gpt-4o-mini"}' in metrics
+
+def test_metrics_endpoint():
+    """Test the metrics endpoint serves the Prometheus text format."""
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE singularity_time_to_first_token_seconds histogram" in response.text
+    assert "\nsingularity_active_websockets " in response.text
+    assert "\nsingularity_send_queue_frames " in response.text
+    assert "\nsingularity_log_records_dropped_total " in response.text
+
+def test_lifespan_shares_one_adapter():
+    """Test the lifespan owns a single router of pooled adapters and closes them on shutdown."""
+    from src.handlers.websocket import WebSocketHandler
+    
+    with patch('src.api.dependencies.WebSocketHandler', wraps=WebSocketHandler) as mock_handler:
+        with TestClient(application) as lifespan_client:
+            wait_until_ready(lifespan_client)
+            adapter = application.state.provider_router
+            with lifespan_client.websocket_connect("/api/v1/ws"):
+                pass
+            with lifespan_client.websocket_connect("/api/v1/ws"):
+                pass
+            
+            # Every connection got the same adapter
+            assert [call[0][0] for call in mock_handler.call_args_list] == [adapter, adapter]
+            assert not adapter.providers[0].adapter.http_client.is_closed
+    
+    assert all(provider.adapter.http_client.is_closed for provider in adapter.providers)
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_websocket_multiplexed_requests(mock_generate):
+    """Test two requests on one socket stream at the same time."""
+    import asyncio
+    
+    def make_chunk(content):
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = content
+        return chunk
+    
+    async def mock_generator(words):
+        for word in words:
+            await asyncio.sleep(0.05)
+            yield make_chunk(word)
+    
+    async def generate(messages, **kwargs):
+        return mock_generator([messages[-1]["content"]] * 3)
+    
+    mock_generate.side_effect = generate
+    
+    with client.websocket_connect("/api/v1/ws") as websocket:
+        for request_id in ("first", "second"):
+            websocket.send_text(json.dumps({
+                "request_id": request_id,
+                "messages": [{"role": "user", "content": request_id}]
+            }))
+        
+        responses = [websocket.receive_json() for _ in range(8)]
+    
+    order = [response["request_id"] for response in responses]
+    
+    # The second request started streaming before the first one finished
+    assert order.index("second") < max(i for i, rid in enumerate(order) if rid == "first")
+    for request_id in ("first", "second"):
+        chunks = [r for r in responses if r["request_id"] == request_id]
+        assert "".join(r["content"] for r in chunks) == request_id * 3
+        assert chunks[-1]["finished"] is True
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_websocket_cancel_request(mock_generate):
+    """Test a cancel message stops a running completion."""
+    import asyncio
+    
+    async def endless_generator():
+        while True:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = "token"
+            yield chunk
+            await asyncio.sleep(0.01)
+    
+    mock_generate.return_value = endless_generator()
+    
+    with client.websocket_connect("/api/v1/ws") as websocket:
+        websocket.send_text(json.dumps({
+            "request_id": "test-789",
+            "messages": [{"role": "user", "content": "Tell me everything"}]
+        }))
+        assert websocket.receive_json()["content"] == "token"
+        
+        websocket.send_text(json.dumps({"type": "cancel", "request_id": "test-789"}))
+        
+        response = websocket.receive_json()
+        while not response["finished"]:
+            response = websocket.receive_json()
+    
+    assert response["request_id"] == "test-789"
+    assert response["metrics"]["status"] == "cancelled"
+    assert response["metrics"]["tokens"] >= 1
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_websocket_msgpack_protocol(mock_generate):
+    """Test a client negotiating MessagePack gets compact binary frames."""
+    from src.utils.serialization import MSGPACK_SUBPROTOCOL, MsgPackCodec
+    from src.models.chat import ChatCompletionRequest
+    
+    chunk = MagicMock()
+    chunk.choices = [MagicMock()]
+    chunk.choices[0].delta.content = "Hello"
+    
+    async def mock_generator(*args, **kwargs):
+        yield chunk
+    
+    mock_generate.return_value = mock_generator()
+    codec = MsgPackCodec()
+    
+    with client.websocket_connect("/api/v1/ws", subprotocols=[MSGPACK_SUBPROTOCOL]) as websocket:
+        assert websocket.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+        websocket.send_bytes(codec.encode_request(ChatCompletionRequest(
+            request_id="test-msgpack",
+            messages=[ChatMessage(role="user", content="Say hello!")]
+        )))
+        
+        first = codec.decode_frame(websocket.receive_bytes())
+        final = codec.decode_frame(websocket.receive_bytes())
+        
+        # Invalid payloads are reported in the negotiated format too
+        websocket.send_bytes(b"\xc1")
+        error = codec.decode_frame(websocket.receive_bytes())
+    
+    assert (first.request_id, first.content, first.finished) == ("test-msgpack", "Hello", False)
+    assert (final.request_id, final.finished) == ("test-msgpack", True)
+    assert final.metrics["length"] == len("Hello")
+    assert "Invalid MessagePack format" in error.error
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_http_streaming_completion(mock_generate):
+    """Test a completion streamed as Server-Sent Events over plain HTTP."""
+    chunks = []
+    for content in ("Hello", " world!"):
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = content
+        chunks.append(chunk)
+    
+    async def mock_generator(*args, **kwargs):
+        for chunk in chunks:
+            yield chunk
+    
+    mock_generate.return_value = mock_generator()
+    
+    response = client.post("/api/v1/chat/completions", json={
+        "request_id": "test-sse",
+        "messages": [{"role": "user", "content": "Say hello!"}]
+    })
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.split("\n\n") if line]
+    assert "".join(event["content"] for event in events) == "Hello world!"
+    assert all(event["request_id"] == "test-sse" for event in events)
+    assert events[-1]["finished"] is True
+    assert events[-1]["metrics"]["length"] == len("Hello world!")
+    assert mock_generate.call_args.kwargs["stream"] is True
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_http_non_streaming_completion(mock_generate):
+    """Test a non-streamed request asks the upstream for a whole response."""
+    completion = MagicMock()
+    completion.choices = [MagicMock()]
+    completion.choices[0].message.content = "Hello world!"
+    completion.usage.prompt_tokens = 3
+    completion.usage.completion_tokens = 2
+    mock_generate.return_value = completion
+    
+    response = client.post("/api/v1/chat/completions", json={
+        "stream": False,
+        "messages": [{"role": "user", "content": "Say hello!"}]
+    })
+    
+    assert response.status_code == 200
+    body = response.json()
+    assert body["content"] == "Hello world!"
+    assert body["request_id"]
+    assert body["metrics"]["completionTokens"] == 2
+    assert body["metrics"]["provider"] == "default"
+    assert mock_generate.call_args.kwargs["stream"] is False
+
+
+def test_http_completion_errors_set_the_status():
+    """Test failures before the first chunk become the HTTP status."""
+    response = client.post("/api/v1/chat/completions", json={"messages": "not a list"})
+    assert response.status_code == 422
+    
+    with patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion',
+               side_effect=ValueError("Unsupported request")):
+        response = client.post("/api/v1/chat/completions", json={
+            "messages": [{"role": "user", "content": "Say hello!"}]
+        })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unsupported request"
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_http_batch_completions(mock_generate):
+    """Test a batch returns one NDJSON line per request."""
+    async def mock_generate_stream(messages, **kwargs):
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = messages[-1]["content"].upper()
+        
+        async def stream():
+            yield chunk
+        return stream()
+    
+    mock_generate.side_effect = mock_generate_stream
+    
+    response = client.post("/api/v1/chat/completions/batch", json={
+        "parallelism": 2,
+        "requests": [
+            {"request_id": "first", "messages": [{"role": "user", "content": "one"}]},
+            {"request_id": "second", "messages": [{"role": "user", "content": "two"}]},
+        ]
+    })
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {line["request_id"]: line for line in map(json.loads, response.text.splitlines())}
+    assert results["first"]["content"] == "ONE" and results["first"]["index"] == 0
+    assert results["second"]["content"] == "TWO" and results["second"]["index"] == 1
+    assert results["second"]["metrics"]["length"] == 3
+
+
+def test_http_batch_is_validated():
+    """Test duplicate request ids and oversized batches are refused up front."""
+    request = {"request_id": "same", "messages": [{"role": "user", "content": "Hi"}]}
+    response = client.post("/api/v1/chat/completions/batch", json={"requests": [request, request]})
+    assert response.status_code == 422
+    
+    with patch('src.models.chat.settings.BATCH_MAX_REQUESTS', 1):
+        response = client.post("/api/v1/chat/completions/batch", json={
+            "requests": [request, dict(request, request_id="other")]
+        })
+    assert response.status_code == 422
+    assert "at most 1 requests" in response.json()["detail"][0]["msg"]
+
+
+@patch('src.adapters.openai.OpenAIAdapter.generate_chat_completion')
+def test_http_completion_is_traced_under_its_traceparent(mock_generate):
+    """Test a request with a traceparent header can be looked up on the debug endpoint."""
+    completion = MagicMock()
+    completion.choices = [MagicMock()]
+    completion.choices[0].message.content = "Hello world!"
+    mock_generate.return_value = completion
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    
+    response = client.post(
+        "/api/v1/chat/completions",
+        json={"stream": False, "messages": [{"role": "user", "content": "Say hello!"}]},
+        headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"}
+    )
+    assert response.json()["metrics"]["traceId"] == trace_id
+    
+    response = client.get(f"/debug/traces/{trace_id}")
+    assert response.status_code == 200
+    trace = response.json()
+    assert trace["root"]["attributes"]["status"] == "completed"
+    assert "upstream_complete" in [span["name"] for span in trace["root"]["children"][-1]["children"]]
+    assert trace_id in [summary["trace_id"] for summary in client.get("/debug/traces").json()]
+    assert client.get("/debug/traces/unknown").status_code == 404
+
+    # A caller that did not sample its trace is not traced either
+    unsampled_id = "5bf92f3577b34da6a3ce929d0e0e4736"
+    with patch('src.api.dependencies.settings.ADMISSION_ENABLED', False):
+        response = client.post(
+            "/api/v1/chat/completions",
+            json={"stream": False, "messages": [{"role": "user", "content": "Say hello!"}]},
+            headers={"traceparent": f"00-{unsampled_id}-00f067aa0ba902b7-00"}
+        )
+    assert "traceId" not in response.json()["metrics"]
+    assert client.get(f"/debug/traces/{unsampled_id}").status_code == 404
+
+    with patch('src.api.debug.settings.DEBUG_ENDPOINTS_ENABLED', False):
+        assert client.get(f"/debug/traces/{trace_id}").status_code == 404
+        assert client.get("/debug/traces").status_code == 404
+
+
+def test_importing_the_application_defers_the_openai_sdk():
+    """Test binding the port does not wait for the OpenAI SDK to be imported."""
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, src.main; print('openai' in sys.modules)"],
+        cwd=Path(__file__).parents[2], capture_output=True, text=True, check=True,
+    )
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,146 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from src.utils.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    ConcurrencyGate,
+)
+
+
+def _controller(**overrides):
+    options = dict(
+        requests_per_second=1.0,
+        request_burst=2,
+        tokens_per_minute=600,
+        max_concurrent=1,
+        max_queue=1,
+        queue_timeout=1.0,
+        max_clients=2,
+    )
+    options.update(overrides)
+    return AdmissionController(**options)
+
+
+@pytest.mark.asyncio
+async def test_check_rate_rejects_with_retry_hint():
+    """Test a client over its burst is rejected with the wait until its next request."""
+    controller = _controller()
+    with patch("src.utils.shared_state.time.monotonic", return_value=10.0):
+        await controller.check_rate("client", 1)
+        await controller.check_rate("client", 1)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.check_rate("client", 1)
+        # Other clients have their own buckets
+        await controller.check_rate("other", 1)
+    assert rejected.value.retry_after == pytest.approx(1.0)
+
+    with patch("src.utils.shared_state.time.monotonic", return_value=11.0):
+        await controller.check_rate("client", 1)
+
+
+@pytest.mark.asyncio
+async def test_check_rate_limits_tokens_per_minute():
+    """Test estimated tokens are charged to a per-minute bucket."""
+    controller = _controller(request_burst=10)
+    with patch("src.utils.shared_state.time.monotonic", return_value=0.0):
+        await controller.check_rate("client", 500)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.check_rate("client", 200)
+    # 100 tokens are missing at 10 tokens per second
+    assert rejected.value.retry_after == pytest.approx(10.0)
+
+
+@pytest.mark.asyncio
+async def test_client_buckets_are_bounded():
+    """Test the least recently seen client is forgotten beyond max_clients."""
+    controller = _controller(request_burst=1)
+    with patch("src.utils.shared_state.time.monotonic", return_value=0.0):
+        await controller.check_rate("a", 1)
+        await controller.check_rate("b", 1)
+        await controller.check_rate("c", 1)
+        assert list(controller.state._buckets) == ["b", "c"]
+        # Forgotten clients start over with a full bucket
+        await controller.check_rate("a", 1)
+
+
+@pytest.mark.asyncio
+async def test_gate_queues_in_order_and_rejects_when_full():
+    """Test waiters get freed slots first in, first out, and a full queue rejects at once."""
+    gate = ConcurrencyGate(max_concurrent=1, max_queue=2, queue_timeout=1.0)
+    await gate.acquire()
+    order = []
+
+    async def wait_for_slot(name):
+        await gate.acquire()
+        order.append(name)
+
+    waiters = [asyncio.create_task(wait_for_slot(name)) for name in ("first", "second")]
+    await asyncio.sleep(0)
+    assert gate.queued == 2
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        await gate.acquire()
+    assert rejected.value.retry_after is not None
+
+    gate.release()
+    while not order:
+        await asyncio.sleep(0)
+    assert order == ["first"]
+    gate.release()
+    await asyncio.gather(*waiters)
+    assert order == ["first", "second"]
+    assert gate.active == 1 and gate.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_gate_queue_timeout():
+    """Test a request waiting longer than the queue timeout is rejected."""
+    gate = ConcurrencyGate(max_concurrent=1, max_queue=1, queue_timeout=0.01)
+    await gate.acquire()
+    with pytest.raises(AdmissionRejected, match="within"):
+        await gate.acquire()
+    assert gate.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_passes_its_slot_on():
+    """Test a waiter cancelled after being handed a slot gives it to the next one."""
+    gate = ConcurrencyGate(max_concurrent=1, max_queue=2, queue_timeout=1.0)
+    await gate.acquire()
+    first = asyncio.create_task(gate.acquire())
+    second = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+
+    gate.release()
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+    await second
+    assert gate.active == 1 and gate.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_slot_releases_on_error():
+    """Test the gate slot and the host stream are given back when the completion fails."""
+    controller = _controller()
+    with pytest.raises(RuntimeError):
+        async with controller.slot():
+            assert controller.gate.active == 1
+            assert await controller.state.active_streams() == 1
+            raise RuntimeError("upstream failed")
+    assert controller.gate.active == 0
+    assert await controller.state.active_streams() == 0
+
+
+@pytest.mark.asyncio
+async def test_slot_rejects_when_the_host_is_at_capacity():
+    """Test the host-wide stream limit rejects a request even with a free worker slot."""
+    controller = _controller(max_concurrent=2, max_concurrent_host=1)
+    async with controller.slot():
+        with pytest.raises(AdmissionRejected) as rejected:
+            async with controller.slot():
+                pass
+        assert rejected.value.retry_after is not None
+        # The rejected request gave its worker slot back
+        assert controller.gate.active == 1
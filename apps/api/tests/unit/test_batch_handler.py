@@ -0,0 +1,122 @@
+import asyncio
+import json
+import pytest
+from unittest.mock import MagicMock, patch
+
+from src.handlers.batch import BatchCompletionHandler
+from src.models.chat import ChatCompletionRequest, ChatMessage
+from src.utils.admission import AdmissionController
+
+
+def _http_request():
+    request = MagicMock()
+    request.headers = {}
+    request.client.host = "127.0.0.1"
+    return request
+
+
+def _chat_request(request_id, content="Hello"):
+    return ChatCompletionRequest(
+        request_id=request_id,
+        messages=[ChatMessage(role="user", content=content)]
+    )
+
+
+def _chunk(content):
+    chunk = MagicMock()
+    chunk.choices = [MagicMock()]
+    chunk.choices[0].delta.content = content
+    return chunk
+
+
+async def _collect(lines):
+    return [json.loads(line) async for line in lines]
+
+
+class _Upstream:
+    """Answers each prompt with itself after the delay it names, counting concurrent streams."""
+
+    def __init__(self):
+        self.running = 0
+        self.most_running = 0
+
+    async def generate_chat_completion(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        if prompt == "fail":
+            raise ValueError("Upstream refused the prompt")
+        return self._stream(prompt)
+
+    async def _stream(self, prompt):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            await asyncio.sleep(float(prompt) / 100)
+            yield _chunk(prompt)
+        finally:
+            self.running -= 1
+
+
+@pytest.mark.asyncio
+async def test_batch_results_come_in_completion_order_with_bounded_parallelism():
+    """Test at most the batch's parallelism runs and faster requests are reported first."""
+    upstream = _Upstream()
+    handler = BatchCompletionHandler(upstream)
+    chat_requests = [_chat_request(f"r{index}", delay) for index, delay in enumerate(["6", "1", "3", "1"])]
+
+    results = await _collect(handler.run(_http_request(), chat_requests, parallelism=2))
+
+    assert [result["request_id"] for result in results] == ["r1", "r2", "r3", "r0"]
+    assert [result["index"] for result in results] == [1, 2, 3, 0]
+    assert results[0]["content"] == "1"
+    assert results[0]["metrics"]["length"] == 1
+    assert upstream.most_running == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_reports_each_error_on_its_own_line():
+    """Test a failed request does not fail the rest of the batch."""
+    handler = BatchCompletionHandler(_Upstream())
+
+    results = await _collect(handler.run(_http_request(), [_chat_request("bad", "fail"), _chat_request("ok", "1")]))
+
+    by_id = {result["request_id"]: result for result in results}
+    assert by_id["bad"]["error"] == "Upstream refused the prompt"
+    assert "content" not in by_id["bad"]
+    assert by_id["ok"]["content"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_batch_waits_out_rate_limits():
+    """Test a batch is paced by its client's request rate instead of failing."""
+    admission = AdmissionController(
+        requests_per_second=50,
+        request_burst=1,
+        tokens_per_minute=100000,
+        max_concurrent=4,
+        max_queue=4,
+        queue_timeout=1.0,
+        max_clients=10
+    )
+    chat_requests = [_chat_request(f"r{index}", "0") for index in range(3)]
+
+    handler = BatchCompletionHandler(_Upstream(), admission=admission)
+    results = await _collect(handler.run(_http_request(), chat_requests, parallelism=3))
+    assert all("content" in result for result in results)
+
+    with patch("src.handlers.batch.settings.BATCH_RATE_LIMIT_MAX_WAIT", 0):
+        handler = BatchCompletionHandler(_Upstream(), admission=admission)
+        results = await _collect(handler.run(_http_request(), chat_requests, parallelism=3))
+    rejected = [result for result in results if "error" in result]
+    assert rejected and all(result["retry_after"] > 0 for result in rejected)
+
+
+@pytest.mark.asyncio
+async def test_closing_the_batch_cancels_running_requests():
+    """Test a client that goes away stops the requests still running."""
+    handler = BatchCompletionHandler(_Upstream())
+    lines = handler.run(_http_request(), [_chat_request("fast", "0"), _chat_request("slow", "1000")])
+
+    assert json.loads(await lines.__anext__())["request_id"] == "fast"
+    await lines.aclose()
+
+    assert handler._active_requests == {}
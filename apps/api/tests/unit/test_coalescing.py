@@ -0,0 +1,94 @@
+import asyncio
+import pytest
+
+from src.utils.coalescing import coalesce_deltas
+
+
+async def _source(items):
+    """Yield deltas, sleeping whenever a float is found in the items."""
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+async def _collect(deltas, window, max_bytes):
+    return [frame async for frame in coalesce_deltas(deltas, window, max_bytes)]
+
+
+@pytest.mark.asyncio
+async def test_first_delta_is_sent_immediately():
+    """Test the first delta is never held back by the window."""
+    frames = coalesce_deltas(_source(["Hel", 0.2, "lo"]), window=1.0, max_bytes=1024)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    assert await frames.__anext__() == "Hel"
+    assert loop.time() - started < 0.1
+    await frames.aclose()
+
+
+@pytest.mark.asyncio
+async def test_deltas_within_window_are_batched():
+    """Test deltas arriving back to back are sent as one frame."""
+    frames = await _collect(_source(["a", "b", "c", "d"]), window=1.0, max_bytes=1024)
+    assert frames == ["a", "bcd"]
+
+
+@pytest.mark.asyncio
+async def test_window_flushes_while_upstream_is_quiet():
+    """Test buffered deltas go out when the window elapses before the next delta."""
+    frames = await _collect(_source(["a", "b", "c", 0.1, "d"]), window=0.02, max_bytes=1024)
+    assert frames == ["a", "bc", "d"]
+
+
+@pytest.mark.asyncio
+async def test_size_limit_flushes_early():
+    """Test the buffer is flushed as soon as it reaches max_bytes."""
+    frames = await _collect(_source(["a", "bb", "cc", "dd", "e"]), window=1.0, max_bytes=4)
+    assert frames == ["a", "bbcc", "dde"]
+
+
+@pytest.mark.asyncio
+async def test_size_limit_counts_utf8_bytes():
+    """Test non-ASCII deltas are measured in encoded bytes."""
+    frames = await _collect(_source(["a", "é", "é", "x"]), window=1.0, max_bytes=4)
+    assert frames == ["a", "éé", "x"]
+
+
+@pytest.mark.asyncio
+async def test_zero_window_disables_coalescing():
+    """Test a window of 0 passes every delta through unchanged."""
+    frames = await _collect(_source(["a", "b", "c"]), window=0, max_bytes=1024)
+    assert frames == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_empty_source():
+    """Test an empty source produces no frames."""
+    assert await _collect(_source([]), window=0.05, max_bytes=1024) == []
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_pending_read():
+    """Test closing the coalescer stops the read it was waiting on."""
+    release = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def stalled():
+        yield "a"
+        yield "b"
+        try:
+            await release.wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        yield "c"
+
+    frames = coalesce_deltas(stalled(), window=0.01, max_bytes=1024)
+    assert await frames.__anext__() == "a"
+    assert await frames.__anext__() == "b"
+    await frames.aclose()
+
+    assert cancelled.is_set()
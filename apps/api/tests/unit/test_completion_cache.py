@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from src.utils.completion_cache import (
+    PURGE_INTERVAL_SECONDS,
+    CompletionCache,
+    completion_cache_key,
+    replay_chunks,
+)
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+def test_completion_cache_key():
+    """Test the key is stable and covers every field that changes the answer."""
+    key = completion_cache_key("gpt-4o-mini", MESSAGES, 0.0, None)
+    assert key == completion_cache_key("gpt-4o-mini", [dict(reversed(list(MESSAGES[0].items())))], 0.0, None)
+    assert key != completion_cache_key("gpt-4o", MESSAGES, 0.0, None)
+    assert key != completion_cache_key("gpt-4o-mini", [{"role": "user", "content": "Hi"}], 0.0, None)
+    assert key != completion_cache_key("gpt-4o-mini", MESSAGES, 0.7, None)
+    assert key != completion_cache_key("gpt-4o-mini", MESSAGES, 0.0, 100)
+
+
+@pytest.mark.asyncio
+async def test_memory_tier_is_bounded_lru():
+    """Test the in-memory tier evicts the least recently used entry."""
+    cache = CompletionCache(":memory:", ttl_seconds=60, max_entries=2)
+    await cache.set("a", ["A"])
+    await cache.set("b", ["B"])
+    assert await cache.get("a") == ["A"]
+    await cache.set("c", ["C"])
+
+    assert list(cache._memory) == ["a", "c"]
+    assert await cache.get("missing") is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_tier_persists_across_instances(tmp_path):
+    """Test entries survive a restart through the SQLite tier."""
+    path = str(tmp_path / "cache" / "completions.db")
+    cache = CompletionCache(path, ttl_seconds=60, max_entries=10)
+    cache.open()
+    await cache.set("key", ["Hello", " world"])
+    cache.close()
+
+    reopened = CompletionCache(path, ttl_seconds=60, max_entries=10)
+    reopened.open()
+    assert await reopened.get("key") == ["Hello", " world"]
+    assert "key" in reopened._memory
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_entries_expire(tmp_path):
+    """Test entries past their TTL are misses in both tiers."""
+    cache = CompletionCache(str(tmp_path / "completions.db"), ttl_seconds=10, max_entries=10)
+    cache.open()
+    with patch("src.utils.completion_cache.time.time", return_value=1000.0):
+        await cache.set("key", ["Hello"])
+    with patch("src.utils.completion_cache.time.time", return_value=1011.0):
+        assert await cache.get("key") is None
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_rows_are_purged_on_write(tmp_path):
+    """Test the SQLite tier drops expired rows while it runs, not only when reopened."""
+    cache = CompletionCache(str(tmp_path / "completions.db"), ttl_seconds=10, max_entries=10)
+    with patch("src.utils.completion_cache.time.time", return_value=1000.0):
+        cache.open()
+        await cache.set("old", ["Hello"])
+    with patch("src.utils.completion_cache.time.time", return_value=1000.0 + PURGE_INTERVAL_SECONDS):
+        await cache.set("new", ["World"])
+
+    keys = [row[0] for row in cache._connection.execute("SELECT key FROM completions")]
+    assert keys == ["new"]
+    cache.close()
+
+
+@pytest.mark.asyncio
+async def test_replay_chunks_pacing():
+    """Test replay at full speed and at a configured pace."""
+    assert [chunk async for chunk in replay_chunks(["a", "b"])] == ["a", "b"]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert [chunk async for chunk in replay_chunks(["a", "b", "c"], delay=0.02)] == ["a", "b", "c"]
+    assert loop.time() - started >= 0.04
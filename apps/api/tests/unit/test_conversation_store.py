@@ -0,0 +1,120 @@
+import pytest
+from unittest.mock import patch
+
+from src.utils.conversation_store import PURGE_INTERVAL_SECONDS, ConversationStore, new_conversation_id
+
+USER = {"role": "user", "content": "Hello"}
+ASSISTANT = {"role": "assistant", "content": "Hi there"}
+
+
+@pytest.mark.asyncio
+async def test_history_grows_turn_by_turn():
+    """Test appended turns are returned in order and unknown ids have no history."""
+    store = ConversationStore(":memory:", idle_ttl_seconds=60, max_bytes=1024)
+    store.open()
+    assert await store.get_history("chat") is None
+
+    await store.append("chat", [USER, ASSISTANT])
+    await store.append("chat", [{"role": "user", "content": "Again"}])
+
+    history = await store.get_history("chat")
+    assert history == [USER, ASSISTANT, {"role": "user", "content": "Again"}]
+    assert store.memory_bytes == sum(len(m["role"]) + len(m["content"]) for m in history)
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_evicts_least_recently_used(tmp_path):
+    """Test the memory tier stays under budget and evicted histories reload from SQLite."""
+    store = ConversationStore(str(tmp_path / "conversations.db"), idle_ttl_seconds=60, max_bytes=30)
+    store.open()
+    await store.append("a", [USER])
+    await store.append("b", [USER])
+    await store.append("c", [ASSISTANT, ASSISTANT])
+
+    assert list(store._memory) == ["c"]
+    assert await store.get_history("a") == [USER]
+    assert "a" in store._memory
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_tier_persists_across_instances(tmp_path):
+    """Test histories survive a restart through the SQLite tier."""
+    path = str(tmp_path / "store" / "conversations.db")
+    store = ConversationStore(path, idle_ttl_seconds=60, max_bytes=1024)
+    store.open()
+    await store.append("chat", [USER, ASSISTANT])
+    store.close()
+
+    reopened = ConversationStore(path, idle_ttl_seconds=60, max_bytes=1024)
+    reopened.open()
+    assert await reopened.get_history("chat") == [USER, ASSISTANT]
+    await reopened.append("chat", [USER])
+    assert await reopened.get_history("chat") == [USER, ASSISTANT, USER]
+    reopened.close()
+
+
+@pytest.mark.asyncio
+async def test_idle_conversations_expire(tmp_path):
+    """Test conversations idle past the TTL are dropped from both tiers."""
+    store = ConversationStore(str(tmp_path / "conversations.db"), idle_ttl_seconds=10, max_bytes=1024)
+    store.open()
+    with patch("src.utils.conversation_store.time.time", return_value=1000.0):
+        await store.append("chat", [USER, ASSISTANT])
+    with patch("src.utils.conversation_store.time.time", return_value=1011.0):
+        assert await store.get_history("chat") is None
+        assert store.memory_bytes == 0
+
+        # Reusing the id starts a fresh conversation
+        await store.append("chat", [ASSISTANT])
+    store._memory.clear()
+    with patch("src.utils.conversation_store.time.time", return_value=1012.0):
+        assert await store.get_history("chat") == [ASSISTANT]
+    store.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_rows_are_purged_at_an_interval(tmp_path):
+    """Test appends only scan the database for expired rows every purge interval."""
+    store = ConversationStore(str(tmp_path / "conversations.db"), idle_ttl_seconds=10, max_bytes=1024)
+    with patch("src.utils.conversation_store.time.time", return_value=1000.0):
+        store.open()
+        await store.append("old", [USER])
+
+    def rows():
+        return store._connection.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    with patch("src.utils.conversation_store.time.time", return_value=1020.0):
+        await store.append("new", [USER])
+    assert rows() == 2
+    with patch("src.utils.conversation_store.time.time", return_value=1000.0 + PURGE_INTERVAL_SECONDS):
+        await store.append("new", [ASSISTANT])
+    assert rows() == 1
+    store.close()
+
+
+def test_new_conversation_ids_are_unguessable():
+    """Test issued ids are long random tokens that do not repeat."""
+    ids = {new_conversation_id() for _ in range(100)}
+    assert len(ids) == 100
+    assert all(len(conversation_id) >= 32 for conversation_id in ids)
+
+
+@pytest.mark.asyncio
+async def test_shared_store_reads_turns_of_other_workers(tmp_path):
+    """Test a shared store catches up on messages another worker appended."""
+    path = str(tmp_path / "conversations.db")
+    first = ConversationStore(path, idle_ttl_seconds=60, max_bytes=1024, shared=True)
+    second = ConversationStore(path, idle_ttl_seconds=60, max_bytes=1024, shared=True)
+    first.open()
+    second.open()
+
+    await first.append("chat", [USER])
+    assert await second.get_history("chat") == [USER]
+    await second.append("chat", [ASSISTANT])
+
+    assert await first.get_history("chat") == [USER, ASSISTANT]
+    assert first.memory_bytes == len("user") + len("Hello") + len("assistant") + len("Hi there")
+    first.close()
+    second.close()
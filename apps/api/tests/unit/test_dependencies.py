@@ -1,26 +1,144 @@
+import asyncio
+
 import pytest
+from fastapi import HTTPException
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
-from src.api.dependencies import get_open_ai_adapter, get_websocket_handler
-from src.adapters.openai import OpenAIAdapter
+from src.api.dependencies import (
+    get_admission,
+    get_completion_cache,
+    get_conversation_store,
+    get_provider_router,
+    get_shared_state,
+    get_single_flight,
+    get_token_budget,
+    get_websocket_handler,
+)
+from src.adapters.router import ProviderRouter
 from src.handlers.websocket import WebSocketHandler
+from src.utils.admission import AdmissionController
+from src.utils.shared_state import LocalSharedState
+from src.utils.single_flight import SingleFlightGroup
+from src.utils.token_budget import TokenBudget
+
+
+def _connection(**state):
+    """Build a stand-in connection whose app carries the given state."""
+    return SimpleNamespace(app=SimpleNamespace(state=SimpleNamespace(**state)))
+
+@pytest.mark.asyncio
+async def test_get_provider_router():
+    """Test the get_provider_router dependency returns the shared router."""
+    shared_router = MagicMock(spec=ProviderRouter)
+    connection = _connection(provider_router=shared_router)
+
+    assert await get_provider_router(connection) is shared_router
+    assert await get_provider_router(connection) is shared_router
 
-def test_get_open_ai_adapter():
-    """Test the get_open_ai_adapter dependency."""
-    adapter = get_open_ai_adapter()
-    assert isinstance(adapter, OpenAIAdapter)
+@pytest.mark.asyncio
+async def test_get_provider_router_without_lifespan():
+    """Test the router is created once and reused when the lifespan has not run."""
+    connection = _connection()
 
-@patch('src.api.dependencies.OpenAIAdapter')
-def test_get_websocket_handler(mock_openai_adapter):
+    router = await get_provider_router(connection)
+    assert isinstance(router, ProviderRouter)
+    assert await get_provider_router(connection) is router
+
+@pytest.mark.asyncio
+async def test_get_provider_router_waits_for_the_lifespan_build():
+    """Test connections arriving during startup wait for the router being built."""
+    build = asyncio.get_running_loop().create_future()
+    connection = _connection(provider_router=None, router_build=build)
+    shared_router = MagicMock(spec=ProviderRouter)
+
+    waiting = asyncio.ensure_future(get_provider_router(connection))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    build.set_result(shared_router)
+    assert await waiting is shared_router
+
+    failed = asyncio.get_running_loop().create_future()
+    failed.set_exception(RuntimeError("bad provider configuration"))
+    with pytest.raises(HTTPException) as error:
+        await get_provider_router(_connection(provider_router=None, router_build=failed))
+    assert error.value.status_code == 503
+
+@patch('src.api.dependencies.ProviderRouter')
+def test_get_websocket_handler(mock_provider_router):
     """Test the get_websocket_handler dependency."""
-    # Create a mock adapter
-    mock_adapter = MagicMock()
+    # Create a mock router
+    mock_router = MagicMock()
     
-    # Test with passed adapter
-    handler = get_websocket_handler(mock_adapter)
+    # Test with passed router
+    handler = get_websocket_handler(
+        router=mock_router,
+        completion_cache=None,
+        single_flight=None,
+        conversation_store=None,
+        token_budget=None,
+        admission=None,
+        send_queue_metrics=None,
+        service_metrics=None,
+        tracer=None,
+    )
     assert isinstance(handler, WebSocketHandler)
-    
-    # Test with default dependencies
-    mock_openai_adapter.return_value = mock_adapter
-    handler = get_websocket_handler()
-    assert isinstance(handler, WebSocketHandler) 
\ No newline at end of file
+    assert handler.router is mock_router
+    assert handler.completion_cache is None
+    assert handler.single_flight is None
+    assert handler.conversation_store is None
+    assert handler.token_budget is None
+    assert handler.admission is None
+    assert handler.tracer is None
+
+def test_get_completion_cache():
+    """Test the completion cache is only provided when the lifespan enabled it."""
+    cache = MagicMock()
+    assert get_completion_cache(_connection(completion_cache=cache)) is cache
+    assert get_completion_cache(_connection()) is None
+
+def test_get_single_flight():
+    """Test the single-flight group is shared and can be disabled."""
+    connection = _connection()
+    group = get_single_flight(connection)
+    assert isinstance(group, SingleFlightGroup)
+    assert get_single_flight(connection) is group
+
+    with patch('src.api.dependencies.settings.SINGLE_FLIGHT_ENABLED', False):
+        assert get_single_flight(_connection()) is None
+
+def test_get_conversation_store():
+    """Test the conversation store is only provided when the lifespan opened it."""
+    store = MagicMock()
+    assert get_conversation_store(_connection(conversation_store=store)) is store
+    assert get_conversation_store(_connection()) is None
+
+def test_get_token_budget():
+    """Test the token budget manager is shared and can be disabled."""
+    connection = _connection()
+    token_budget = get_token_budget(connection)
+    assert isinstance(token_budget, TokenBudget)
+    assert get_token_budget(connection) is token_budget
+
+    with patch('src.api.dependencies.settings.TOKEN_BUDGET_ENABLED', False):
+        assert get_token_budget(_connection()) is None
+
+def test_get_shared_state():
+    """Test the shared state follows the configured backend and is created once."""
+    connection = _connection()
+    shared_state = get_shared_state(connection)
+    assert isinstance(shared_state, LocalSharedState)
+    assert get_shared_state(connection) is shared_state
+
+
+def test_get_admission():
+    """Test the admission controller is shared and can be disabled."""
+    connection = _connection()
+    admission = get_admission(connection)
+    assert isinstance(admission, AdmissionController)
+    assert get_admission(connection) is admission
+    # Its buckets live in the application's shared state
+    assert admission.state is get_shared_state(connection)
+
+    with patch('src.api.dependencies.settings.ADMISSION_ENABLED', False):
+        assert get_admission(_connection()) is None
@@ -1,9 +1,51 @@
+import asyncio
+
 import pytest
+from fastapi import HTTPException
 from starlette import status
+from unittest.mock import MagicMock
 
-from src.api.health import health_endpoint
+from src.api.health import health_endpoint, liveness_endpoint, readiness_endpoint
 
 def test_health_endpoint():
     """Test the health endpoint returns OK"""
     response = health_endpoint()
-    assert response == "OK" 
\ No newline at end of file
+    assert response == "OK" 
+
+
+@pytest.mark.asyncio
+async def test_liveness_endpoint():
+    """Test the liveness check answers while warming up but not after a failed startup."""
+    request = MagicMock()
+    request.app.state.startup = asyncio.get_running_loop().create_future()
+    assert await liveness_endpoint(request) == "OK"
+
+    request.app.state.startup.set_exception(RuntimeError("bad provider configuration"))
+    with pytest.raises(HTTPException) as error:
+        await liveness_endpoint(request)
+    assert error.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert "bad provider configuration" in error.value.detail
+
+
+@pytest.mark.asyncio
+async def test_readiness_endpoint_follows_the_startup():
+    """Test the worker is ready once its startup task succeeded, or without one."""
+    request = MagicMock()
+    request.app.state.startup = None
+    assert await readiness_endpoint(request) == "OK"
+
+    startup = asyncio.get_running_loop().create_future()
+    request.app.state.startup = startup
+    with pytest.raises(HTTPException) as error:
+        await readiness_endpoint(request)
+    assert error.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    startup.set_result(None)
+    assert await readiness_endpoint(request) == "OK"
+
+    failed = asyncio.get_running_loop().create_future()
+    failed.set_exception(RuntimeError("bad provider configuration"))
+    request.app.state.startup = failed
+    with pytest.raises(HTTPException) as error:
+        await readiness_endpoint(request)
+    assert error.value.detail.startswith("Startup failed")
@@ -0,0 +1,71 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from openai import InternalServerError, NotFoundError
+
+from src.handlers.http import HTTPCompletionHandler, _http_error
+from src.models.chat import ChatCompletionRequest, ChatMessage
+from src.utils.admission import AdmissionRejected
+from src.utils.stream_watchdog import StreamStalled
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(error_class, status):
+    return error_class("upstream error", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+def _http_request():
+    request = MagicMock()
+    request.headers = {}
+    request.client.host = "127.0.0.1"
+    return request
+
+
+def test_http_error_statuses():
+    """Test pipeline errors map to the status an HTTP client expects."""
+    rejected = _http_error(AdmissionRejected("Rate limit exceeded", retry_after=0.2))
+    assert rejected.status_code == 429
+    assert rejected.headers == {"Retry-After": "1"}
+
+    assert _http_error(_status_error(NotFoundError, 404)).status_code == 404
+    assert _http_error(_status_error(InternalServerError, 500)).status_code == 502
+    assert _http_error(StreamStalled("No token for 5s")).status_code == 502
+    assert _http_error(ValueError("Unknown conversation")).status_code == 400
+    assert _http_error(None).status_code == 500
+
+
+@pytest.mark.asyncio
+async def test_closing_the_event_stream_cancels_the_upstream():
+    """Test a client that goes away mid-stream stops the upstream stream."""
+    closed = asyncio.Event()
+
+    async def chunks():
+        try:
+            for index in range(1000):
+                chunk = MagicMock()
+                chunk.choices = [MagicMock()]
+                chunk.choices[0].delta.content = f"token{index} "
+                yield chunk
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    adapter = MagicMock()
+    adapter.generate_chat_completion = AsyncMock(return_value=chunks())
+    handler = HTTPCompletionHandler(adapter)
+    chat_request = ChatCompletionRequest(
+        request_id="sse",
+        messages=[ChatMessage(role="user", content="Count")]
+    )
+
+    await handler.open(_http_request(), chat_request)
+    events = handler.events()
+    first = await events.__anext__()
+    assert first.startswith('data: {"request_id":"sse"')
+    await events.aclose()
+
+    await asyncio.wait_for(closed.wait(), timeout=1)
+    assert handler._task.cancelled()
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+from unittest.mock import MagicMock, patch
+
+from openai import RateLimitError
+
+from src.jobs import JobPacer, JobRunner, load_checkpoint
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+
+
+def _request_line(content, request_id=None):
+    line = {"messages": [{"role": "user", "content": content}]}
+    if request_id is not None:
+        line["request_id"] = request_id
+    return json.dumps(line)
+
+
+def _read_results(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+class _Upstream:
+    """Answers each prompt in upper case, counting calls and concurrent requests."""
+
+    def __init__(self, rate_limited=0):
+        self.prompts = []
+        self.running = 0
+        self.most_running = 0
+        self.rate_limited = rate_limited
+
+    async def generate_chat_completion(self, messages, **kwargs):
+        prompt = messages[-1]["content"]
+        self.prompts.append(prompt)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            response = httpx.Response(429, request=REQUEST, headers={"retry-after-ms": "50"})
+            raise RateLimitError("rate limited", response=response, body=None)
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.running -= 1
+        response = MagicMock()
+        response.choices[0].message.content = prompt.upper()
+        response.usage.prompt_tokens = 3
+        response.usage.completion_tokens = 2
+        return response
+
+
+@pytest.mark.asyncio
+async def test_job_writes_a_result_per_line(tmp_path):
+    """Test every line gets a result with bounded concurrency, invalid ones an error."""
+    source, output = tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    _write_lines(source, [_request_line(f"prompt {index}") for index in range(6)] + ["", "not json"])
+    upstream = _Upstream()
+
+    summary = await JobRunner(upstream, str(source), str(output), concurrency=2).run()
+
+    results = {result["line"]: result for result in _read_results(output)}
+    assert set(results) == {1, 2, 3, 4, 5, 6, 8}
+    assert results[1]["content"] == "PROMPT 0"
+    assert results[1]["completion_tokens"] == 2
+    assert results[8]["error"].startswith("Invalid request")
+    assert upstream.most_running == 2
+    assert (summary.completed, summary.failed, summary.completion_tokens) == (6, 1, 12)
+
+
+@pytest.mark.asyncio
+async def test_job_records_a_malformed_response_as_a_failed_line(tmp_path):
+    """Test a response without choices fails its line and the job carries on."""
+    source, output = tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    _write_lines(source, [_request_line("empty", "a"), _request_line("two", "b")])
+    upstream = _Upstream()
+    answer = upstream.generate_chat_completion
+
+    async def generate_chat_completion(messages, **kwargs):
+        response = await answer(messages, **kwargs)
+        if messages[-1]["content"] == "empty":
+            response.choices = []
+        return response
+
+    upstream.generate_chat_completion = generate_chat_completion
+    summary = await JobRunner(upstream, str(source), str(output)).run()
+
+    results = {result["request_id"]: result for result in _read_results(output)}
+    assert results["a"]["error"].startswith("Invalid response")
+    assert results["b"]["content"] == "TWO"
+    assert (summary.completed, summary.failed) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_job_resumes_from_its_output(tmp_path):
+    """Test a rerun skips the lines done and drops a line cut short by a crash."""
+    source, output = tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    _write_lines(source, [_request_line("one", "a"), _request_line("two", "b"), _request_line("three", "c")])
+    output.write_text('{"line":2,"request_id":"b","content":"TWO"}\n{"line":3,"request_')
+    upstream = _Upstream()
+
+    summary = await JobRunner(upstream, str(source), str(output)).run()
+
+    assert sorted(upstream.prompts) == ["one", "three"]
+    assert sorted(result["line"] for result in _read_results(output)) == [1, 2, 3]
+    assert (summary.completed, summary.skipped) == (2, 1)
+    assert load_checkpoint(str(output)) == {1, 2, 3}
+
+
+def test_checkpoint_can_leave_failed_lines_to_run_again(tmp_path):
+    """Test failed lines only count as done unless they are retried."""
+    output = tmp_path / "output.jsonl"
+    output.write_text('{"line":1,"content":"ok"}\n{"line":2,"error":"Upstream refused"}\n')
+
+    assert load_checkpoint(str(output)) == {1, 2}
+    assert load_checkpoint(str(output), retry_failed=True) == {1}
+
+
+@pytest.mark.asyncio
+async def test_job_pauses_on_upstream_rate_limits(tmp_path):
+    """Test a rate limit pauses the job for the time asked and the line is tried again."""
+    source, output = tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    _write_lines(source, [_request_line("one")])
+
+    started = time.monotonic()
+    summary = await JobRunner(_Upstream(rate_limited=1), str(source), str(output)).run()
+
+    assert time.monotonic() - started >= 0.05
+    assert _read_results(output)[0]["content"] == "ONE"
+    assert summary.rate_limit_pauses == 1
+
+    summary = await JobRunner(
+        _Upstream(rate_limited=5), str(source), str(tmp_path / "failed.jsonl"), rate_limit_retries=1
+    ).run()
+    assert summary.failed == 1
+
+
+@pytest.mark.asyncio
+async def test_pacer_limits_the_request_rate():
+    """Test requests beyond one second of the rate wait for the bucket to refill."""
+    pacer = JobPacer(requests_per_minute=1200)
+
+    started = time.monotonic()
+    for _ in range(25):
+        await pacer.acquire(tokens=100)
+
+    # 20 requests fit the bucket, the 5 others need a quarter of a second
+    assert 0.2 <= time.monotonic() - started < 1.0
+
+
+@pytest.mark.asyncio
+async def test_pacer_charges_requests_larger_than_the_bucket_in_full():
+    """Test requests estimated above one second of tokens still keep to the token rate."""
+    clock = [0.0]
+
+    async def sleep(seconds):
+        clock[0] += seconds
+
+    with patch("src.jobs.time.monotonic", lambda: clock[0]), patch("src.jobs.asyncio.sleep", sleep):
+        pacer = JobPacer(tokens_per_minute=60000)
+        for _ in range(5):
+            await pacer.acquire(tokens=2000)
+
+    # 10000 tokens at 1000 a second, the first 1000 from the full bucket
+    assert clock[0] == pytest.approx(8.0)
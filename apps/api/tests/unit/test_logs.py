@@ -0,0 +1,85 @@
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueListener
+
+from src.utils.logs import SAMPLED, CallSiteSampler, JsonFormatter, NonBlockingQueueHandler
+
+
+def _record(message, *args, level=logging.INFO, lineno=1, **extra):
+    record = logging.LogRecord("src.test", level, "test.py", lineno, message, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_writes_one_object_per_record():
+    """Test records become JSON lines with their extra fields and exception."""
+    record = _record("Completed request %s in %sms", "abc", 12, request_id="abc")
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "Completed request abc in 12ms"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "src.test"
+    assert entry["request_id"] == "abc"
+    assert entry["time"].endswith("+00:00")
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = logging.LogRecord("src.test", logging.ERROR, "test.py", 1, "Failed", None, sys.exc_info())
+    entry = json.loads(JsonFormatter().format(record))
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_sampler_keeps_one_record_in_n_per_call_site():
+    """Test sampled call sites are thinned separately and others are kept whole."""
+    sampler = CallSiteSampler(every=3)
+
+    first_site = [sampler.filter(_record("Disconnected", lineno=10, **SAMPLED)) for _ in range(6)]
+    other_site = [sampler.filter(_record("Cancelled", lineno=20, **SAMPLED)) for _ in range(2)]
+    unsampled = [sampler.filter(_record("Failed", lineno=10)) for _ in range(3)]
+
+    assert first_site == [True, False, False, True, False, False]
+    assert other_site == [True, False]
+    assert unsampled == [True, True, True]
+
+    record = _record("Disconnected", lineno=30, **SAMPLED)
+    sampler.filter(record)
+    assert record.sample_every == 3
+
+
+def test_queue_handler_defers_formatting_and_drops_when_full():
+    """Test records are queued unformatted and a full queue never blocks the caller."""
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    payload = ["tokens", 3]
+
+    for _ in range(3):
+        handler.handle(_record("Usage %s", payload))
+
+    queued = handler.queue.get_nowait()
+    assert queued.msg == "Usage %s" and queued.args == (payload,)
+    assert handler.dropped == 1
+
+
+def test_slow_sink_does_not_slow_down_logging():
+    """Test a sink that takes long to write only delays the listener thread."""
+    written = threading.Event()
+
+    class SlowSink(logging.Handler):
+        def emit(self, record):
+            time.sleep(0.05)
+            written.set()
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=100))
+    listener = QueueListener(handler.queue, SlowSink())
+    listener.start()
+    try:
+        started = time.perf_counter()
+        for index in range(20):
+            handler.handle(_record("Chunk %s", index))
+        assert time.perf_counter() - started < 0.05
+    finally:
+        listener.stop()
+    assert written.is_set()
@@ -0,0 +1,65 @@
+import pytest
+
+from src.utils.metrics import Counter, Gauge, Histogram, ServiceMetrics, render
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Test observations land in their bucket and render cumulatively with sum and count."""
+    histogram = Histogram("latency_seconds", "Latency.", ("model",), buckets=(0.1, 1.0))
+    child = histogram.labels("gpt-4o")
+    for value in (0.05, 0.1, 0.5, 3.0):
+        child.observe(value)
+
+    assert render([histogram]).splitlines() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{model="gpt-4o",le="0.1"} 2',
+        'latency_seconds_bucket{model="gpt-4o",le="1"} 3',
+        'latency_seconds_bucket{model="gpt-4o",le="+Inf"} 4',
+        'latency_seconds_sum{model="gpt-4o"} 3.65',
+        'latency_seconds_count{model="gpt-4o"} 4',
+    ]
+
+
+def test_counters_and_gauges():
+    """Test unlabelled samples are always exposed and label values are escaped."""
+    counter = Counter("requests_total", "Requests.", ("model",))
+    counter.labels('my "model"').inc(2)
+    gauge = Gauge("sockets", "Sockets.")
+
+    assert render([counter, gauge]).splitlines()[2:] == [
+        'requests_total{model="my \\"model\\""} 2',
+        "# HELP sockets Sockets.",
+        "# TYPE sockets gauge",
+        "sockets 0",
+    ]
+
+
+def test_stream_recorder_outcomes():
+    """Test a recorder records token timings once per delta and its outcome once."""
+    metrics = ServiceMetrics()
+    recorder = metrics.start_stream("gpt-4o-mini")
+    for _ in range(3):
+        recorder.delta()
+    recorder.completed(3)
+    recorder.failed()
+
+    assert metrics.requests.labels("gpt-4o-mini").value == 1
+    assert sum(metrics.time_to_first_token.labels("gpt-4o-mini").counts) == 1
+    assert sum(metrics.inter_token_latency.labels("gpt-4o-mini").counts) == 2
+    assert sum(metrics.stream_duration.labels("gpt-4o-mini").counts) == 1
+    assert metrics.errors.labels("gpt-4o-mini").value == 0
+
+
+@pytest.mark.parametrize("outcome, counter", [
+    ("failed", "errors"),
+    ("cancelled", "cancellations"),
+    ("disconnected", "disconnects"),
+])
+def test_stream_recorder_failures(outcome, counter):
+    """Test interrupted streams are counted by outcome, unknown models as other."""
+    metrics = ServiceMetrics()
+    getattr(metrics.start_stream("made-up-model"), outcome)()
+
+    assert getattr(metrics, counter).labels("other").value == 1
+    assert sum(metrics.stream_duration.labels("other").counts) == 0
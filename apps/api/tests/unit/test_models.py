@@ -1,7 +1,10 @@
 import pytest
 from typing import List
+from unittest.mock import patch
 
-from src.models.chat import ChatMessage, ChatCompletionRequest, StreamChunk, ErrorResponse
+from pydantic import ValidationError
+
+from src.models.chat import BatchCompletionRequest, ChatMessage, ChatCompletionRequest, CoalesceOptions, StreamChunk, ErrorResponse
 
 def test_chat_message():
     """Test the ChatMessage model."""
@@ -10,6 +13,9 @@ def test_chat_message():
         message = ChatMessage(role=role, content="Test content")
         assert message.role == role
         assert message.content == "Test content"
+        assert message.pinned is False
+    
+    assert ChatMessage(role="system", content="Rules", pinned=True).pinned is True
     
     # Test with invalid role
     with pytest.raises(ValueError):
@@ -67,4 +73,31 @@ def test_error_response():
     """Test the ErrorResponse model."""
     error = ErrorResponse(request_id="123", error="Something went wrong")
     assert error.request_id == "123"
-    assert error.error == "Something went wrong" 
\ No newline at end of file
+    assert error.error == "Something went wrong" 
+
+def test_coalesce_options():
+    """Test the CoalesceOptions model."""
+    request = ChatCompletionRequest(
+        request_id="123",
+        messages=[ChatMessage(role="user", content="Hello")],
+        coalesce={"window_ms": 50, "max_bytes": 256}
+    )
+    assert request.coalesce == CoalesceOptions(window_ms=50, max_bytes=256)
+    
+    # Defaults to the server settings
+    assert ChatCompletionRequest(request_id="123", messages=[]).coalesce is None
+    
+    # Out of range values are rejected
+    with pytest.raises(ValueError):
+        CoalesceOptions(window_ms=-1)
+    with pytest.raises(ValueError):
+        CoalesceOptions(max_bytes=0)
+
+def test_batch_size_is_checked_before_its_requests():
+    """Test an oversized batch is rejected without validating each of its requests."""
+    with patch('src.models.chat.settings.BATCH_MAX_REQUESTS', 1):
+        with pytest.raises(ValidationError) as error:
+            BatchCompletionRequest(requests=[{"messages": "invalid"}, {"messages": "invalid"}])
+    errors = error.value.errors()
+    assert len(errors) == 1
+    assert "at most 1 requests" in errors[0]["msg"]
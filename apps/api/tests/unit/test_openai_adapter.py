@@ -1,7 +1,11 @@
+import httpx
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 
+from openai import APIConnectionError, RateLimitError
+
 from src.adapters.openai import OpenAIAdapter, OpenAIModel
+from src.utils.tracing import Trace, activate
 
 
 def test_openai_model_enum():
@@ -15,28 +19,100 @@ class TestOpenAIAdapter:
     """Test suite for the OpenAIAdapter class."""
     
     @patch('src.adapters.openai.AsyncOpenAI')
-    @patch('src.adapters.openai.Settings')
+    @patch('src.adapters.openai.settings')
     def test_init_with_default_api_key(self, mock_settings, mock_async_openai):
         """Test initialization with the default API key from settings."""
         # Setup mock
-        mock_settings_instance = MagicMock()
-        mock_settings_instance.OPENAI_API_KEY = "test-api-key"
-        mock_settings.return_value = mock_settings_instance
+        mock_settings.OPENAI_API_KEY = "test-api-key"
+        mock_settings.OPENAI_MAX_CONNECTIONS = 10
+        mock_settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS = 5
+        mock_settings.OPENAI_KEEPALIVE_EXPIRY = 30.0
+        mock_settings.OPENAI_CONNECT_TIMEOUT = 5.0
+        mock_settings.OPENAI_READ_TIMEOUT = 60.0
+        mock_settings.OPENAI_POOL_TIMEOUT = 10.0
+        mock_settings.OPENAI_BASE_URL = None
         
         # Initialize adapter
         adapter = OpenAIAdapter()
         
         # Verify
         assert adapter.api_key == "test-api-key"
-        mock_async_openai.assert_called_once_with(api_key="test-api-key")
+        mock_async_openai.assert_called_once_with(
+            api_key="test-api-key",
+            base_url=None,
+            http_client=adapter.http_client,
+            max_retries=0
+        )
     
+    @patch('src.adapters.openai.AsyncOpenAI')
+    def test_init_with_base_url(self, mock_async_openai):
+        """Test an OpenAI-compatible endpoint can replace the public API."""
+        settings_instance = MagicMock()
+        settings_instance.OPENAI_API_KEY = "key"
+        settings_instance.OPENAI_BASE_URL = "http://127.0.0.1:8090/v1"
+        settings_instance.OPENAI_MAX_CONNECTIONS = 10
+        settings_instance.OPENAI_MAX_KEEPALIVE_CONNECTIONS = 5
+        settings_instance.OPENAI_KEEPALIVE_EXPIRY = 30.0
+        settings_instance.OPENAI_CONNECT_TIMEOUT = 5.0
+        settings_instance.OPENAI_READ_TIMEOUT = 60.0
+        settings_instance.OPENAI_POOL_TIMEOUT = 10.0
+
+        adapter = OpenAIAdapter(settings_instance=settings_instance)
+
+        assert mock_async_openai.call_args.kwargs["base_url"] == "http://127.0.0.1:8090/v1"
+        assert adapter.http_client is mock_async_openai.call_args.kwargs["http_client"]
+
     @patch('src.adapters.openai.AsyncOpenAI')
     def test_init_with_custom_api_key(self, mock_async_openai):
         """Test initialization with a custom API key."""
         adapter = OpenAIAdapter(api_key="custom-api-key")
         
         assert adapter.api_key == "custom-api-key"
-        mock_async_openai.assert_called_once_with(api_key="custom-api-key")
+        mock_async_openai.assert_called_once_with(
+            api_key="custom-api-key",
+            base_url=None,
+            http_client=adapter.http_client,
+            max_retries=0
+        )
+
+    def test_http_client_uses_configured_pool(self):
+        """Test the pooled HTTP client is built from the settings."""
+        settings_instance = MagicMock()
+        settings_instance.OPENAI_API_KEY = "key"
+        settings_instance.OPENAI_BASE_URL = None
+        settings_instance.OPENAI_MAX_CONNECTIONS = 7
+        settings_instance.OPENAI_MAX_KEEPALIVE_CONNECTIONS = 3
+        settings_instance.OPENAI_KEEPALIVE_EXPIRY = 12.0
+        settings_instance.OPENAI_CONNECT_TIMEOUT = 2.0
+        settings_instance.OPENAI_READ_TIMEOUT = 30.0
+        settings_instance.OPENAI_POOL_TIMEOUT = 4.0
+
+        adapter = OpenAIAdapter(settings_instance=settings_instance)
+
+        pool = adapter.http_client._transport._pool
+        assert pool._max_connections == 7
+        assert pool._max_keepalive_connections == 3
+        assert adapter.http_client.timeout.connect == 2.0
+        assert adapter.http_client.timeout.read == 30.0
+        assert adapter.http_client.timeout.pool == 4.0
+
+    @pytest.mark.asyncio
+    async def test_warmup(self):
+        """Test warmup reports whether the upstream could be reached."""
+        adapter = OpenAIAdapter(api_key="test-key")
+        adapter.client = MagicMock()
+        adapter.client.models.list = AsyncMock()
+        assert await adapter.warmup() is True
+
+        adapter.client.models.list = AsyncMock(side_effect=Exception("unreachable"))
+        assert await adapter.warmup() is False
+
+    @pytest.mark.asyncio
+    async def test_close(self):
+        """Test closing the adapter closes the pooled HTTP client."""
+        adapter = OpenAIAdapter(api_key="test-key")
+        await adapter.close()
+        assert adapter.http_client.is_closed
     
     def test_prepare_completion_params_with_model_enum(self):
         """Test the _prepare_completion_params method with a model enum."""
@@ -56,6 +132,7 @@ class TestOpenAIAdapter:
         assert params["temperature"] == 0.5
         assert params["max_tokens"] == 100
         assert params["stream"] is True
+        assert params["stream_options"] == {"include_usage": True}
     
     def test_prepare_completion_params_with_model_string(self):
         """Test the _prepare_completion_params method with a model string."""
@@ -75,6 +152,7 @@ class TestOpenAIAdapter:
         assert params["temperature"] == 0.8
         assert params["max_tokens"] == 200
         assert params["stream"] is False
+        assert "stream_options" not in params
     
     def test_prepare_completion_params_for_o3_mini(self):
         """Test the _prepare_completion_params method for o3-mini model."""
@@ -138,7 +216,8 @@ class TestOpenAIAdapter:
             messages=messages,
             temperature=0.7,
             max_tokens=100,
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True}
         )
 
     @pytest.mark.asyncio
@@ -157,4 +236,57 @@ class TestOpenAIAdapter:
         # Test error handling
         messages = [{"role": "user", "content": "Hello"}]
         with pytest.raises(Exception):
-            await adapter.generate_chat_completion(messages=messages) 
\ No newline at end of file
+            await adapter.generate_chat_completion(messages=messages) 
+    @pytest.mark.asyncio
+    @patch('src.adapters.openai.logger')
+    async def test_generate_chat_completion_retries_before_first_token(self, mock_logger):
+        """Test a rate-limited stream is opened again after the requested delay."""
+        adapter = OpenAIAdapter(api_key="test-key")
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        rate_limited = RateLimitError(
+            "rate limited",
+            response=httpx.Response(429, headers={"retry-after-ms": "1"}, request=request),
+            body=None
+        )
+        stream = MagicMock()
+        adapter.client = MagicMock()
+        adapter.client.chat.completions.create = AsyncMock(side_effect=[rate_limited, stream])
+
+        assert await adapter.generate_chat_completion(messages=[{"role": "user", "content": "Hi"}]) is stream
+        assert adapter.client.chat.completions.create.call_count == 2
+        assert adapter.retry_metrics.as_dict()["byReason"] == {"rate_limit": 1}
+
+    @pytest.mark.asyncio
+    @patch('src.adapters.openai.logger')
+    async def test_generate_chat_completion_gives_up(self, mock_logger):
+        """Test retries stop after the configured attempts and are counted."""
+        adapter = OpenAIAdapter(api_key="test-key")
+        adapter.retry_max_attempts = 2
+        adapter.retry_base_delay = 0.001
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        adapter.client = MagicMock()
+        adapter.client.chat.completions.create = AsyncMock(
+            side_effect=APIConnectionError(request=request)
+        )
+
+        with pytest.raises(APIConnectionError):
+            await adapter.generate_chat_completion(messages=[{"role": "user", "content": "Hi"}])
+        assert adapter.client.chat.completions.create.call_count == 2
+        assert adapter.retry_metrics.retries == 1
+        assert adapter.retry_metrics.exhausted == 1
+
+    @pytest.mark.asyncio
+    async def test_generate_chat_completion_continues_the_trace(self):
+        """Test a traced request sends its traceparent upstream and records each attempt."""
+        adapter = OpenAIAdapter(api_key="test-key")
+        adapter.client = MagicMock()
+        adapter.client.chat.completions.create = AsyncMock()
+        trace = Trace("0af7651916cd43dd8448eb211c80319c")
+
+        with activate(trace):
+            await adapter.generate_chat_completion(messages=[{"role": "user", "content": "Hi"}])
+
+        attempt = trace.spans[-1]
+        assert attempt.name == "upstream_attempt" and attempt.attributes == {"attempt": 1}
+        headers = adapter.client.chat.completions.create.call_args.kwargs["extra_headers"]
+        assert headers == {"traceparent": f"00-{trace.trace_id}-{attempt.span_id}-01"}
@@ -0,0 +1,104 @@
+import httpx
+import pytest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+from openai import (
+    APIConnectionError,
+    AuthenticationError,
+    BadRequestError,
+    InternalServerError,
+    RateLimitError,
+)
+
+from src.utils.retry import (
+    RetryMetrics,
+    build_retrying,
+    retry_after_seconds,
+    retry_reason,
+    wait_retry_after_or_jitter,
+)
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(error_class, status, headers=None, body=None):
+    response = httpx.Response(status, headers=headers or {}, request=REQUEST)
+    return error_class("upstream error", response=response, body=body)
+
+
+def test_retry_reason():
+    """Test retryable errors are told apart from fatal ones."""
+    assert retry_reason(_status_error(RateLimitError, 429)) == "rate_limit"
+    assert retry_reason(_status_error(InternalServerError, 503)) == "server_error"
+    assert retry_reason(APIConnectionError(request=REQUEST)) == "connection"
+    assert retry_reason(_status_error(BadRequestError, 400)) is None
+    assert retry_reason(_status_error(AuthenticationError, 401)) is None
+    assert retry_reason(ValueError("bug")) is None
+
+    quota = _status_error(RateLimitError, 429, body={"code": "insufficient_quota"})
+    assert retry_reason(quota) is None
+
+
+def test_retry_after_seconds():
+    """Test every form of Retry-After header is understood."""
+    assert retry_after_seconds(_status_error(RateLimitError, 429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(_status_error(RateLimitError, 429, {"retry-after": "3"})) == 3.0
+    later = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 < retry_after_seconds(_status_error(RateLimitError, 429, {"retry-after": later})) <= 30
+    assert retry_after_seconds(_status_error(RateLimitError, 429, {"retry-after": "soon"})) is None
+    assert retry_after_seconds(_status_error(RateLimitError, 429)) is None
+    assert retry_after_seconds(APIConnectionError(request=REQUEST)) is None
+
+
+def test_wait_prefers_retry_after_and_caps_it():
+    """Test the wait follows Retry-After up to the cap, else backs off with jitter."""
+    wait = wait_retry_after_or_jitter(base_delay=0.5, max_delay=4.0)
+    state = MagicMock(attempt_number=3)
+
+    state.outcome.exception.return_value = _status_error(RateLimitError, 429, {"retry-after": "2"})
+    assert wait(state) == 2.0
+    state.outcome.exception.return_value = _status_error(RateLimitError, 429, {"retry-after": "60"})
+    assert wait(state) == 4.0
+    state.outcome.exception.return_value = _status_error(InternalServerError, 500)
+    assert 0 <= wait(state) <= 4.0
+
+
+@pytest.mark.asyncio
+async def test_retrying_stops_on_fatal_errors_and_counts_retries():
+    """Test retryable failures are retried and counted, fatal ones are not."""
+    metrics = RetryMetrics()
+    errors = [
+        _status_error(RateLimitError, 429, {"retry-after-ms": "1"}),
+        _status_error(InternalServerError, 500, {"retry-after-ms": "1"}),
+        _status_error(BadRequestError, 400),
+    ]
+    attempts = 0
+    with pytest.raises(BadRequestError):
+        async for attempt in build_retrying(5, 0.001, 0.01, 5.0, metrics):
+            with attempt:
+                attempts += 1
+                raise errors[attempts - 1]
+
+    assert attempts == 3
+    assert metrics.as_dict() == {
+        "retries": 2,
+        "exhausted": 0,
+        "byReason": {"rate_limit": 1, "server_error": 1},
+    }
+
+
+@pytest.mark.asyncio
+async def test_retrying_respects_the_total_deadline():
+    """Test no attempt is made once the next wait would pass the deadline."""
+    metrics = RetryMetrics()
+    attempts = 0
+    with pytest.raises(RateLimitError):
+        async for attempt in build_retrying(10, 0.001, 5.0, 0.5, metrics):
+            with attempt:
+                attempts += 1
+                raise _status_error(RateLimitError, 429, {"retry-after": "1"})
+
+    assert attempts == 1
+    assert metrics.retries == 0
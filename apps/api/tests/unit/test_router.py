@@ -0,0 +1,194 @@
+import httpx
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from openai import BadRequestError, InternalServerError
+
+from src.adapters.router import NoProviderError, Provider, ProviderRouter, RoutedStream
+from src.settings import ProviderSettings, Settings
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(error_class, status):
+    response = httpx.Response(status, request=REQUEST)
+    return error_class("upstream error", response=response, body=None)
+
+
+def _provider(name, models=(), result=None, error=None):
+    adapter = MagicMock()
+    adapter.generate_chat_completion = AsyncMock(return_value=result, side_effect=error)
+    adapter.warmup = AsyncMock(return_value=True)
+    adapter.close = AsyncMock()
+    return Provider(name, adapter, models)
+
+
+class _Stream:
+    """An upstream stream yielding some chunks, then failing if asked to."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.close = AsyncMock()
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+
+def test_from_settings_defaults_to_one_provider():
+    """Test the public API or OPENAI_BASE_URL is the only provider when none are configured."""
+    router = ProviderRouter.from_settings(Settings(OPENAI_API_KEY="key"))
+    assert [provider.name for provider in router.providers] == ["default"]
+
+
+def test_from_settings_builds_one_pool_per_provider():
+    """Test each provider gets its own client and fails over instead of retrying."""
+    router = ProviderRouter.from_settings(Settings(
+        OPENAI_API_KEY="key",
+        OPENAI_PROVIDERS=[
+            ProviderSettings(name="primary", base_url="http://primary/v1", api_key="a"),
+            ProviderSettings(name="backup", base_url="http://backup/v1", api_key="b", models=["gpt-4o"]),
+        ],
+    ))
+    primary, backup = router.providers
+    assert primary.adapter.http_client is not backup.adapter.http_client
+    assert str(backup.adapter.client.base_url) == "http://backup/v1/"
+    assert primary.adapter.retry_max_attempts == 1
+    assert backup.serves("gpt-4o") and not backup.serves("gpt-4o-mini")
+
+
+def test_rank_prefers_fast_idle_healthy_providers():
+    """Test latency, load and errors all push a provider down the ranking."""
+    fast, slow, fresh = _provider("fast"), _provider("slow"), _provider("fresh")
+    router = ProviderRouter([slow, fast, fresh])
+    fast.stats.latency, slow.stats.latency = 0.1, 0.5
+    # Unmeasured providers count as fast as the fastest one, and load multiplies latency
+    fast.stats.in_flight = 1
+    assert router.rank("gpt-4o-mini") == [fresh, fast, slow]
+
+    fresh.stats.latency = 0.1
+    fresh.stats.error_rate = 0.9
+    assert router.rank("gpt-4o-mini") == [fast, slow, fresh]
+
+
+def test_rank_skips_ejected_providers_unless_all_are():
+    """Test an ejected provider only gets traffic when no other one can serve the model."""
+    first = _provider("first", models=["gpt-4o", "gpt-4o-mini"])
+    second = _provider("second", models=["gpt-4o"])
+    router = ProviderRouter([first, second])
+    with patch("src.adapters.router.time.monotonic", return_value=100.0):
+        first.stats.ejected_until = 130.0
+        assert router.rank("gpt-4o") == [second]
+        assert router.rank("gpt-4o-mini") == [first]
+    with pytest.raises(NoProviderError):
+        router.rank("o3-mini")
+
+
+@pytest.mark.asyncio
+async def test_fails_over_to_the_next_provider():
+    """Test a provider failing to open a stream hands the request to the next one."""
+    stream = _Stream([])
+    broken = _provider("broken", error=_status_error(InternalServerError, 503))
+    healthy = _provider("healthy", result=stream)
+    router = ProviderRouter([broken, healthy])
+
+    routed = await router.generate_chat_completion(messages=[], model="gpt-4o-mini")
+
+    assert isinstance(routed, RoutedStream)
+    assert routed.provider is healthy and routed.failovers == 1
+    assert broken.stats.failures == 1 and broken.stats.failovers == 1
+    assert broken.stats.in_flight == 0 and healthy.stats.in_flight == 1
+
+
+@pytest.mark.asyncio
+async def test_bad_requests_do_not_fail_over():
+    """Test an error the request caused is raised without trying another provider."""
+    invalid = _provider("first", error=_status_error(BadRequestError, 400))
+    other = _provider("second")
+    router = ProviderRouter([invalid, other])
+
+    with pytest.raises(BadRequestError):
+        await router.generate_chat_completion(messages=[], model="gpt-4o-mini")
+    other.adapter.generate_chat_completion.assert_not_called()
+    assert invalid.stats.error_rate == 0
+
+
+def test_repeated_failures_eject_a_provider():
+    """Test a provider is left out once its error rate reaches the threshold."""
+    flaky = _provider("flaky", error=_status_error(InternalServerError, 500))
+    router = ProviderRouter([flaky, _provider("other")], error_alpha=0.5, eject_error_rate=0.7)
+
+    router.record_failure(flaky)
+    assert len(router.rank("gpt-4o-mini")) == 2
+    router.record_failure(flaky)
+    assert [provider.name for provider in router.rank("gpt-4o-mini")] == ["other"]
+
+
+@pytest.mark.asyncio
+async def test_non_streamed_responses_stay_out_of_the_latency():
+    """Test a whole response is timed apart from the time to first chunk providers are ranked by."""
+    provider = _provider("only", result=MagicMock())
+    router = ProviderRouter([provider])
+    provider.stats.latency = 0.1
+
+    routed = await router.generate_chat_completion(messages=[], model="gpt-4o-mini", stream=False)
+
+    assert routed.provider is provider
+    assert provider.stats.latency == 0.1
+    assert provider.stats.response_time is not None
+    assert provider.stats.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_routed_stream_records_latency_and_outcome():
+    """Test the first chunk is the latency sample and a broken stream counts as a failure."""
+    provider = _provider("only", result=_Stream(["a", "b"]))
+    router = ProviderRouter([provider], latency_alpha=0.5)
+
+    routed = await router.generate_chat_completion(messages=[], model="gpt-4o-mini")
+    assert [chunk async for chunk in routed] == ["a", "b"]
+    assert provider.stats.latency is not None
+    assert provider.stats.in_flight == 0
+
+    provider.adapter.generate_chat_completion.return_value = _Stream(["a"], error=ConnectionResetError())
+    routed = await router.generate_chat_completion(messages=[], model="gpt-4o-mini")
+    with pytest.raises(ConnectionResetError):
+        async for _ in routed:
+            pass
+    await routed.close()
+    assert provider.stats.failures == 1
+    assert provider.stats.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_abandoned_stream_counts_its_wait():
+    """Test a stream closed before its first chunk raises a lower latency estimate."""
+    provider = _provider("slow", result=_Stream([]))
+    router = ProviderRouter([provider], latency_alpha=0.5)
+    provider.stats.latency = 1.0
+
+    with patch("src.adapters.router.time.monotonic", return_value=10.0):
+        routed = await router.generate_chat_completion(messages=[], model="gpt-4o-mini")
+    with patch("src.adapters.router.time.monotonic", return_value=13.0):
+        await routed.close()
+        await routed.close()
+
+    assert provider.stats.latency == pytest.approx(2.0)
+    assert provider.stats.in_flight == 0
+    routed._stream.close.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_warmup_and_close_reach_every_provider():
+    """Test the router warms up and closes the pool of each provider."""
+    providers = [_provider("first"), _provider("second")]
+    router = ProviderRouter(providers)
+
+    assert await router.warmup()
+    await router.close()
+    for provider in providers:
+        provider.adapter.warmup.assert_awaited_once()
+        provider.adapter.close.assert_awaited_once()
@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from src.utils.send_queue import (
+    FRAME_ERROR,
+    FRAME_RELEASE,
+    SLOW_CONSUMER_COALESCE,
+    SLOW_CONSUMER_DISCONNECT,
+    SLOW_CONSUMER_PAUSE,
+    OutboundFrame,
+    SendQueue,
+    SendQueueMetrics,
+)
+
+
+class _Socket:
+    """A socket stand-in whose writes block until it is unblocked."""
+
+    def __init__(self, blocked=False):
+        self.written = []
+        self.closed = False
+        self.ready = asyncio.Event()
+        if not blocked:
+            self.ready.set()
+
+    async def send(self, frame):
+        await self.ready.wait()
+        self.written.append((frame.request_id, frame.kind, frame.content, frame.finished))
+
+    async def close(self):
+        self.closed = True
+
+
+async def _drain(queue):
+    while queue.depth or queue._frames:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_frames_are_written_in_order():
+    """Test the writer sends frames in the order they were queued, releases included."""
+    socket = _Socket()
+    queue = SendQueue(socket.send, max_frames=4)
+    queue.start()
+    await queue.put(OutboundFrame("a", content="Hi"))
+    await queue.put(OutboundFrame("a", finished=True))
+    queue.release("a")
+    await queue.put(OutboundFrame("b", kind=FRAME_ERROR, content="Bad"))
+    await _drain(queue)
+
+    assert socket.written == [
+        ("a", "chunk", "Hi", False),
+        ("a", "chunk", "", True),
+        ("a", FRAME_RELEASE, "", False),
+        ("b", FRAME_ERROR, "Bad", False),
+    ]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_coalesces_pending_deltas():
+    """Test deltas are merged into the waiting frame of their request once the queue is full."""
+    socket = _Socket(blocked=True)
+    metrics = SendQueueMetrics()
+    queue = SendQueue(socket.send, max_frames=2, policy=SLOW_CONSUMER_COALESCE, metrics=metrics)
+    queue.start()
+    await queue.put(OutboundFrame("a", content="The"))
+    await asyncio.sleep(0)
+    for content in [" quick", " brown", " fox"]:
+        await queue.put(OutboundFrame("a", content=content))
+
+    # The writer holds "The"; " fox" joins the last waiting frame
+    assert queue.depth == 2
+    assert metrics.coalesced == 1
+
+    socket.ready.set()
+    await queue.put(OutboundFrame("a", finished=True))
+    await _drain(queue)
+    assert [content for _, _, content, _ in socket.written] == ["The", " quick", " brown fox", ""]
+    await queue.close()
+    assert metrics.queued_frames == 0 and metrics.connections == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_pauses_the_producer():
+    """Test the pause policy holds the producer until the writer makes room."""
+    socket = _Socket(blocked=True)
+    metrics = SendQueueMetrics()
+    queue = SendQueue(socket.send, max_frames=1, policy=SLOW_CONSUMER_PAUSE, metrics=metrics)
+    queue.start()
+    await queue.put(OutboundFrame("a", content="one"))
+    await asyncio.sleep(0)
+    await queue.put(OutboundFrame("a", content="two"))
+
+    producer = asyncio.create_task(queue.put(OutboundFrame("a", content="three")))
+    await asyncio.sleep(0.01)
+    assert not producer.done()
+    assert metrics.paused == 1
+
+    socket.ready.set()
+    await producer
+    await _drain(queue)
+    assert [content for _, _, content, _ in socket.written] == ["one", "two", "three"]
+    await queue.close()
+
+
+@pytest.mark.asyncio
+async def test_full_queue_disconnects_slow_consumer():
+    """Test the disconnect policy closes the connection and fails every later send."""
+    socket = _Socket(blocked=True)
+    metrics = SendQueueMetrics()
+    queue = SendQueue(
+        socket.send,
+        max_frames=1,
+        policy=SLOW_CONSUMER_DISCONNECT,
+        metrics=metrics,
+        close=socket.close
+    )
+    queue.start()
+    await queue.put(OutboundFrame("a", content="one"))
+    await asyncio.sleep(0)
+    await queue.put(OutboundFrame("a", content="two"))
+
+    with pytest.raises(WebSocketDisconnect):
+        await queue.put(OutboundFrame("a", content="three"))
+    with pytest.raises(WebSocketDisconnect):
+        await queue.put(OutboundFrame("b", content="other"))
+    await queue.close()
+
+    assert socket.closed
+    assert metrics.disconnected == 1
+    assert metrics.queued_frames == 0 and metrics.connections == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_write_closes_the_queue():
+    """Test a send that fails, e.g. on a closed socket, makes later puts raise."""
+    async def failing_send(frame):
+        raise RuntimeError("Cannot call send once a close message has been sent")
+
+    queue = SendQueue(failing_send, max_frames=4)
+    queue.start()
+    await queue.put(OutboundFrame("a", content="Hi"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(WebSocketDisconnect):
+        await queue.put(OutboundFrame("a", content="there"))
+    await queue.close()
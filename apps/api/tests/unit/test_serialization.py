@@ -0,0 +1,150 @@
+import json
+import msgpack
+import pytest
+
+from src.models.chat import ChatCompletionRequest, ChatMessage, ErrorResponse, StreamChunk
+from src.utils.serialization import (
+    JSON_SUBPROTOCOL,
+    MSGPACK_SUBPROTOCOL,
+    FrameCodec,
+    FrameDecodeError,
+    JsonCodec,
+    MsgPackCodec,
+    encode_error_response,
+    encode_stream_chunk,
+    negotiate_codec,
+)
+
+
+def _send_json_text(model):
+    """Encode a model the way starlette's send_json does."""
+    return json.dumps(model.model_dump(), separators=(",", ":"), ensure_ascii=False)
+
+
+CONTENTS = [
+    "",
+    "Hello",
+    " world!",
+    'He said "hi"\\n',
+    "line\nbreak\ttab\r",
+    "control \x00\x1f chars",
+    "naïve café – 東京 🚀",
+    "  ",
+]
+
+
+@pytest.mark.parametrize("content", CONTENTS)
+@pytest.mark.parametrize("finished", [False, True])
+def test_stream_chunk_matches_send_json(content, finished):
+    """Test the fast encoder is byte-for-byte identical to the model path."""
+    for request_id in ["123", 'id-"quoted"', "ünïcode-id"]:
+        expected = _send_json_text(
+            StreamChunk(request_id=request_id, content=content, finished=finished)
+        )
+        assert encode_stream_chunk(request_id, content, finished) == expected
+
+
+def test_stream_chunk_with_metrics_matches_send_json():
+    """Test chunks carrying metrics encode identically."""
+    metrics = {"responseTime": 120, "length": 42, "tokens": 10, "status": "completed"}
+    expected = _send_json_text(
+        StreamChunk(request_id="123", content="", finished=True, metrics=metrics)
+    )
+    assert encode_stream_chunk("123", "", True, metrics) == expected
+
+
+@pytest.mark.parametrize("error", ["Invalid JSON format", 'bad "value"\n', "ошибка"])
+def test_error_response_matches_send_json(error):
+    """Test error frames encode identically."""
+    expected = _send_json_text(ErrorResponse(request_id="123", error=error))
+    assert encode_error_response("123", error) == expected
+
+
+def test_error_response_with_retry_hint_matches_send_json():
+    """Test the retry hint of a rejected request encodes identically."""
+    expected = _send_json_text(ErrorResponse(request_id="123", error="Slow down", retry_after=1.5))
+    assert encode_error_response("123", "Slow down", 1.5) == expected
+
+
+@pytest.mark.parametrize("offered, expected_type, expected_subprotocol", [
+    ([], JsonCodec, None),
+    (["unknown"], JsonCodec, None),
+    ([JSON_SUBPROTOCOL], JsonCodec, JSON_SUBPROTOCOL),
+    ([MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL], MsgPackCodec, MSGPACK_SUBPROTOCOL),
+    ([JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL], JsonCodec, JSON_SUBPROTOCOL),
+])
+def test_negotiate_codec(offered, expected_type, expected_subprotocol):
+    """Test the client's first supported subprotocol wins, JSON otherwise."""
+    codec = negotiate_codec(offered)
+    assert isinstance(codec, expected_type)
+    assert codec.subprotocol == expected_subprotocol
+
+
+@pytest.mark.parametrize("codec_type", [JsonCodec, MsgPackCodec])
+def test_codecs_round_trip(codec_type):
+    """Test requests, chunks and errors survive both formats."""
+    server, client = codec_type(), codec_type()
+    request = ChatCompletionRequest(
+        request_id="123",
+        messages=[ChatMessage(role="user", content="Héllo")],
+        max_tokens=10
+    )
+    assert ChatCompletionRequest(**server.decode(client.encode_request(request))) == request
+
+    metrics = {"responseTime": 10, "length": 5}
+    frames = [
+        server.encode_chunk("123", "Hé", False),
+        server.encode_chunk("456", "Other", False),
+        server.encode_chunk("123", "llo", False),
+        server.encode_chunk("123", "", True, metrics),
+        server.encode_error("789", "Something went wrong"),
+        server.encode_error("790", "Slow down", 0.25),
+    ]
+    assert [client.decode_frame(frame) for frame in frames] == [
+        StreamChunk(request_id="123", content="Hé", finished=False),
+        StreamChunk(request_id="456", content="Other", finished=False),
+        StreamChunk(request_id="123", content="llo", finished=False),
+        StreamChunk(request_id="123", content="", finished=True, metrics=metrics),
+        ErrorResponse(request_id="789", error="Something went wrong"),
+        ErrorResponse(request_id="790", error="Slow down", retry_after=0.25),
+    ]
+
+
+def test_msgpack_stream_ids():
+    """Test the request_id is only sent on the first frame of each stream."""
+    codec = MsgPackCodec()
+    first = msgpack.unpackb(codec.encode_chunk("request-a", "Hi", False))
+    second = msgpack.unpackb(codec.encode_chunk("request-a", " there", False))
+    other = msgpack.unpackb(codec.encode_chunk("request-b", "Yo", False))
+    final = msgpack.unpackb(codec.encode_chunk("request-a", "", True, {"length": 8}))
+
+    assert first == [1, 1, "Hi", "request-a"]
+    assert second == [1, 1, " there"]
+    assert other == [1, 2, "Yo", "request-b"]
+    assert final == [2, 1, "", {"length": 8}]
+
+    # A finished stream's id is released; a request that only sends a final chunk binds inline
+    assert msgpack.unpackb(codec.encode_chunk("request-c", "", True)) == [2, 3, "", None, "request-c"]
+    assert len(codec.encode_chunk("request-a", "x", False)) < len(
+        json.dumps({"request_id": "request-a", "content": "x", "finished": False, "metrics": None})
+    )
+
+
+def test_decode_errors():
+    """Test undecodable frames raise FrameDecodeError with a client-facing message."""
+    with pytest.raises(FrameDecodeError, match="Invalid JSON format"):
+        JsonCodec().decode("{invalid json}")
+    with pytest.raises(FrameDecodeError, match="Invalid MessagePack format"):
+        MsgPackCodec().decode(b"\xc1")
+    with pytest.raises(FrameDecodeError, match="expected a binary frame"):
+        MsgPackCodec().decode("{}")
+
+
+def test_codec_missing_a_method_cannot_be_built():
+    """Test a codec must implement every frame method to be instantiated."""
+    class PartialCodec(FrameCodec):
+        def decode(self, data):
+            return data
+
+    with pytest.raises(TypeError):
+        PartialCodec()
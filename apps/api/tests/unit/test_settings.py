@@ -43,6 +43,20 @@ def test_settings_validation():
             OPENAI_API_KEY="key"
         )
 
+@pytest.mark.parametrize("name", [
+    "ADMISSION_REQUESTS_PER_SECOND", "ADMISSION_REQUEST_BURST", "ADMISSION_TOKENS_PER_MINUTE"
+])
+def test_admission_rates_must_be_positive(name):
+    """Test a zero admission rate is rejected instead of dividing by zero later."""
+    with pytest.raises(ValueError):
+        Settings(
+            API_NAME="Test",
+            API_VERSION="1.0",
+            API_DESCRIPTION="Test",
+            OPENAI_API_KEY="key",
+            **{name: 0}
+        )
+
 def test_settings_singleton():
     """Test the settings singleton instance."""
     from src.settings import settings
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import patch
+
+from src.utils.shared_state import (
+    BucketCharge,
+    LocalSharedState,
+    SQLiteSharedState,
+    TokenBucket,
+)
+
+# One request per second with a burst of two
+REQUESTS = BucketCharge(rate=1.0, capacity=2, amount=1)
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two backends on one database file, like two workers of a host."""
+    path = str(tmp_path / "shared_state.db")
+    states = [SQLiteSharedState(path), SQLiteSharedState(path)]
+    for state in states:
+        state.open()
+    yield states
+    for state in states:
+        state.close()
+
+
+def test_token_bucket_refills_over_time():
+    """Test a bucket starts full, empties and refills at its rate."""
+    bucket = TokenBucket(rate=2.0, capacity=4, now=0.0)
+    assert bucket.wait_time(4, now=0.0) == 0.0
+    bucket.consume(4)
+
+    assert bucket.wait_time(1, now=0.0) == pytest.approx(0.5)
+    assert bucket.wait_time(1, now=0.5) == 0.0
+    # Amounts above the capacity only need a full bucket
+    assert bucket.wait_time(100, now=0.5) == pytest.approx(1.5)
+
+
+@pytest.mark.asyncio
+async def test_local_charge_takes_all_buckets_or_none():
+    """Test a charge that does not fit one bucket leaves the others untouched."""
+    state = LocalSharedState(max_keys=10)
+    tokens = BucketCharge(rate=1.0, capacity=10, amount=8)
+    with patch("src.utils.shared_state.time.monotonic", return_value=0.0):
+        assert await state.charge("client", (REQUESTS, tokens)) == 0
+        assert await state.charge("client", (REQUESTS, tokens)) == pytest.approx(6.0)
+        # The request bucket was not charged by the rejected request
+        assert await state.charge("client", (REQUESTS, tokens._replace(amount=1))) == 0
+
+
+@pytest.mark.asyncio
+async def test_sqlite_buckets_are_shared_by_workers(workers):
+    """Test a client's burst is spent across workers, not per worker."""
+    first, second = workers
+    with patch("src.utils.shared_state.time.time", return_value=100.0):
+        assert await first.charge("client", (REQUESTS,)) == 0
+        assert await second.charge("client", (REQUESTS,)) == 0
+        assert await first.charge("client", (REQUESTS,)) == pytest.approx(1.0)
+        assert await second.charge("other", (REQUESTS,)) == 0
+    with patch("src.utils.shared_state.time.time", return_value=101.0):
+        assert await second.charge("client", (REQUESTS,)) == 0
+
+
+@pytest.mark.asyncio
+async def test_sqlite_purges_refilled_buckets(workers, monkeypatch):
+    """Test rows of buckets that are full again are deleted."""
+    state = workers[0]
+    monkeypatch.setattr("src.utils.shared_state.PURGE_INTERVAL", 2)
+    with patch("src.utils.shared_state.time.time", return_value=0.0):
+        await state.charge("idle", (REQUESTS,))
+    with patch("src.utils.shared_state.time.time", return_value=10.0):
+        await state.charge("busy", (REQUESTS,))
+    keys = [row[0] for row in state._connection.execute("SELECT key FROM rate_buckets")]
+    assert keys == ["busy"]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_streams_are_counted_on_the_host(workers):
+    """Test streams of every worker count towards the host limit."""
+    first, second = workers
+    stream = await first.register_stream(limit=2)
+    assert await second.register_stream(limit=2) is not None
+    assert await second.active_streams() == 2
+    assert await first.register_stream(limit=2) is None
+
+    await first.unregister_stream(stream)
+    assert await first.register_stream(limit=2) is not None
+
+
+def test_sqlite_drops_streams_of_dead_workers(tmp_path):
+    """Test a worker opening the database forgets streams of processes that are gone."""
+    path = str(tmp_path / "shared_state.db")
+    crashed = SQLiteSharedState(path)
+    crashed.open()
+    crashed._connection.execute(
+        "INSERT INTO active_streams (id, pid, started) VALUES ('orphan', 2147483647, 0)"
+    )
+
+    restarted = SQLiteSharedState(path)
+    restarted.open()
+    assert restarted._count_streams() == 0
+    restarted.close()
+    crashed._connection.close()
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+
+from src.utils.single_flight import SingleFlightGroup
+
+
+class _Upstream:
+    """A controllable upstream that yields deltas as they are released."""
+
+    def __init__(self):
+        self.opened = 0
+        self.closed = False
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def open(self):
+        self.opened += 1
+        return self._deltas()
+
+    async def _deltas(self):
+        try:
+            while True:
+                item = await self.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.closed = True
+
+
+async def _collect(subscription):
+    return [delta async for delta in subscription]
+
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_upstream():
+    """Test a late subscriber gets the deltas already produced plus the live tail."""
+    group = SingleFlightGroup()
+    upstream = _Upstream()
+
+    first = group.subscribe("key", upstream.open)
+    upstream.queue.put_nowait("Hel")
+    assert await first.__anext__() == "Hel"
+
+    late = asyncio.create_task(_collect(group.subscribe("key", upstream.open)))
+    upstream.queue.put_nowait("lo")
+    upstream.queue.put_nowait(None)
+
+    assert [delta async for delta in first] == ["lo"]
+    assert await late == ["Hel", "lo"]
+    assert upstream.opened == 1
+    assert group.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_cancelled_only_when_last_subscriber_leaves():
+    """Test leaving subscribers keep the upstream alive until the last one goes."""
+    group = SingleFlightGroup()
+    upstream = _Upstream()
+
+    first = group.subscribe("key", upstream.open)
+    second = group.subscribe("key", upstream.open)
+    upstream.queue.put_nowait("a")
+    assert await first.__anext__() == "a"
+    assert await second.__anext__() == "a"
+
+    await first.aclose()
+    await asyncio.sleep(0)
+    assert not upstream.closed
+    assert group.in_flight() == 1
+
+    await second.aclose()
+    await asyncio.sleep(0.01)
+    assert upstream.closed
+    assert group.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_subscriber_leaves_the_flight():
+    """Test a subscriber cancelled while waiting unsubscribes cleanly."""
+    group = SingleFlightGroup()
+    upstream = _Upstream()
+
+    waiting = asyncio.create_task(_collect(group.subscribe("key", upstream.open)))
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    await asyncio.sleep(0.01)
+
+    assert upstream.closed
+    assert group.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_upstream_error_reaches_every_subscriber():
+    """Test an upstream failure is raised to all subscribers."""
+    group = SingleFlightGroup()
+    upstream = _Upstream()
+
+    first = asyncio.create_task(_collect(group.subscribe("key", upstream.open)))
+    second = asyncio.create_task(_collect(group.subscribe("key", upstream.open)))
+    await asyncio.sleep(0.01)
+    upstream.queue.put_nowait(RuntimeError("upstream failed"))
+
+    for task in (first, second):
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            await task
+    assert upstream.opened == 1
+
+
+@pytest.mark.asyncio
+async def test_new_flight_after_completion():
+    """Test a request arriving after a flight ended opens a new upstream."""
+    group = SingleFlightGroup()
+    upstream = _Upstream()
+
+    upstream.queue.put_nowait("a")
+    upstream.queue.put_nowait(None)
+    assert await _collect(group.subscribe("key", upstream.open)) == ["a"]
+
+    upstream.queue.put_nowait("b")
+    upstream.queue.put_nowait(None)
+    assert await _collect(group.subscribe("key", upstream.open)) == ["b"]
+    assert upstream.opened == 2
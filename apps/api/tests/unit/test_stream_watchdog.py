@@ -0,0 +1,127 @@
+import asyncio
+import pytest
+
+from src.utils.stream_watchdog import StreamStalled, watch_deltas
+
+
+class _Upstream:
+    """An upstream stand-in that sleeps whenever a float is found in its items."""
+
+    def __init__(self, items):
+        self.items = items
+        self.started = False
+        self.closed = False
+
+    async def deltas(self):
+        self.started = True
+        try:
+            for item in self.items:
+                if isinstance(item, float):
+                    await asyncio.sleep(item)
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            self.closed = True
+
+
+async def _collect(deltas):
+    return [delta async for delta in deltas]
+
+
+@pytest.mark.asyncio
+async def test_fast_stream_passes_through():
+    """Test a stream within both deadlines is unchanged and never hedged."""
+    hedges = []
+    upstream = _Upstream(["a", "b", "c"])
+    deltas = watch_deltas(upstream.deltas(), 0.5, 0.5, lambda: hedges.append(1))
+
+    assert await _collect(deltas) == ["a", "b", "c"]
+    assert hedges == []
+    assert upstream.closed
+
+
+@pytest.mark.asyncio
+async def test_late_first_token_is_hedged_and_loser_cancelled():
+    """Test the hedge wins when the primary is slower, and the primary is closed."""
+    primary = _Upstream([1.0, "slow"])
+    hedge = _Upstream(["fast", " answer"])
+
+    deltas = watch_deltas(primary.deltas(), 0.05, 0.5, hedge.deltas)
+
+    assert await _collect(deltas) == ["fast", " answer"]
+    assert primary.closed
+    assert hedge.closed
+
+
+@pytest.mark.asyncio
+async def test_primary_can_still_win_after_hedging():
+    """Test the primary keeps its chance once the hedge has started."""
+    primary = _Upstream([0.08, "primary"])
+    hedge = _Upstream([1.0, "hedge"])
+
+    deltas = watch_deltas(primary.deltas(), 0.05, 0.5, hedge.deltas)
+
+    assert await _collect(deltas) == ["primary"]
+    assert hedge.closed
+
+
+@pytest.mark.asyncio
+async def test_failed_attempt_leaves_the_other_racing():
+    """Test a hedge that fails does not end a primary that is merely slow."""
+    primary = _Upstream([0.07, "primary"])
+    hedge = _Upstream([RuntimeError("hedge failed")])
+
+    deltas = watch_deltas(primary.deltas(), 0.05, 0.5, hedge.deltas)
+
+    assert await _collect(deltas) == ["primary"]
+
+
+@pytest.mark.asyncio
+async def test_first_token_deadline_without_hedging():
+    """Test a missing first token raises a clear error when hedging is off."""
+    upstream = _Upstream([1.0, "late"])
+
+    with pytest.raises(StreamStalled, match="first token"):
+        await _collect(watch_deltas(upstream.deltas(), 0.05, 0.5))
+    assert upstream.closed
+
+
+@pytest.mark.asyncio
+async def test_stall_after_tokens_raises():
+    """Test a gap between tokens longer than the deadline raises StreamStalled."""
+    upstream = _Upstream(["a", 1.0, "b"])
+    received = []
+
+    with pytest.raises(StreamStalled, match="stalled"):
+        async for delta in watch_deltas(upstream.deltas(), 0.5, 0.05):
+            received.append(delta)
+    assert received == ["a"]
+    assert upstream.closed
+
+
+@pytest.mark.asyncio
+async def test_zero_deadlines_wait_forever():
+    """Test deadlines of 0 disable the watchdog."""
+    upstream = _Upstream([0.02, "a", 0.02, "b"])
+    assert await _collect(watch_deltas(upstream.deltas(), 0, 0)) == ["a", "b"]
+
+
+@pytest.mark.asyncio
+async def test_closing_early_cancels_every_attempt():
+    """Test closing the watched stream while racing closes both upstreams."""
+    primary = _Upstream([1.0, "slow"])
+    hedge = _Upstream([1.0, "slower"])
+    deltas = watch_deltas(primary.deltas(), 0.05, 0.5, hedge.deltas)
+
+    task = asyncio.ensure_future(deltas.__anext__())
+    # Cancel once both race, whatever pauses the loop before the hedge starts
+    while not hedge.started:
+        await asyncio.sleep(0.005)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert primary.closed
+    assert hedge.closed
@@ -0,0 +1,135 @@
+import pytest
+from unittest.mock import patch
+
+from src.utils.token_budget import (
+    TOKENS_PER_MESSAGE,
+    TOKENS_PER_REPLY,
+    ContextWindow,
+    ContextWindowExceeded,
+    TokenBudget,
+    estimate_tokens,
+    strip_pins,
+)
+
+SMALL_WINDOW = {"tiny": ContextWindow(context_tokens=100, max_output_tokens=20)}
+
+
+def _budget(**overrides):
+    options = {"reserved_completion_tokens": 10, "cache_size": 100, "offload_chars": 10000}
+    options.update(overrides)
+    return TokenBudget(**options)
+
+
+def _message(role, words, pinned=False):
+    message = {"role": role, "content": " ".join(["word"] * words)}
+    if pinned:
+        message["pinned"] = True
+    return message
+
+
+def test_estimate_tokens():
+    """Test the local estimate is close to real tokenizer counts."""
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("Hello world") == 2
+    assert estimate_tokens("Hello, world!") == 4
+    assert estimate_tokens("12345") == 2
+    assert estimate_tokens("日本語") == 3
+    assert estimate_tokens("a" * 80) == 10
+
+
+def test_count_message_is_memoized():
+    """Test a message is only measured once, whatever dict carries it."""
+    budget = _budget()
+    message = {"role": "user", "content": "Hello world"}
+    with patch("src.utils.token_budget.estimate_tokens", wraps=estimate_tokens) as estimate:
+        assert budget.count_message(message) == TOKENS_PER_MESSAGE + 1 + 2
+        assert budget.count_message(dict(message)) == TOKENS_PER_MESSAGE + 1 + 2
+    assert estimate.call_count == 2
+
+
+def test_count_cache_is_bounded():
+    """Test the memo evicts the least recently used counts."""
+    budget = _budget(cache_size=2)
+    for content in ["a", "b", "c"]:
+        budget.count_message({"role": "user", "content": content})
+    assert list(budget._counts) == [("user", "b"), ("user", "c")]
+
+
+@patch("src.utils.token_budget.MODEL_CONTEXT_WINDOWS", SMALL_WINDOW)
+def test_fitting_history_is_unchanged():
+    """Test a request that fits keeps every message and its max_tokens."""
+    messages = [_message("system", 5), _message("user", 5)]
+    fitted = _budget().fit_messages(messages, "tiny", max_tokens=15)
+
+    assert fitted.messages == messages
+    assert fitted.max_tokens == 15
+    assert fitted.dropped == 0
+    assert fitted.prompt_tokens == 2 * (TOKENS_PER_MESSAGE + 1 + 5) + TOKENS_PER_REPLY
+
+
+@patch("src.utils.token_budget.MODEL_CONTEXT_WINDOWS", SMALL_WINDOW)
+def test_oldest_messages_are_dropped_first():
+    """Test truncation drops the oldest messages but keeps system, pinned and latest."""
+    messages = [
+        _message("system", 5),
+        _message("user", 20),
+        _message("assistant", 5, pinned=True),
+        _message("user", 20),
+        _message("assistant", 20),
+        _message("user", 5),
+    ]
+    fitted = _budget(reserved_completion_tokens=30).fit_messages(messages, "tiny")
+
+    assert fitted.messages == [
+        {"role": "system", "content": messages[0]["content"]},
+        {"role": "assistant", "content": messages[2]["content"]},
+        messages[4],
+        messages[5],
+    ]
+    assert fitted.dropped == 2
+    assert fitted.prompt_tokens <= 100 - 30
+
+
+@patch("src.utils.token_budget.MODEL_CONTEXT_WINDOWS", SMALL_WINDOW)
+def test_max_tokens_is_fitted_to_remaining_context():
+    """Test max_tokens is clamped to the model limit and to the room left."""
+    budget = _budget()
+    assert budget.fit_messages([_message("user", 5)], "tiny", max_tokens=500).max_tokens == 20
+
+    messages = [_message("system", 80), _message("user", 5)]
+    fitted = budget.fit_messages(messages, "tiny", max_tokens=20)
+    assert fitted.max_tokens == 100 - fitted.prompt_tokens
+
+
+@patch("src.utils.token_budget.MODEL_CONTEXT_WINDOWS", SMALL_WINDOW)
+def test_messages_that_must_stay_can_overflow():
+    """Test an error is raised when kept messages alone exceed the context."""
+    with pytest.raises(ContextWindowExceeded):
+        _budget().fit_messages([_message("system", 90), _message("user", 10)], "tiny")
+
+
+def test_unknown_model_is_not_fitted():
+    """Test requests for models without known limits are passed through."""
+    messages = [_message("user", 5, pinned=True)]
+    fitted = _budget().fit_messages(messages, "unknown-model", max_tokens=100000)
+    assert fitted.messages == strip_pins(messages)
+    assert fitted.max_tokens == 100000
+
+
+@pytest.mark.asyncio
+async def test_large_histories_are_fitted_off_the_event_loop():
+    """Test fitting runs in a worker thread above the offload threshold."""
+    budget = _budget(offload_chars=10)
+    messages = [_message("user", 5)]
+    with patch("src.utils.token_budget.asyncio.to_thread", wraps=__import__("asyncio").to_thread) as to_thread:
+        await budget.fit(messages, "gpt-4o-mini")
+        assert to_thread.call_count == 1
+        await _budget().fit(messages, "gpt-4o-mini")
+        assert to_thread.call_count == 1
+
+
+def test_strip_pins():
+    """Test pinned markers are removed and unpinned lists are returned as is."""
+    plain = [{"role": "user", "content": "Hi"}]
+    assert strip_pins(plain) is plain
+    assert strip_pins([{"role": "user", "content": "Hi", "pinned": True}]) == plain
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import time
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from src.handlers.websocket import WebSocketHandler
+from src.utils.tracing import (
+    FileTraceExporter,
+    MemoryTraceExporter,
+    Trace,
+    Tracer,
+    activate,
+    current_traceparent,
+    record_span,
+    span,
+    trace_context_from_headers,
+)
+
+
+def _names(node):
+    return [node["name"]] + [name for child in node.get("children", []) for name in _names(child)]
+
+
+def _find(node, name):
+    if node["name"] == name:
+        return node
+    for child in node.get("children", []):
+        found = _find(child, name)
+        if found is not None:
+            return found
+    return None
+
+
+def test_sampling_follows_the_caller_and_the_sample_rate():
+    """Test a traceparent's decision is followed and every other request is sampled by rate."""
+    exporter = MemoryTraceExporter(max_traces=10)
+    assert Tracer(exporter, sample_rate=0).start_trace() is None
+    assert Tracer(exporter, sample_rate=0).start_trace("client-trace") is None
+    assert Tracer(exporter, sample_rate=1).start_trace("client-trace").trace_id == "client-trace"
+    assert Tracer(exporter, sample_rate=0).start_trace("client-trace", sampled=True) is not None
+    assert Tracer(exporter, sample_rate=1).start_trace("client-trace", sampled=False) is None
+
+    trace = Tracer(exporter, sample_rate=1).start_trace(request_id="abc")
+    assert len(trace.trace_id) == 32
+    assert trace.root.attributes == {"request_id": "abc"}
+
+
+@pytest.mark.asyncio
+async def test_spans_nest_under_the_current_span():
+    """Test spans form a tree across awaits and record the errors that end them."""
+    trace = Trace("0af7651916cd43dd8448eb211c80319c")
+
+    async def connect():
+        with span("attempt", attempt=1):
+            await asyncio.sleep(0)
+
+    with span("outside") as untraced:
+        assert untraced is None
+    with activate(trace):
+        with span("completion"):
+            with span("connect") as connecting:
+                await connect()
+                assert current_traceparent() == f"00-{trace.trace_id}-{connecting.span_id}-01"
+            record_span("first_token", time.monotonic() - 0.01, tokens=1)
+        with pytest.raises(ValueError):
+            with span("cache_store"):
+                raise ValueError("disk full")
+    trace.root.finish()
+
+    tree = trace.as_dict()
+    assert _names(tree["root"]) == ["request", "completion", "connect", "attempt", "first_token", "cache_store"]
+    assert _find(tree["root"], "attempt")["attributes"] == {"attempt": 1}
+    assert _find(tree["root"], "first_token")["duration_ms"] >= 10
+    assert _find(tree["root"], "cache_store")["attributes"] == {"error": "ValueError"}
+    assert Trace("client-trace").traceparent(trace.root) is None
+
+
+def test_traceparent_header_gives_the_trace_id_and_sampled_flag():
+    """Test only well-formed W3C traceparent headers are honoured."""
+    trace_id = "0af7651916cd43dd8448eb211c80319c"
+    header = "00-0AF7651916CD43DD8448EB211C80319C-b7ad6b7169203331-01"
+    assert trace_context_from_headers({"traceparent": header}) == (trace_id, True)
+    header = f"00-{trace_id}-b7ad6b7169203331-00"
+    assert trace_context_from_headers({"traceparent": header}) == (trace_id, False)
+    assert trace_context_from_headers({"traceparent": "not-a-trace"}) is None
+    assert trace_context_from_headers({}) is None
+
+
+def test_memory_exporter_keeps_the_most_recent_traces():
+    """Test the ring buffer drops its oldest traces and lists the newest first."""
+    exporter = MemoryTraceExporter(max_traces=2)
+    for trace_id in ("a", "b", "c"):
+        exporter.export(Trace(trace_id))
+
+    assert exporter.get("a") is None
+    assert [trace.trace_id for trace in exporter.recent(10)] == ["c", "b"]
+
+    # A request reusing the id of another does not replace its trace
+    kept = exporter.get("c")
+    exporter.export(Trace("c"))
+    assert exporter.get("c") is kept and exporter.duplicates == 1
+
+
+def test_file_exporter_writes_rotating_json_lines(tmp_path):
+    """Test traces are appended as JSON lines and the file rotates past its size."""
+    path = tmp_path / "traces.jsonl"
+    exporter = FileTraceExporter(str(path), max_bytes=400, backups=1)
+    for index in range(6):
+        trace = Trace(f"trace-{index}")
+        trace.root.finish()
+        exporter.export(trace)
+    exporter.close()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert lines and lines[-1]["trace_id"] == "trace-5"
+    assert (tmp_path / "traces.jsonl.1").exists()
+
+
+def test_file_exporter_creates_its_directory(tmp_path):
+    """Test traces are written when the directory of the file does not exist yet."""
+    path = tmp_path / "cache" / "nested" / "traces.jsonl"
+    exporter = FileTraceExporter(str(path), max_bytes=1000, backups=1)
+    trace = Trace("trace-0")
+    trace.root.finish()
+    exporter.export(trace)
+    exporter.close()
+
+    assert json.loads(path.read_text())["trace_id"] == "trace-0"
+
+
+@pytest.mark.asyncio
+async def test_handler_traces_every_stage_of_a_request():
+    """Test a request with a trace id gets spans from parsing to the final chunk."""
+    async def chunks():
+        for content in ("Hello", " world"):
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = content
+            yield chunk
+
+    adapter = MagicMock()
+    adapter.generate_chat_completion = AsyncMock(return_value=chunks())
+    exporter = MemoryTraceExporter(max_traces=10)
+    handler = WebSocketHandler(adapter, tracer=Tracer(exporter, sample_rate=1))
+    websocket = MagicMock()
+    websocket.send_text = AsyncMock()
+
+    await handler.process_message(websocket, json.dumps({
+        "request_id": "traced",
+        "trace_id": "debug-1",
+        "messages": [{"role": "user", "content": "Hi"}]
+    }))
+    handler.tracer.sample_rate = 0
+    await handler.process_message(websocket, json.dumps({
+        "request_id": "untraced",
+        "messages": [{"role": "user", "content": "Hi"}]
+    }))
+
+    assert [trace.trace_id for trace in exporter.recent(10)] == ["debug-1"]
+    tree = exporter.get("debug-1").as_dict()
+    names = _names(tree["root"])
+    for stage in ("decode", "validate", "completion", "history", "fit_context", "upstream_connect",
+                  "first_token", "stream", "send", "final_chunk"):
+        assert stage in names
+    assert tree["root"]["attributes"]["status"] == "completed"
+    assert _find(tree["root"], "stream")["attributes"] == {"tokens": 2}
+
+    final_frames = [json.loads(call[0][0]) for call in websocket.send_text.call_args_list]
+    final_frames = [frame for frame in final_frames if frame["finished"]]
+    assert final_frames[0]["metrics"]["traceId"] == "debug-1"
+    assert "traceId" not in final_frames[1]["metrics"]
@@ -1,9 +1,16 @@
+import asyncio
 import json
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 
-from src.handlers.websocket import WebSocketHandler
-from src.models.chat import ChatCompletionRequest, ChatMessage, StreamChunk
+from src.handlers.websocket import StreamProgress, WebSocketHandler
+from src.utils.admission import AdmissionController
+from src.utils.completion_cache import CompletionCache
+from src.utils.conversation_store import ConversationStore
+from src.utils.send_queue import SendQueueMetrics
+from src.utils.single_flight import SingleFlightGroup
+from src.utils.token_budget import TokenBudget
+from src.models.chat import ChatCompletionRequest, ChatMessage, CoalesceOptions, StreamChunk, StreamMetrics
 
 
 class TestWebSocketHandler:
@@ -11,10 +18,18 @@ class TestWebSocketHandler:
     
     def setup_method(self):
         """Set up test fixtures."""
-        self.mock_openai_adapter = MagicMock()
-        self.handler = WebSocketHandler(self.mock_openai_adapter)
+        self.mock_router = MagicMock()
+        self.handler = WebSocketHandler(self.mock_router)
         self.mock_websocket = MagicMock()
-        self.mock_websocket.send_json = AsyncMock()
+        self.mock_websocket.send_text = AsyncMock()
+
+    def _sent_frames(self):
+        """Decode every frame sent to the mock WebSocket."""
+        return [json.loads(call[0][0]) for call in self.mock_websocket.send_text.call_args_list]
+
+    def _last_frame(self):
+        """Decode the last frame sent to the mock WebSocket."""
+        return json.loads(self.mock_websocket.send_text.call_args[0][0])
     
     @pytest.mark.asyncio
     async def test_send_chunk(self):
@@ -27,16 +42,18 @@ class TestWebSocketHandler:
             finished=False
         )
         
-        # Verify that send_json was called correctly
+        # Verify the frame matches what send_text would have sent for the model
         expected_data = StreamChunk(
             request_id="123",
             content="Hello",
             finished=False
         ).model_dump()
-        self.mock_websocket.send_json.assert_called_once_with(expected_data)
+        self.mock_websocket.send_text.assert_called_once_with(
+            json.dumps(expected_data, separators=(",", ":"), ensure_ascii=False)
+        )
         
         # Reset the mock and test with metrics
-        self.mock_websocket.send_json.reset_mock()
+        self.mock_websocket.send_text.reset_mock()
         metrics = {"responseTime": 200, "length": 5}
         
         await self.handler.send_chunk(
@@ -53,7 +70,9 @@ class TestWebSocketHandler:
             finished=True,
             metrics=metrics
         ).model_dump()
-        self.mock_websocket.send_json.assert_called_once_with(expected_data)
+        self.mock_websocket.send_text.assert_called_once_with(
+            json.dumps(expected_data, separators=(",", ":"), ensure_ascii=False)
+        )
 
     @pytest.mark.asyncio
     async def test_handle_error(self):
@@ -63,27 +82,48 @@ class TestWebSocketHandler:
         
         await self.handler.handle_error(self.mock_websocket, request_data, error)
         
-        # Check that send_json was called with the correct error response
-        self.mock_websocket.send_json.assert_called_once()
-        called_arg = self.mock_websocket.send_json.call_args[0][0]
+        # Check that the correct error response was sent
+        self.mock_websocket.send_text.assert_called_once()
+        called_arg = self._last_frame()
         assert called_arg["request_id"] == "123"
         assert called_arg["error"] == "Test error"
         
         # Test with missing request_id
-        self.mock_websocket.send_json.reset_mock()
+        self.mock_websocket.send_text.reset_mock()
         await self.handler.handle_error(self.mock_websocket, {}, error)
         
-        called_arg = self.mock_websocket.send_json.call_args[0][0]
+        called_arg = self._last_frame()
         assert called_arg["request_id"] == "unknown"
 
     def test_prepare_metrics(self):
         """Test the _prepare_metrics method."""
-        start_time = 1000.0  # Mock timestamp
-        with patch('time.time', return_value=1001.0):  # 1 second later
-            metrics = self.handler._prepare_metrics(start_time, 100)
+        progress = StreamProgress(
+            started_at=1000.0,  # Mock monotonic timestamps
+            queue_wait=0.05,
+            connect_time=0.2,
+            first_token_at=1000.4,
+            gaps=[0.01 * i for i in range(1, 21)],
+            prompt_tokens=12,
+            completion_tokens=20
+        )
+        with patch('time.monotonic', return_value=1001.0):  # 1 second later
+            metrics = self.handler._prepare_metrics(progress, 100)
             
             assert metrics["responseTime"] == 1000  # 1 second = 1000ms
             assert metrics["length"] == 100
+            assert metrics["queueWait"] == 50.0
+            assert metrics["connectTime"] == 200.0
+            assert metrics["timeToFirstToken"] == 400.0
+            assert metrics["meanChunkGap"] == 105.0
+            assert metrics["p95ChunkGap"] == 190.0
+            assert metrics["promptTokens"] == 12
+            assert metrics["completionTokens"] == 20
+            assert StreamMetrics.model_validate(metrics).response_time == 1000
+
+    def test_prepare_metrics_leaves_out_unmeasured_fields(self):
+        """Test timings that were never measured are not sent."""
+        metrics = self.handler._prepare_metrics(StreamProgress(cached=True), 0, status="cancelled")
+        assert set(metrics) == {"responseTime", "length", "tokens", "status", "cached"}
 
     def test_format_messages_for_openai(self):
         """Test the _format_messages_for_openai method."""
@@ -127,14 +167,14 @@ class TestWebSocketHandler:
         assert content == "Hello World"
         
         # The send_chunk should have been called twice (once for each non-empty chunk)
-        assert self.mock_websocket.send_json.call_count == 2
+        assert self.mock_websocket.send_text.call_count == 2
 
     @pytest.mark.asyncio
     async def test_handle_chat_completion(self):
         """Test the handle_chat_completion method."""
         # Mock the OpenAI adapter
         mock_stream = AsyncMock()
-        self.mock_openai_adapter.generate_chat_completion = AsyncMock(return_value=mock_stream)
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=mock_stream)
         
         # Mock the _process_stream method
         with patch.object(self.handler, '_process_stream', AsyncMock(return_value="Generated content")) as mock_process:
@@ -153,14 +193,13 @@ class TestWebSocketHandler:
             assert result == "Generated content"
             
             # Verify the adapter was called correctly
-            self.mock_openai_adapter.generate_chat_completion.assert_called_once()
+            self.mock_router.generate_chat_completion.assert_called_once()
             
             # Verify _process_stream was called
             mock_process.assert_called_once()
             
             # Verify a final chunk was sent with metrics
-            last_call = self.mock_websocket.send_json.call_args_list[-1]
-            last_chunk = last_call[0][0]
+            last_chunk = self._last_frame()
             assert last_chunk["request_id"] == "123"
             assert last_chunk["finished"] is True
             assert "responseTime" in last_chunk["metrics"]
@@ -208,4 +247,553 @@ class TestWebSocketHandler:
         await self.handler.process_message(self.mock_websocket, '{"model": "gpt-4"}')
         
         # Verify handle_error was called
-        self.handler.handle_error.assert_called_once() 
\ No newline at end of file
+        self.handler.handle_error.assert_called_once() 
+    @pytest.mark.asyncio
+    async def test_dispatch_message_runs_requests_concurrently(self):
+        """Test dispatched requests run as their own tasks and interleave."""
+        release = asyncio.Event()
+        started = []
+
+        async def slow_completion(websocket, chat_request):
+            started.append(chat_request.request_id)
+            await release.wait()
+
+        self.handler.handle_chat_completion = slow_completion
+
+        first = await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "a", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        second = await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "b", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        await asyncio.sleep(0)
+
+        # Both requests started before either finished
+        assert started == ["a", "b"]
+        release.set()
+        await asyncio.gather(first, second)
+        assert self.handler._active_requests == {}
+
+    @pytest.mark.asyncio
+    async def test_dispatch_message_respects_concurrency_limit(self):
+        """Test requests beyond the per-connection limit wait for a free slot."""
+        handler = WebSocketHandler(self.mock_router, max_concurrent_requests=1)
+        release = asyncio.Event()
+        started = []
+
+        async def slow_completion(websocket, chat_request):
+            started.append(chat_request.request_id)
+            await release.wait()
+
+        handler.handle_chat_completion = slow_completion
+        tasks = [
+            await handler.dispatch_message(self.mock_websocket, json.dumps(
+                {"request_id": request_id, "messages": [{"role": "user", "content": "Hi"}]}
+            ))
+            for request_id in ("a", "b")
+        ]
+        await asyncio.sleep(0)
+        assert started == ["a"]
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert started == ["a", "b"]
+
+    @pytest.mark.asyncio
+    async def test_dispatch_message_rejects_duplicate_and_excess_requests(self):
+        """Test duplicate request ids and requests over the pending limit are rejected."""
+        handler = WebSocketHandler(self.mock_router, max_pending_requests=1)
+        handler.handle_chat_completion = self._never_finishing_completion
+        message = {"request_id": "a", "messages": [{"role": "user", "content": "Hi"}]}
+
+        task = await handler.dispatch_message(self.mock_websocket, json.dumps(message))
+        assert await handler.dispatch_message(self.mock_websocket, json.dumps(message)) is None
+        assert "already in progress" in self._last_frame()["error"]
+
+        message["request_id"] = "b"
+        assert await handler.dispatch_message(self.mock_websocket, json.dumps(message)) is None
+        assert "Too many requests" in self._last_frame()["error"]
+
+        await handler.shutdown()
+        assert task.cancelled()
+
+    @staticmethod
+    async def _never_finishing_completion(websocket, chat_request):
+        """Stand in for a completion that streams until it is cancelled."""
+        await asyncio.Event().wait()
+
+    def _slow_stream(self, words, release):
+        """Build an upstream stand-in that yields words and then waits for release."""
+        class SlowStream:
+            def __init__(self):
+                self.closed = False
+
+            async def __aiter__(self):
+                for word in words:
+                    chunk = MagicMock()
+                    chunk.choices = [MagicMock()]
+                    chunk.choices[0].delta.content = word
+                    yield chunk
+                await release.wait()
+
+            async def close(self):
+                self.closed = True
+
+        return SlowStream()
+
+    @pytest.mark.asyncio
+    async def test_cancel_request_aborts_upstream(self):
+        """Test a client cancel closes the upstream and reports a cancelled status."""
+        stream = self._slow_stream(["Hello", " there"], asyncio.Event())
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=stream)
+
+        task = await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "123", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        while self.mock_websocket.send_text.call_count < 2:
+            await asyncio.sleep(0)
+
+        await self.handler.dispatch_message(
+            self.mock_websocket, json.dumps({"type": "cancel", "request_id": "123"})
+        )
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert task.cancelled()
+        assert stream.closed
+        final_chunk = self._last_frame()
+        assert final_chunk["finished"] is True
+        assert final_chunk["metrics"]["status"] == "cancelled"
+        assert final_chunk["metrics"]["tokens"] == 2
+        assert final_chunk["metrics"]["length"] == len("Hello there")
+
+    @pytest.mark.asyncio
+    async def test_accepted_connection_sends_through_queue(self):
+        """Test frames of an accepted connection are written by the send queue's writer."""
+        self.mock_websocket.scope = {"subprotocols": []}
+        self.mock_websocket.headers = {}
+        self.mock_websocket.accept = AsyncMock()
+        metrics = SendQueueMetrics()
+        handler = WebSocketHandler(self.mock_router, send_queue_metrics=metrics)
+        await handler.accept(self.mock_websocket)
+        assert metrics.connections == 1
+
+        stream = AsyncMock()
+        stream.__aiter__.return_value = [self._chunk("Hello"), self._chunk(" world")]
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=stream)
+        task = await handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "123", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        await task
+        while metrics.queued_frames:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+
+        frames = self._sent_frames()
+        assert "".join(frame["content"] for frame in frames) == "Hello world"
+        assert frames[-1]["finished"] is True
+
+        await handler.shutdown()
+        assert metrics.connections == 0
+
+    @staticmethod
+    def _chunk(text):
+        """Build an upstream chunk carrying a text delta."""
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = text
+        return chunk
+
+    @pytest.mark.asyncio
+    async def test_final_chunk_reports_timings_and_usage(self):
+        """Test the final chunk carries upstream timings and the streamed usage report."""
+        usage_chunk = MagicMock()
+        usage_chunk.choices = []
+        usage_chunk.usage.prompt_tokens = 9
+        usage_chunk.usage.completion_tokens = 2
+        stream = AsyncMock()
+        stream.__aiter__.return_value = [self._chunk("Hello"), self._chunk(" world"), usage_chunk]
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=stream)
+
+        task = await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "123", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        await task
+
+        metrics = self._last_frame()["metrics"]
+        assert metrics["length"] == len("Hello world")
+        assert metrics["promptTokens"] == 9
+        assert metrics["completionTokens"] == 2
+        for key in ("queueWait", "connectTime", "timeToFirstToken", "meanChunkGap", "p95ChunkGap"):
+            assert metrics[key] >= 0
+
+    @pytest.mark.asyncio
+    async def test_rate_limited_request_gets_retry_hint(self):
+        """Test a request over the client's rate limit is rejected with retry_after."""
+        admission = AdmissionController(
+            requests_per_second=0.5,
+            request_burst=1,
+            tokens_per_minute=100000,
+            max_concurrent=4,
+            max_queue=4,
+            queue_timeout=1.0,
+            max_clients=10
+        )
+        handler = WebSocketHandler(self.mock_router, admission=admission)
+        handler.handle_chat_completion = AsyncMock()
+        tasks = [
+            await handler.dispatch_message(self.mock_websocket, json.dumps(
+                {"request_id": request_id, "messages": [{"role": "user", "content": "Hi"}]}
+            ))
+            for request_id in ("a", "b")
+        ]
+        await asyncio.gather(*tasks)
+
+        handler.handle_chat_completion.assert_called_once()
+        error_frame = self._last_frame()
+        assert error_frame["request_id"] == "b"
+        assert "Rate limit" in error_frame["error"]
+        assert 0 < error_frame["retry_after"] <= 2
+        assert admission.gate.active == 0
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_request(self):
+        """Test a request cancelled while waiting for a slot still gets a final chunk."""
+        handler = WebSocketHandler(self.mock_router, max_concurrent_requests=1)
+        handler.handle_chat_completion = self._never_finishing_completion
+        for request_id in ("a", "b"):
+            await handler.dispatch_message(self.mock_websocket, json.dumps(
+                {"request_id": request_id, "messages": [{"role": "user", "content": "Hi"}]}
+            ))
+        await asyncio.sleep(0)
+
+        assert handler.cancel_request("b") is True
+        await asyncio.sleep(0)
+        final_chunk = self._last_frame()
+        assert final_chunk["request_id"] == "b"
+        assert final_chunk["metrics"]["status"] == "cancelled"
+        assert final_chunk["metrics"]["tokens"] == 0
+
+        assert handler.cancel_request("unknown") is False
+        await handler.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_closes_upstream_without_sending(self):
+        """Test a disconnect closes the upstream stream and sends nothing more."""
+        stream = self._slow_stream(["Hello"], asyncio.Event())
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=stream)
+
+        await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "123", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        while self.mock_websocket.send_text.call_count < 1:
+            await asyncio.sleep(0)
+
+        await self.handler.shutdown()
+
+        assert stream.closed
+        assert self.mock_websocket.send_text.call_count == 1
+        assert self.handler._active_requests == {}
+
+    @pytest.mark.asyncio
+    async def test_process_stream_coalesces_deltas(self):
+        """Test back-to-back deltas are sent in fewer frames, first token alone."""
+        chunks = []
+        for word in ["One", " two", " three", " four"]:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = word
+            chunks.append(chunk)
+        mock_stream = AsyncMock()
+        mock_stream.__aiter__.return_value = chunks
+        progress = StreamProgress()
+
+        content = await self.handler._process_stream(
+            self.mock_websocket, "123", mock_stream, progress, CoalesceOptions(window_ms=500)
+        )
+
+        assert content == "One two three four"
+        assert progress.tokens == 4
+        sent = [frame["content"] for frame in self._sent_frames()]
+        assert sent == ["One", " two three four"]
+
+    @pytest.mark.asyncio
+    async def test_process_stream_coalescing_disabled_per_request(self):
+        """Test a request can opt out of coalescing with a window of 0."""
+        chunks = []
+        for word in ["One", " two", " three"]:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = word
+            chunks.append(chunk)
+        mock_stream = AsyncMock()
+        mock_stream.__aiter__.return_value = chunks
+
+        await self.handler._process_stream(
+            self.mock_websocket, "123", mock_stream, coalesce=CoalesceOptions(window_ms=0)
+        )
+
+        assert self.mock_websocket.send_text.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_completion_cache_miss_then_hit(self):
+        """Test a completed response is cached and then replayed without the upstream."""
+        cache = CompletionCache(":memory:", ttl_seconds=60, max_entries=10)
+        handler = WebSocketHandler(self.mock_router, completion_cache=cache)
+        chunks = []
+        for word in ["Cached", " answer"]:
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = word
+            chunks.append(chunk)
+        mock_stream = AsyncMock()
+        mock_stream.__aiter__.return_value = chunks
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=mock_stream)
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            messages=[ChatMessage(role="user", content="Hello")],
+            temperature=0
+        )
+
+        assert await handler.handle_chat_completion(self.mock_websocket, chat_request) == "Cached answer"
+        assert self._last_frame()["metrics"]["cached"] is False
+
+        self.mock_websocket.send_text.reset_mock()
+        assert await handler.handle_chat_completion(self.mock_websocket, chat_request) == "Cached answer"
+
+        self.mock_router.generate_chat_completion.assert_called_once()
+        frames = self._sent_frames()
+        assert "".join(frame["content"] for frame in frames) == "Cached answer"
+        assert frames[-1]["metrics"]["cached"] is True
+        assert frames[-1]["metrics"]["tokens"] == 2
+
+    @pytest.mark.asyncio
+    async def test_non_streamed_request_gets_the_whole_response(self):
+        """Test stream=False asks the upstream for one response, cached as one delta."""
+        cache = CompletionCache(":memory:", ttl_seconds=60, max_entries=10)
+        handler = WebSocketHandler(self.mock_router, completion_cache=cache)
+        completion = MagicMock()
+        completion.choices = [MagicMock()]
+        completion.choices[0].message.content = "Whole answer"
+        completion.usage.prompt_tokens = 4
+        completion.usage.completion_tokens = 2
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=completion)
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            messages=[ChatMessage(role="user", content="Hello")],
+            temperature=0,
+            stream=False
+        )
+
+        assert await handler.handle_chat_completion(self.mock_websocket, chat_request) == "Whole answer"
+        assert self.mock_router.generate_chat_completion.call_args.kwargs["stream"] is False
+        frames = self._sent_frames()
+        assert [frame["content"] for frame in frames] == ["Whole answer", ""]
+        assert frames[-1]["metrics"]["completionTokens"] == 2
+        assert await cache.get(handler._get_cache_key(chat_request, [{"role": "user", "content": "Hello"}])) == [
+            "Whole answer"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_completion_cache_bypassed_per_request(self):
+        """Test a request can opt out of the cache."""
+        cache = CompletionCache(":memory:", ttl_seconds=60, max_entries=10)
+        await cache.set("unused", ["x"])
+        handler = WebSocketHandler(self.mock_router, completion_cache=cache)
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            messages=[ChatMessage(role="user", content="Hello")],
+            cache=False
+        )
+        assert handler._get_cache_key(chat_request, []) is None
+        assert WebSocketHandler(self.mock_router)._get_cache_key(chat_request, []) is None
+
+    def test_completion_cache_only_keeps_sampled_requests_on_opt_in(self):
+        """Test requests above temperature 0 are cached only when the client asks for it."""
+        handler = WebSocketHandler(
+            self.mock_router, completion_cache=CompletionCache(":memory:", ttl_seconds=60, max_entries=10)
+        )
+        messages = [ChatMessage(role="user", content="Hello")]
+
+        sampled = ChatCompletionRequest(request_id="1", messages=messages, temperature=0.7)
+        assert handler._get_cache_key(sampled, []) is None
+        opted_in = ChatCompletionRequest(request_id="2", messages=messages, temperature=0.7, cache=True)
+        assert handler._get_cache_key(opted_in, []) is not None
+        deterministic = ChatCompletionRequest(request_id="3", messages=messages, temperature=0)
+        assert handler._get_cache_key(deterministic, []) is not None
+
+    @pytest.mark.asyncio
+    async def test_identical_deterministic_requests_share_upstream(self):
+        """Test concurrent identical requests at temperature 0 open one upstream stream."""
+        single_flight = SingleFlightGroup()
+        handler = WebSocketHandler(self.mock_router, single_flight=single_flight)
+        release = asyncio.Event()
+
+        class GatedStream:
+            async def __aiter__(self):
+                for word in ["Shared", " answer"]:
+                    await release.wait()
+                    chunk = MagicMock()
+                    chunk.choices = [MagicMock()]
+                    chunk.choices[0].delta.content = word
+                    yield chunk
+
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=GatedStream())
+        requests = [
+            ChatCompletionRequest(
+                request_id=request_id,
+                messages=[ChatMessage(role="user", content="Hello")],
+                temperature=0
+            )
+            for request_id in ("a", "b")
+        ]
+
+        tasks = [
+            asyncio.create_task(handler.handle_chat_completion(self.mock_websocket, request))
+            for request in requests
+        ]
+        await asyncio.sleep(0.01)
+        release.set()
+
+        assert await asyncio.gather(*tasks) == ["Shared answer", "Shared answer"]
+        self.mock_router.generate_chat_completion.assert_called_once()
+        finals = [frame for frame in self._sent_frames() if frame["finished"]]
+        assert sorted(frame["request_id"] for frame in finals) == ["a", "b"]
+        assert all(frame["metrics"]["tokens"] == 2 for frame in finals)
+
+    @pytest.mark.asyncio
+    async def test_conversation_sends_only_new_messages(self):
+        """Test a conversation turn is sent upstream with the stored history."""
+        store = ConversationStore(":memory:", idle_ttl_seconds=60, max_bytes=1024)
+        store.open()
+        handler = WebSocketHandler(self.mock_router, conversation_store=store)
+
+        def reply(text):
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            stream = AsyncMock()
+            stream.__aiter__.return_value = [chunk]
+            return stream
+
+        self.mock_router.generate_chat_completion = AsyncMock(
+            side_effect=[reply("Hi!"), reply("Fine.")]
+        )
+        await handler.handle_chat_completion(
+            self.mock_websocket,
+            ChatCompletionRequest(
+                request_id="1",
+                new_conversation=True,
+                messages=[ChatMessage(role="user", content="Hello")]
+            )
+        )
+        conversation_id = self._last_frame()["metrics"]["conversationId"]
+        await handler.handle_chat_completion(
+            self.mock_websocket,
+            ChatCompletionRequest(
+                request_id="2",
+                conversation_id=conversation_id,
+                messages=[ChatMessage(role="user", content="How are you?")]
+            )
+        )
+
+        second_call = self.mock_router.generate_chat_completion.call_args_list[1]
+        assert second_call.kwargs["messages"] == [
+            {"role": "user", "content": "Hello"},
+            {"role": "assistant", "content": "Hi!"},
+            {"role": "user", "content": "How are you?"},
+        ]
+        assert len(await store.get_history(conversation_id)) == 4
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_conversation_rejects_unknown_ids(self):
+        """Test an id the server did not issue is rejected instead of starting a conversation."""
+        store = ConversationStore(":memory:", idle_ttl_seconds=60, max_bytes=1024)
+        store.open()
+        handler = WebSocketHandler(self.mock_router, conversation_store=store)
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            conversation_id="chat",
+            messages=[ChatMessage(role="user", content="Hello")]
+        )
+        with pytest.raises(ValueError, match="Unknown or expired conversation"):
+            await handler.handle_chat_completion(self.mock_websocket, chat_request)
+        assert await store.get_history("chat") is None
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_conversation_requires_store(self):
+        """Test a conversation_id is rejected when no store is enabled."""
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            conversation_id="chat",
+            messages=[ChatMessage(role="user", content="Hello")]
+        )
+        with pytest.raises(ValueError, match="not enabled"):
+            await self.handler.handle_chat_completion(self.mock_websocket, chat_request)
+
+    @pytest.mark.asyncio
+    async def test_request_is_fitted_to_context_before_sending(self):
+        """Test pins are stripped and max_tokens is fitted before the upstream call."""
+        handler = WebSocketHandler(
+            self.mock_router,
+            token_budget=TokenBudget(reserved_completion_tokens=1024, cache_size=100, offload_chars=10000)
+        )
+        mock_stream = AsyncMock()
+        mock_stream.__aiter__.return_value = []
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=mock_stream)
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            messages=[
+                ChatMessage(role="system", content="Be brief", pinned=True),
+                ChatMessage(role="user", content="Hello")
+            ],
+            max_tokens=1000000
+        )
+
+        await handler.handle_chat_completion(self.mock_websocket, chat_request)
+
+        call = self.mock_router.generate_chat_completion.call_args
+        assert call.kwargs["messages"] == [
+            {"role": "system", "content": "Be brief"},
+            {"role": "user", "content": "Hello"},
+        ]
+        assert call.kwargs["max_tokens"] == 16384
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.websocket.settings.STREAM_INTER_TOKEN_TIMEOUT', 0.05)
+    async def test_stalled_stream_reports_an_error(self):
+        """Test a stream that stops mid-answer is closed and reported to the client."""
+        stream = self._slow_stream(["Hello"], asyncio.Event())
+        self.mock_router.generate_chat_completion = AsyncMock(return_value=stream)
+
+        task = await self.handler.dispatch_message(self.mock_websocket, json.dumps(
+            {"request_id": "123", "messages": [{"role": "user", "content": "Hi"}]}
+        ))
+        await task
+
+        assert stream.closed
+        frames = self._sent_frames()
+        assert frames[0]["content"] == "Hello"
+        assert frames[-1]["request_id"] == "123"
+        assert "stalled" in frames[-1]["error"]
+
+    @pytest.mark.asyncio
+    @patch('src.handlers.websocket.settings.STREAM_FIRST_TOKEN_TIMEOUT', 0.05)
+    async def test_late_first_token_is_hedged(self):
+        """Test a second upstream request is raced against a slow first token."""
+        slow = self._slow_stream([], asyncio.Event())
+        fast = AsyncMock()
+        chunk = MagicMock()
+        chunk.choices = [MagicMock()]
+        chunk.choices[0].delta.content = "Hedged"
+        fast.__aiter__.return_value = [chunk]
+        self.mock_router.generate_chat_completion = AsyncMock(side_effect=[slow, fast])
+        chat_request = ChatCompletionRequest(
+            request_id="123",
+            messages=[ChatMessage(role="user", content="Hello")]
+        )
+
+        assert await self.handler.handle_chat_completion(self.mock_websocket, chat_request) == "Hedged"
+        assert self.mock_router.generate_chat_completion.call_count == 2
+        assert slow.closed